@@ -1,26 +1,198 @@
 import json
-import requests
+import threading
 from traceback import format_exc
 from datetime import datetime, timedelta
-from misc import get_rt_price, join_url, get_mkt_code, calc_buy_count, delay_seconds
-from lofig import logger
+from concurrent.futures import ThreadPoolExecutor
+from misc import get_rt_price, get_rt_prices, join_url, get_mkt_code, calc_buy_count, delay_seconds
+from lofig import logger, Config
+from transport import transport
+from syncstate import sync_state
+from dealstore import deal_store
+from uploader import deal_uploader
+from events import event_hub
+
+
+class IndexedList(list):
+    """带索引的list, 保持插入顺序, 可以像list一样遍历和序列化
+    子类通过keyof指定索引键, 相同键只索引第一个元素
+    """
+    def __init__(self, items=()):
+        super().__init__(items)
+        self.reindex()
+
+    @staticmethod
+    def keyof(item):
+        raise NotImplementedError
+
+    def __reduce__(self):
+        # list的反序列化会在__init__之前调用append/extend, 改为用元素列表重新构造
+        return (self.__class__, (list(self),))
+
+    def reindex(self):
+        self.index_map = {}
+        self.duplicates = 0
+        for x in self:
+            self.index_item(x)
+
+    def index_item(self, item):
+        key = self.keyof(item)
+        if key in self.index_map:
+            self.duplicates += 1
+        else:
+            self.index_map[key] = item
+
+    def get(self, key):
+        return self.index_map.get(key)
+
+    def has(self, key):
+        return key in self.index_map
+
+    def append(self, item):
+        super().append(item)
+        self.index_item(item)
+
+    def extend(self, items):
+        for x in items:
+            self.append(x)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def remove(self, item):
+        super().remove(item)
+        if self.duplicates:
+            # 有重复键时需要找到同键的下一个元素
+            self.reindex()
+        elif self.index_map.get(self.keyof(item)) is item:
+            del self.index_map[self.keyof(item)]
+
+    # 以下操作较少使用, 修改后重建索引
+    def insert(self, i, item):
+        super().insert(i, item)
+        self.reindex()
+
+    def pop(self, i=-1):
+        item = super().pop(i)
+        self.reindex()
+        return item
+
+    def clear(self):
+        super().clear()
+        self.index_map = {}
+        self.duplicates = 0
+
+    def __setitem__(self, i, item):
+        super().__setitem__(i, item)
+        self.reindex()
+
+    def __delitem__(self, i):
+        super().__delitem__(i)
+        self.reindex()
+
+
+class PositionList(IndexedList):
+    """按股票代码索引的持仓列表"""
+    @staticmethod
+    def keyof(stock):
+        return stock['code']
+
+
+class TradingRecordList(IndexedList):
+    """按(code, tradeType, sid)索引的已提交委托"""
+    @staticmethod
+    def keyof(record):
+        return (record.get('code'), record.get('tradeType'), record.get('sid'))
+
+
+class BuyDetailList(IndexedList):
+    """按(sid, date, type)索引的买卖明细"""
+    @staticmethod
+    def keyof(detail):
+        return (detail.get('sid'), detail.get('date'), detail.get('type'))
+
+    @classmethod
+    def of(self, details):
+        if isinstance(details, BuyDetailList) or not isinstance(details, list):
+            return details
+        return BuyDetailList(details)
 
 
 class Account():
+    # 分页查询每页条数, 券商默认20, 更大的值需确认券商接受
+    page_size = str(Config.trade_config().get('deals_page_size', 20))
+
     def __init__(self):
         self.keyword = None
-        self.stocks = []
+        self.stocks = PositionList()
         self.fundcode = '511880'
         self.hacc = None
         self.pure_assets = 0.0
         self.available_money = 0.0
         self.trading_records = []
         self.today_deals = None
+        self.order_date = None
+        self.order_states = {}
+        self.order_deals = {}
         self.buy_jylx = ''
         self.sell_jylx = ''
+        self._loader = None
+
+    @property
+    def loader(self):
+        # 账户所属的登录, 未指定时为默认登录accld
+        return self._loader or accld
+
+    @loader.setter
+    def loader(self, loader):
+        self._loader = loader
+
+    @property
+    def login(self):
+        return self._loader.name if self._loader else None
+
+    @property
+    def uid(self):
+        # 本地存储和上传队列中的账户标识, 非默认登录加上登录名前缀
+        return f'{self.login}/{self.keyword}' if self.login else self.keyword
+
+    def notify(self, etype, data):
+        # 推送账户变化给订阅的客户端
+        event_hub.publish(etype, {'account': self.keyword, **data}, self.login)
+
+    @staticmethod
+    def stock_view(stock):
+        return {k: v for k, v in stock.items() if k not in ('buydetail', 'buydetail_full', 'strategies')}
+
+    def notify_stocks(self, codes=None):
+        stocks = self.stocks if codes is None else [s for s in (self.get_stock(c) for c in codes) if s]
+        self.notify('positions', {'stocks': [self.stock_view(s) for s in stocks], 'full': codes is None})
+
+    def notify_assets(self):
+        self.notify('assets', {'assets': {'pure_assets': self.pure_assets, 'available_money': self.available_money, 'account_type': self.keyword}})
+
+    @property
+    def stocks(self):
+        return self._stocks
+
+    @property
+    def trading_records(self):
+        return self._trading_records
+
+    @trading_records.setter
+    def trading_records(self, records):
+        self._trading_records = records if isinstance(records, TradingRecordList) else TradingRecordList(records)
+
+    @stocks.setter
+    def stocks(self, stocks):
+        self._stocks = stocks if isinstance(stocks, PositionList) else PositionList(stocks)
+
+    def pending_orders(self):
+        # 已提交未成交的委托
+        return self.trading_records
 
     def get_stock(self, code):
-        return next((s for s in self.stocks if s['code'] == code), None)
+        return self.stocks.get(code)
 
     @property
     def hold_account(self):
@@ -30,15 +202,27 @@ class Account():
 
     @property
     def jysession(self):
-        return accld.jywg.session if accld.jywg else None
+        return self.loader.jywg.session if self.loader.jywg else None
 
     @property
     def wgdomain(self):
-        return accld.jywg.jywg if accld.jywg else None
+        return self.loader.jywg.jywg if self.loader.jywg else None
 
     @property
     def valkey(self):
-        return accld.jywg.validate_key if accld.jywg else None
+        return self.loader.jywg.validate_key if self.loader.jywg else None
+
+    @staticmethod
+    def own_buydetail(stock, key, details=None):
+        """把stock[key]设为BuyDetailList, strategies中引用同一列表时一起替换, 两处始终是同一个对象"""
+        if details is None:
+            details = stock.get(key, [])
+        wrapped = BuyDetailList.of(details)
+        stock[key] = wrapped
+        strgrp = stock.get('strategies')
+        if isinstance(strgrp, dict) and strgrp.get(key) is details:
+            strgrp[key] = wrapped
+        return wrapped
 
     @staticmethod
     def extend_buydetail(buydetail, exdetail):
@@ -46,12 +230,18 @@ class Account():
             return 0
         if not isinstance(exdetail, list):
             return 0
+        if isinstance(buydetail, BuyDetailList):
+            keys = buydetail.index_map
+        else:
+            keys = {BuyDetailList.keyof(x) for x in buydetail}
         cnt = 0
         for bd in exdetail:
-            exbd = next((x for x in buydetail if x['sid'] == bd['sid'] and x['date'] == bd['date'] and x['type'] == bd['type']), None)
-            if exbd:
+            key = BuyDetailList.keyof(bd)
+            if key in keys:
                 continue
             buydetail.append(bd)
+            if not isinstance(buydetail, BuyDetailList):
+                keys.add(key)
             cnt += 1
         return cnt
 
@@ -61,24 +251,22 @@ class Account():
             self.add_watch_stock(code, {'buydetail': exdetail, 'buydetail_full': exdetail})
             return
 
-        if 'buydetail_full' not in stock:
-            stock['buydetail_full'] = []
-        ecnt = self.extend_buydetail(stock['buydetail_full'], exdetail)
+        ecnt = self.extend_buydetail(self.own_buydetail(stock, 'buydetail_full'), exdetail)
         if ecnt == 0:
             return
-        if 'buydetail' not in stock:
-            stock['buydetail'] = []
-        self.extend_buydetail(stock['buydetail'], exdetail)
+        self.extend_buydetail(self.own_buydetail(stock, 'buydetail'), exdetail)
 
-    def load_watchings(self):
-        if not accld.fha or not accld.fha.get('headers', None):
+    def fetch_watchings(self):
+        if not self.loader.fha or not self.loader.fha.get('headers', None):
             logger.warning('loadWatchings no fha server configured')
-            return
+            return None
 
-        wurl = join_url(accld.fha['server'], 'stock?act=watchings&acc=' + self.keyword)
-        r = requests.get(wurl, headers=accld.fha['headers'])
+        wurl = join_url(self.loader.fha['server'], 'stock?act=watchings&acc=' + self.keyword)
+        r = transport.get(wurl, headers=self.loader.fha['headers'])
         r.raise_for_status()
-        watchings = r.json()
+        return r.json()
+
+    def apply_watchings(self, watchings):
         if not watchings:
             logger.info('%s loadWatchings no watchings', self.keyword)
             return
@@ -86,6 +274,9 @@ class Account():
         for code, stk in watchings.items():
             self.add_watch_stock(code[-6:], stk.get('strategies', None))
 
+    def load_watchings(self):
+        self.apply_watchings(self.fetch_watchings())
+
     def add_watch_stock(self, code, strgrp):
         stock = self.get_stock(code)
         if stock:
@@ -93,9 +284,9 @@ class Account():
             if stock['holdCount'] == 0 or not osg:
                 stock['strategies'] = strgrp
                 if 'buydetail' in strgrp:
-                    stock['buydetail'] = strgrp['buydetail']
+                    self.own_buydetail(stock, 'buydetail', strgrp['buydetail'])
                 if 'buydetail_full' in strgrp:
-                    stock['buydetail_full'] = strgrp['buydetail_full']
+                    self.own_buydetail(stock, 'buydetail_full', strgrp['buydetail_full'])
                 return
 
             mxkeyid = 0
@@ -114,54 +305,58 @@ class Account():
                 stock['strategies']['amount'] = strgrp['amount']
 
             if 'buydetail' in strgrp:
-                self.extend_buydetail(stock['buydetail'], strgrp['buydetail'])
+                self.extend_buydetail(self.own_buydetail(stock, 'buydetail'), strgrp['buydetail'])
             if 'buydetail_full' in strgrp:
-                self.extend_buydetail(stock['buydetail_full'], strgrp['buydetail_full'])
+                self.extend_buydetail(self.own_buydetail(stock, 'buydetail_full'), strgrp['buydetail_full'])
             return
 
         count = sum([int(b['count']) for b in strgrp.get('buydetail', [])])
-        self.stocks.append({
-            'code': code, 'name': '', 'holdCount': count, 'availableCount': count,
-            'strategies': strgrp, 'buydetail': strgrp.get('buydetail', []),
-            'buydetail_full': strgrp.get('buydetail_full', [])
-        })
+        stock = {'code': code, 'name': '', 'holdCount': count, 'availableCount': count, 'strategies': strgrp}
+        self.own_buydetail(stock, 'buydetail', strgrp.get('buydetail', []))
+        self.own_buydetail(stock, 'buydetail_full', strgrp.get('buydetail_full', []))
+        self.stocks.append(stock)
 
     @property
     def order_url(self):
         pass
 
-    def fetch_batches_deal_data(self, url, data):
-        has_more_data = True
-        orders = []
+    def iter_batches_deal_data(self, url, data):
+        """分页查询, 拿到翻页游标后立即发出下一页请求, 当前页的数据边处理边返回"""
+        def fetch(pdata):
+            r = self.jysession.post(url, data=pdata)
+            r.raise_for_status()
+            return r.json()
 
-        try:
-            while has_more_data:
-                r = self.jysession.post(url, data=data)
-                r.raise_for_status()
-                deals = r.json()
-                if deals['Status'] != 0:
-                    logger.error('查询订单失败: %s', deals['Message'])
-                    break
-                if not deals['Data'] or len(deals['Data']) == 0:
-                    logger.info('no orders found')
-                    break
-                orders.extend(deals['Data'])
-                if 'Dwc' in deals['Data'][-1]:
-                    data['dwc'] = deals['Data'][-1]['Dwc']
-                if not deals['Data'][-1]['Dwc'] or len(deals['Data']) < int(data['qqhs']):
-                    has_more_data = False
-        except Exception as e:
-            logger.error('查询订单失败: %s', str(e))
-            logger.debug(format_exc())
-        finally:
-            pass
-        return orders
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch, dict(data))
+            while future:
+                try:
+                    deals = future.result()
+                    future = None
+                    if deals['Status'] != 0:
+                        logger.error('查询订单失败: %s', deals['Message'])
+                        return
+                    if not deals['Data'] or len(deals['Data']) == 0:
+                        logger.info('no orders found')
+                        return
+                    if 'Dwc' in deals['Data'][-1]:
+                        data['dwc'] = deals['Data'][-1]['Dwc']
+                    if deals['Data'][-1]['Dwc'] and len(deals['Data']) >= int(data['qqhs']):
+                        future = executor.submit(fetch, dict(data))
+                except Exception as e:
+                    logger.error('查询订单失败: %s', str(e))
+                    logger.debug(format_exc())
+                    return
+                yield from deals['Data']
+
+    def fetch_batches_deal_data(self, url, data):
+        return list(self.iter_batches_deal_data(url, data))
 
     def get_orders(self):
         # 查询当日订单
         url = self.order_url
         data = {
-            'qqhs': '20',
+            'qqhs': self.page_size,
             'dwc': ''
         }
         return self.fetch_batches_deal_data(url, data)
@@ -205,33 +400,69 @@ class Account():
             } for buydetail in buydetails
         ]
 
+    @staticmethod
+    def order_state(order):
+        status = order.get('Wtzt', None)
+        final = status in ['已成', '已撤', '废单', '部撤'] or (status in ['部成'] and delay_seconds('15:00') < 0)
+        return status, order.get('Cjsl', None), final
+
+    @staticmethod
+    def order_key(order):
+        # 没有委托编号的记录用成交内容作为稳定的键
+        sid = order.get('Wtbh', None)
+        if sid is not None:
+            return sid
+        return (order.get('Zqdm'), order.get('Mmsm'), order.get('Wtsj'), order.get('Cjsl'), order.get('Cjjg'))
+
+    def reset_orders(self, date):
+        self.order_date = date
+        self.order_states = {}
+        self.order_deals = {}
+
     def check_orders(self):
+        # 记录每个委托上次的状态和成交数量, 只处理状态有变化的委托
         data = self.get_orders()
         date = datetime.now().strftime('%Y-%m-%d')
+        if self.order_date != date:
+            self.reset_orders(date)
+
         sdeals = {}
+        skeys = {}
         for d in data:
+            sid = d.get('Wtbh', None)
+            state = self.order_state(d)
+            okey = self.order_key(d)
+            if self.order_states.get(okey) == state:
+                continue
+            self.order_states[okey] = state
+
             code = d.get('Zqdm', None)
             mmsm = d.get('Mmsm', None)
-            status = d.get('Wtzt', None)
+            status, _, final = state
             bstype = self.tradeType_from_Mmsm(mmsm)
-            if (status in ['已成', '已撤', '废单', '部撤'] or (status in ['部成'] and delay_seconds('15:00') < 0)) and bstype:
+            if final and bstype:
+                # 已撤、废单等没有成交的委托也已结束, 不再算作未成交委托
+                record = self.trading_records.get((code, bstype, sid))
+                if record:
+                    self.trading_records.remove(record)
                 count = int(d.get('Cjsl', 0))
                 if count == 0:
                     logger.info('%s ignore deal %s %s', self.keyword, mmsm, d.get('Zqmc', ''))
                     continue
-                if code not in sdeals:
-                    sdeals[code] = []
-                sdeals[code].append({
+                deal = {
                     'code': code,
                     'price': float(d.get('Cjjg', 0)),
                     'count': count,
-                    'sid': d.get('Wtbh', None),
+                    'sid': sid,
                     'tradeType': bstype,
                     'time': date
-                })
-                record = next((x for x in self.trading_records if x['code'] == code and x['tradeType'] == bstype and x['sid'] == d.get('Wtbh', None)), None)
-                if record:
-                    self.trading_records.remove(record)
+                }
+                self.order_deals[okey] = deal
+                if code not in sdeals:
+                    sdeals[code] = []
+                    skeys[code] = []
+                sdeals[code].append(deal)
+                skeys[code].append(okey)
             elif status in ['已报'] and mmsm in ['配售申购']:
                 logger.info('%s ignore deal %s %s', self.keyword, mmsm, d.get('Zqmc', ''))
                 continue
@@ -239,15 +470,26 @@ class Account():
                 logger.info('%s imcomplete deal %s %s %s', self.keyword, d.get('Zqmc', ''), status, mmsm)
                 continue
             elif status in ['已确认'] and mmsm in ['担保品划入', '担保品划出']:
-                accld.create_deals_for_transfer(d)
+                self.loader.create_deals_for_transfer(d)
                 continue
             else:
                 logger.info('%s unknown deal type/status: %s', self.keyword, d)
 
+        # 只用新增成交更新持仓
         for code, deals in sdeals.items():
             self.extend_stock_buydetail(code, self.deals_to_buydetail(deals))
 
-        return sdeals
+        if sdeals:
+            deal_store.save_orders(self.uid, [d for deals in sdeals.values() for d in deals], keys=[k for keys in skeys.values() for k in keys])
+            self.notify('deals', {'deals': sdeals})
+            self.notify_stocks(list(sdeals.keys()))
+
+        # 返回当日全部成交
+        alldeals = {}
+        for deal in self.order_deals.values():
+            alldeals.setdefault(deal['code'], []).append(deal)
+        self.today_deals = alldeals
+        return alldeals
 
     def archive_deals(self, codes):
         if not codes:
@@ -276,7 +518,7 @@ class Account():
                 if scount > 0:
                     logger.error('sell count not archived %s %s', c, buydetail)
                     continue
-                stk['buydetail'] = sorted([b for b in buyrecs if b['count'] > 0], key=lambda x: x['date'])
+                stk['buydetail'] = BuyDetailList(sorted([b for b in buyrecs if b['count'] > 0], key=lambda x: x['date']))
                 stk['holdCount'] = sum([b['count'] for b in stk['buydetail']])
                 stk['availableCount'] = stk['holdCount']
 
@@ -292,43 +534,28 @@ class Account():
         updeals = []
         for c,d in deals.items():
             updeals.extend(d)
-        self._upload_deals(updeals)
+        self._upload_deals(updeals, wait=False)
 
-    def _upload_deals(self, deals, max_retry=3):
+    def _upload_deals(self, deals, wait=True):
+        # 加入上传队列, wait为True时立即上传该账户队列中的成交并返回结果, 否则由后台批量上传
         if len(deals) == 0:
-            return
+            return True
 
-        if not accld.fha or not accld.fha.get('headers', None):
+        if not self.loader.fha or not self.loader.fha.get('headers', None):
             logger.warning('uploadDeals no fha server configured')
-            return
+            return False
 
         deals = [{
             **{k:v for k,v in d.items() if k != 'code'},
             'code': get_mkt_code(d['code']) + d['code'] if d['code'] else ''
         } for d in deals]
 
-        url = join_url(accld.fha['server'], 'stock')
-        data = {
-            'act': 'deals',
-            'acc': self.keyword,
-            'data': json.dumps(deals)
-        }
         logger.info('%s uploadDeals %s', self.keyword, deals)
-        retry = 0
-        while retry < max_retry:
-            try:
-                r = requests.post(url, headers=accld.fha['headers'], data=data)
-                r.raise_for_status()
-                if r.status_code == 200:
-                    logger.info('%s uploadDeals success', self.keyword)
-                    return
-                else:
-                    logger.error('%s uploadDeals failed: %s', self.keyword, r.text)
-            except Exception as e:
-                logger.error('%s uploadDeals error (try %d): %s', self.keyword, retry + 1, e)
-                logger.debug(format_exc())
-            retry += 1
-        logger.error('%s uploadDeals failed after %d retries', self.keyword, max_retry)
+        # 立即上传的成交(如历史成交回补)在队列满时也不丢弃
+        deal_uploader.enqueue(self.uid, deals, droppable=not wait)
+        if not wait:
+            return True
+        return deal_uploader.flush(self.uid, self.loader.fha)
 
     @property
     def datestr_fmt(self):
@@ -343,8 +570,8 @@ class Account():
         # 交割单查询 Stock Exchange List
         pass
 
-    def get_history_deals(self, url, date):
-        # 查询date至今所有订单
+    def history_date_sections(self, date):
+        # 券商查询区间最长90天, 按89天分段
         datesections = []
         if isinstance(date, str):
             date = datetime.strptime(date, '%Y-%m-%d')
@@ -355,18 +582,43 @@ class Account():
             if edate > now:
                 break
             date = edate + timedelta(days=1)
+        return datesections
 
-        deals = []
-        for st, et in datesections:
-            data = {
-                'st': st,
-                'et': et,
-                'qqhs': '20',
-                'dwc': ''
-            }
+    def history_query_data(self, st, et):
+        return {
+            'st': st,
+            'et': et,
+            'qqhs': self.page_size,
+            'dwc': ''
+        }
+
+    def fetch_history_sections(self, url, datesections):
+        # 各时间段相互独立, 用有界线程池并发查询, 结果按时间段顺序返回
+        workers = min(len(datesections), Config.trade_config().get('history_workers', 4))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.fetch_batches_deal_data, url, self.history_query_data(st, et)) for st, et in datesections]
+            for future in futures:
+                yield future.result()
+
+    def iter_history_deals(self, url, datesections):
+        if len(datesections) == 1:
+            # 只有一个时间段时边翻页边返回
+            st, et = datesections[0]
+            yield from self.iter_batches_deal_data(url, self.history_query_data(st, et))
+            return
+
+        for deals in self.fetch_history_sections(url, datesections):
+            yield from deals
 
-            deals.extend(self.fetch_batches_deal_data(url, data))
+    def get_history_deals(self, url, date, stream=False):
+        # 查询date至今所有订单, stream为True时返回生成器, 边查询边返回
+        datesections = self.history_date_sections(date)
+        if stream:
+            return self.iter_history_deals(url, datesections)
 
+        deals = []
+        for sdeals in self.fetch_history_sections(url, datesections):
+            deals.extend(sdeals)
         return deals
 
     @staticmethod
@@ -381,7 +633,23 @@ class Account():
 
     def load_his_deals(self, date):
         # 查询date至今所有历史订单(买卖订单)
-        hdeals = self.get_history_deals(self.hisdeals_url, date)
+        hdeals = self.get_history_deals(self.hisdeals_url, date, stream=True)
+        deals = self.parse_his_deals(hdeals)
+        deal_store.save_deals(self.uid, deals)
+        self._upload_deals(deals)
+
+    def sync_his_deals(self, date):
+        # 增量同步历史订单, 只上传同步水位之后的成交
+        date = sync_state.since_date(self.uid, 'deals', date)
+        hdeals = self.get_history_deals(self.hisdeals_url, date, stream=True)
+        deals = self.parse_his_deals(hdeals)
+        deal_store.save_deals(self.uid, deals)
+        deals = sync_state.filter_new(self.uid, 'deals', deals)
+        logger.info('%s sync history deals since %s, %d new', self.keyword, date, len(deals))
+        if len(deals) > 0 and self._upload_deals(deals):
+            sync_state.advance(self.uid, 'deals', deals)
+
+    def parse_his_deals(self, hdeals):
         fetchedDeals = []
         for deali in hdeals:
             tradeType = self.tradeType_from_Mmsm(deali['Mmsm'])
@@ -405,7 +673,7 @@ class Account():
                 'feeYh': float(deali.get('Yhs', 0)), 'feeGh': float(deali.get('Ghf', 0))
             })
 
-        self._upload_deals(fetchedDeals)
+        return fetchedDeals
 
     def merge_cum_deals(self, deals):
         # 合并时间相同的融资利息
@@ -420,7 +688,28 @@ class Account():
 
     def load_other_deals(self, date):
         # 查询date至今所有其它订单(非买卖订单)
-        hdeals = self.get_history_deals(self.hissxl_url, date)
+        hdeals = self.get_history_deals(self.hissxl_url, date, stream=True)
+        fetchedDeals, deals_no_code = self.parse_other_deals(hdeals)
+        deal_store.save_deals(self.uid, fetchedDeals + deals_no_code)
+        self._upload_deals(fetchedDeals, wait=False)
+        if len(deals_no_code) > 0:
+            logger.info('deals no code: %s', deals_no_code)
+            self._upload_deals(deals_no_code)
+
+    def sync_other_deals(self, date):
+        # 增量同步其它订单, 只上传同步水位之后的记录
+        date = sync_state.since_date(self.uid, 'others', date)
+        hdeals = self.get_history_deals(self.hissxl_url, date, stream=True)
+        fetchedDeals, deals_no_code = self.parse_other_deals(hdeals)
+        deal_store.save_deals(self.uid, fetchedDeals + deals_no_code)
+        fetchedDeals = sync_state.filter_new(self.uid, 'others', fetchedDeals)
+        deals_no_code = sync_state.filter_new(self.uid, 'others', deals_no_code)
+        logger.info('%s sync other deals since %s, %d new', self.keyword, date, len(fetchedDeals) + len(deals_no_code))
+        if not self._upload_deals(fetchedDeals + deals_no_code):
+            return
+        sync_state.advance(self.uid, 'others', fetchedDeals + deals_no_code)
+
+    def parse_other_deals(self, hdeals):
         fetchedDeals = []
         dealsTobeCum = []
         ignoredSm = ['融资买入', '融资借入', '偿还融资负债本金', '担保品卖出', '担保品买入', '担保物转入', '担保物转出', '融券回购', '融券购回', '证券卖出', '证券买入', '配股权证', '配股缴款']
@@ -487,10 +776,7 @@ class Account():
             ndeals = self.merge_cum_deals(dealsTobeCum)
             fetchedDeals.extend(ndeals)
 
-        self._upload_deals(fetchedDeals)
-        if len(deals_no_code) > 0:
-            logger.info('deals no code: %s', deals_no_code)
-            self._upload_deals(deals_no_code)
+        return fetchedDeals, deals_no_code
 
     def buy_fund_before_close(self):
         pass
@@ -540,6 +826,8 @@ class Account():
                 stock.update(stocki)
             else:
                 self.stocks.append(stocki)
+        deal_store.save_positions(self.uid, self.stocks)
+        self.notify_stocks()
 
     def get_count_form_data(self, code, price, tradeType):
         fd = {
@@ -585,7 +873,8 @@ class Account():
     def trade_url(self):
         pass
 
-    def trade(self, code, price, count, bstype):
+    def trade(self, code, price, count, bstype, rp=None):
+        # rp为批量下单时预先获取的实时价格
         if bstype == 'B' and self.available_money < 1000:
             s = self.get_assets()
             self.on_assets_loaded(s)
@@ -598,7 +887,7 @@ class Account():
             return
 
         if price == 0:
-            rp = get_rt_price(code)
+            rp = rp or get_rt_price(code)
             price = rp['price']
             if bstype == 'B':
                 price = rp['ask5'] if rp['ask5'] > 0 else rp['top_price']
@@ -630,6 +919,7 @@ class Account():
             self.hold_account.trading_records.append({
                 'code': code, 'price': price, 'count': count, 'sid': robj['Data'][0]['Wtbh'], 'tradeType': bstype, 'time': dltime
             })
+            self.loader.order_signal.set()
         except Exception as e:
             logger.error('submit trade error: %s, %s, %s', code, bstype, e)
             logger.debug(format_exc())
@@ -680,6 +970,7 @@ class NormalAccount(Account):
         if assets:
             self.pure_assets = float(assets['Zzc'])
             self.available_money = float(assets['Kyzj'])
+            self.notify_assets()
 
     def get_positions(self):
         return self.get_assets_and_positions()[1]
@@ -701,7 +992,7 @@ class NormalAccount(Account):
         return join_url(self.wgdomain, f'Trade/SubmitTradeV2?validatekey={self.valkey}')
 
     def buy_fund_before_close(self):
-        accld.buy_bond_repurchase('204001')
+        self.loader.buy_bond_repurchase('204001')
 
 
 class CollateralAccount(Account):
@@ -731,7 +1022,7 @@ class CollateralAccount(Account):
         return self.get_assets(), self.get_positions()
 
     def get_assets(self):
-        jywg = accld.jywg
+        jywg = self.loader.jywg
         if not jywg or not jywg.validate_key:
             return None
 
@@ -755,8 +1046,10 @@ class CollateralAccount(Account):
             return
         self.pure_assets = float(assets['Zzc']) - float(assets['Zfz'])
         self.available_money = float(assets['Zjkys'])
-        if accld.credit_account:
-            accld.credit_account.available_money = float(assets['Bzjkys'])
+        self.notify_assets()
+        if self.loader.credit_account:
+            self.loader.credit_account.available_money = float(assets['Bzjkys'])
+            self.loader.credit_account.notify_assets()
 
     def get_positions(self):
         url = join_url(self.wgdomain, f'/MarginSearch/GetStockList?validatekey={self.valkey}')
@@ -793,7 +1086,7 @@ class CollateralAccount(Account):
         return join_url(self.wgdomain, f'MarginTrade/SubmitTradeV2?validatekey={self.valkey}')
 
     def buy_fund_before_close(self):
-        accld.repay_margin_loan()
+        self.loader.repay_margin_loan()
         self.trade(self.fundcode, 0, 1, 'B')
 
 
@@ -839,6 +1132,10 @@ class TrackingAccount(Account):
     def load_other_deals(self, date):
         pass
 
+    def pending_orders(self):
+        # 跟踪账户的委托不会由券商成交, 不需要快速轮询
+        return []
+
     def check_orders(self):
         sdeals = {}
         for d in self.trading_records:
@@ -854,7 +1151,7 @@ class TrackingAccount(Account):
 
         return sdeals
 
-    def trade(self, code, price, count, bstype):
+    def trade(self, code, price, count, bstype, rp=None):
         time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         stk = self.get_stock(code)
@@ -889,37 +1186,86 @@ class TrackingAccount(Account):
         self.sid += 1
 
 
-class accld:
-    jywg = None
-    fha = None
-    enable_credit = False
-    normal_account = None
-    collateral_account = None
-    credit_account = None
-    all_accounts = {}
-    track_accounts = []
+class OrderSignal(threading.Event):
+    """提交新委托的信号, set时调用注册的回调唤醒委托轮询"""
+    def __init__(self):
+        super().__init__()
+        self.callbacks = []
+
+    def add_callback(self, callback):
+        if callback not in self.callbacks:
+            self.callbacks.append(callback)
+
+    def set(self):
+        super().set()
+        for callback in list(self.callbacks):
+            try:
+                callback()
+            except Exception as e:
+                logger.error('order signal callback error: %s', e)
+
+
+class AccountLoader:
+    """一个券商登录下的所有账户
+    每个登录有各自的jywg会话、数据服务配置和账户, loaders记录进程中register的登录,
+    只有默认登录accld和配置的登录注册, 行情缓存和连接池由所有登录共享
+    """
+    loaders = []
+
+    def __init__(self, name=None):
+        self.name = name
+        self.jywg = None
+        self.fha = None
+        self.enable_credit = False
+        self.normal_account = None
+        self.collateral_account = None
+        self.credit_account = None
+        self.all_accounts = {}
+        self.track_accounts = []
+        self.order_signal = OrderSignal()
 
     @classmethod
-    def load_accounts(self):
-        self.normal_account = NormalAccount()
-        self.all_accounts[self.normal_account.keyword] = self.normal_account
-        self.normal_account.load_watchings()
+    def register(cls, loader):
+        """注册登录, 同名的登录被替换"""
+        cls.loaders = [ld for ld in cls.loaders if ld.name != loader.name] + [loader]
+        return loader
+
+    @classmethod
+    def unregister(cls, loader):
+        cls.loaders = [ld for ld in cls.loaders if ld is not loader]
+
+    @classmethod
+    def get(cls, name=None):
+        return next((ld for ld in cls.loaders if ld.name == name), None)
+
+    def add_account(self, account):
+        account.loader = self
+        self.all_accounts[account.keyword] = account
+        return account
+
+    def create_accounts(self):
+        self.normal_account = self.add_account(NormalAccount())
         if self.enable_credit:
-            self.collateral_account = CollateralAccount()
-            self.collateral_account.load_watchings()
-            self.credit_account = CreditAccount()
+            self.collateral_account = self.add_account(CollateralAccount())
+            self.credit_account = self.add_account(CreditAccount())
             self.credit_account.hacc = self.collateral_account
-            self.all_accounts[self.collateral_account.keyword] = self.collateral_account
-            self.all_accounts[self.credit_account.keyword] = self.credit_account
 
-    @classmethod
+    def trade_accounts(self):
+        # 需要从券商加载持仓的账户
+        return [acc for acc in (self.normal_account, self.collateral_account) if acc]
+
+    def load_accounts(self):
+        self.create_accounts()
+        for acc in self.trade_accounts():
+            acc.load_watchings()
+
     def init_track_accounts(self):
         if not self.fha or not self.fha.get('headers', None):
             logger.warning('fha not fully configured')
             return
 
         url = join_url(self.fha['server'], 'userbind?onlystock=1')
-        r = requests.get(url, headers=self.fha['headers'])
+        r = transport.get(url, headers=self.fha['headers'])
         r.raise_for_status()
         accs = r.json()
         for acc in accs:
@@ -929,10 +1275,41 @@ class accld:
             name = acc['name'] if 'name' in acc else acc['username'].split('.')[1]
             self.track_accounts.append(TrackingAccount(name))
         for account in self.track_accounts:
-            self.all_accounts[account.keyword] = account
-            account.load_watchings()
+            self.add_account(account)
+        self.load_track_watchings(self.track_accounts)
+
+    def load_track_watchings(self, accounts):
+        # 并发查询各跟踪账户的关注股票, 全部返回后再统一合并
+        if len(accounts) == 0:
+            return
+
+        def fetch(account):
+            try:
+                return account.fetch_watchings()
+            except Exception as e:
+                logger.error('%s fetch watchings error: %s', account.keyword, e)
+                logger.debug(format_exc())
+                return None
+
+        workers = min(len(accounts), Config.trade_config().get('track_workers', 8))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='track') as pool:
+            watchings = list(pool.map(fetch, accounts))
+        for account, w in zip(accounts, watchings):
+            account.apply_watchings(w)
+
+    def on_quote_changed(self, code, snap, old=None):
+        """行情变化时更新各账户中该股票的最新价"""
+        if not snap.get('price'):
+            return
+        held = False
+        for acc in list(self.all_accounts.values()):
+            stk = acc.get_stock(code)
+            if stk:
+                stk['latestPrice'] = snap['price']
+                held = True
+        if held:
+            event_hub.publish('quote', {'code': code, 'price': snap['price']}, self.name)
 
-    @classmethod
     def upload_every_monday(self):
         """每周一上传历史成交记录"""
         now = datetime.now()
@@ -942,7 +1319,7 @@ class accld:
         today = now.strftime('%Y-%m-%d')
         url = join_url(self.fha['server'], 'api/tradingdates?len=30')
         try:
-            r = requests.get(url)
+            r = transport.get(url)
             r.raise_for_status()
             dates = r.json()
             if not dates or len(dates) == 0:
@@ -958,28 +1335,31 @@ class accld:
         except Exception as e:
             date = (datetime.now() - timedelta(days=15)).strftime('%Y-%m-%d')
         finally:
-            logger.info('upload history deals and other deals since %s', date)
-            self.load_his_deals(date)
-            self.load_other_deals(date)
+            self.sync_history(date)
+
+    def sync_history(self, date):
+        """增量上传date之后的历史成交记录, 已同步过的账户从同步水位开始"""
+        logger.info('sync history deals and other deals since %s', date)
+        for acc in (self.normal_account, self.collateral_account):
+            if acc:
+                acc.sync_his_deals(date)
+                acc.sync_other_deals(date)
 
-    @classmethod
     def load_his_deals(self, date):
         self.normal_account.load_his_deals(date)
         if self.collateral_account:
             self.collateral_account.load_his_deals(date)
 
-    @classmethod
     def load_other_deals(self, date):
         self.normal_account.load_other_deals(date)
         if self.collateral_account:
             self.collateral_account.load_other_deals(date)
 
-    @classmethod
-    def check_rzrq(self, code):
+    def check_rzrq(self, code, snap=None):
         if not self.credit_account:
             return False
 
-        snap = get_rt_price(code)
+        snap = snap or get_rt_price(code)
         data = self.credit_account.get_count_form_data(code, snap['price'], 'B')
         try:
             r = self.jywg.session.post(self.credit_account.count_url, data=data)
@@ -991,7 +1371,6 @@ class accld:
             logger.debug(format_exc())
             return False
 
-    @classmethod
     def buy_new_stocks(self):
         """购买新股"""
         jywg = self.jywg
@@ -1046,7 +1425,6 @@ class accld:
             logger.error('Error in buyNewStocks: %s', error)
             logger.debug(format_exc())
 
-    @classmethod
     def buy_new_bonds(self):
         """购买新债"""
         jywg = self.jywg
@@ -1105,7 +1483,6 @@ class accld:
             logger.error('Error in buyNewBonds: %s', error)
             logger.debug(format_exc())
 
-    @classmethod
     def buy_bond_repurchase(self, code):
         """国债逆回购"""
         jywg = self.jywg
@@ -1162,7 +1539,6 @@ class accld:
             logger.error('Error in bond repurchase process: %s', error)
             logger.debug(format_exc())
 
-    @classmethod
     def repay_margin_loan(self):
         """偿还融资融券负债"""
         jywg = self.jywg
@@ -1235,8 +1611,7 @@ class accld:
             logger.error('Repayment process failed: %s', error)
             logger.debug(format_exc())
 
-    @classmethod
-    def buy_stock(self, code, price, count, account, strategies=None):
+    def buy_stock(self, code, price, count, account, strategies=None, rp=None):
         if account not in self.all_accounts:
             logger.error('invalid account %s', account)
             return
@@ -1250,6 +1625,8 @@ class accld:
                 logger.error('no count set and no strategy to calc count %s %s %s %s %s %s', account, code, price, count, strategies, stk)
                 return
 
+            if price == 0 and rp:
+                price = rp['price']
             count = calc_buy_count(int(stk['strategies'].get('amount', 10000)), price)
             available_money = self.all_accounts[account].available_money
             if count * price > available_money:
@@ -1260,22 +1637,32 @@ class accld:
         if count == 0:
             logger.error('count is 0, check available money: %s %s', account, available_money)
 
-        self.all_accounts[account].trade(code, price, count, 'B')
+        self.all_accounts[account].trade(code, price, count, 'B', rp)
 
-    @classmethod
-    def sell_stock(self, code, price, count, account):
+    def sell_stock(self, code, price, count, account, rp=None):
         if account not in self.all_accounts:
             logger.error('invalid account %s', account)
             return
 
-        self.all_accounts[account].trade(code, price, count, 'S')
+        self.all_accounts[account].trade(code, price, count, 'S', rp)
+
+    def trade_batch(self, orders):
+        """批量下单, orders中每项包含code, price, count, account, tradeType, strategies
+        市价委托(price为0)的实时价格一次并发获取, 不再每个委托单独请求
+        """
+        codes = [o['code'] for o in orders if not o.get('price')]
+        prices = get_rt_prices(codes) if codes else {}
+        for o in orders:
+            rp = prices.get(o['code'])
+            if o['tradeType'] == 'B':
+                self.buy_stock(o['code'], o.get('price', 0), o.get('count', 0), o['account'], o.get('strategies'), rp=rp)
+            else:
+                self.sell_stock(o['code'], o.get('price', 0), o.get('count', 0), o['account'], rp=rp)
 
-    @classmethod
     def test_trade_api(self, code='601398'):
         snap = get_rt_price(code)
         self.buy_stock(code, snap['bottom_price'], calc_buy_count(1000, snap['bottom_price']), 'normal')
 
-    @classmethod
     def create_deals_for_transfer(self, order):
         """处理担保品划入/划出订单"""
         code = order.get('Zqdm', order.get('Wtjg', '').replace('.', ''))
@@ -1288,11 +1675,14 @@ class accld:
         tradeType = order.get('Mmsm', '')
         if tradeType == "担保品划出":
             self.normal_account.extend_stock_buydetail(code, [bdetail])
-            self.normal_account._upload_deals(Account.buydetails_to_deals([bdetail]))
+            self.normal_account._upload_deals(Account.buydetails_to_deals([bdetail]), wait=False)
             self.collateral_account.extend_stock_buydetail(code, [sdetail])
-            self.collateral_account._upload_deals(Account.buydetails_to_deals([sdetail]))
+            self.collateral_account._upload_deals(Account.buydetails_to_deals([sdetail]), wait=False)
         elif tradeType == "担保品划入":
             self.normal_account.extend_stock_buydetail(code, [sdetail])
-            self.normal_account._upload_deals(Account.buydetails_to_deals([sdetail]))
+            self.normal_account._upload_deals(Account.buydetails_to_deals([sdetail]), wait=False)
             self.collateral_account.extend_stock_buydetail(code, [bdetail])
-            self.collateral_account._upload_deals(Account.buydetails_to_deals([bdetail]))
+            self.collateral_account._upload_deals(Account.buydetails_to_deals([bdetail]), wait=False)
+
+
+accld = AccountLoader.register(AccountLoader())
@@ -0,0 +1,152 @@
+import time
+import base64
+import random
+import threading
+from collections import deque
+from traceback import format_exc
+import importlib.util
+if importlib.util.find_spec("ddddocr"):
+    from ddddocr import DdddOcr
+from misc import join_url
+from lofig import logger, Config
+from transport import transport
+
+
+class captcha:
+    """登录验证码识别
+    OCR模型在进程启动时加载一次, 没有安装ddddocr时使用数据服务的api/captcha识别
+    验证码与会话绑定, 获取新的验证码后之前的验证码失效, 所以依次获取识别,
+    置信度达到threshold时立即使用, 每轮candidates张的最后一张只要合法就使用,
+    总共最多获取max_attempts张, 每次识别的耗时和登录结果记录在stats中
+    """
+    candidates = Config.trade_config().get('captcha_candidates', 3)
+    max_attempts = Config.trade_config().get('captcha_attempts', 12)
+    threshold = Config.trade_config().get('captcha_confidence', 0.8)
+    replace_map = {
+        'g': '9', 'Q': '0', 'i': '1', 'D': '0', 'C': '0', 'u': '0',
+        'U': '0', 'z': '7', 'Z': '7', 'c': '0', 'o': '0', 'q': '9'
+    }
+    model = None
+    model_loaded = False
+    lock = threading.Lock()
+    stats_lock = threading.Lock()
+    attempts = deque(maxlen=100)
+    stats = {'rounds': 0, 'fetched': 0, 'valid': 0, 'exhausted': 0, 'accepted': 0, 'rejected': 0}
+
+    @classmethod
+    def load_model(self):
+        with self.lock:
+            if not self.model_loaded:
+                self.model_loaded = True
+                if importlib.util.find_spec("ddddocr"):
+                    self.model = DdddOcr(show_ad=False)
+                    logger.info('captcha ocr model loaded')
+            return self.model
+
+    @classmethod
+    def normalize(self, vcode):
+        """转换为4位数字验证码, 返回(验证码, 替换字符数), 不合法时验证码为None"""
+        if len(vcode) != 4:
+            return None, 0
+        fvcode = ''
+        replaced = 0
+        for c in vcode:
+            if c.isdigit():
+                fvcode += c
+            elif c in self.replace_map:
+                fvcode += self.replace_map[c]
+                replaced += 1
+            else:
+                return None, 0
+        return fvcode, replaced
+
+    @classmethod
+    def classify(self, img):
+        """识别图片, 返回(原始结果, 置信度)"""
+        model = self.load_model()
+        if model is None:
+            url = join_url(Config.data_service()['server'], 'api/captcha')
+            r = transport.post(url, data={'img': base64.b64encode(img).decode('utf-8')})
+            r.raise_for_status()
+            return r.text.replace('"', '').strip(), 1.0
+
+        try:
+            result = model.classification(img, probability=True)
+            charsets = result['charsets']
+            vcode = ''
+            confidence = 1.0
+            for probs in result['probability']:
+                i = max(range(len(probs)), key=lambda k: probs[k])
+                vcode += charsets[i]
+                confidence *= probs[i]
+            return vcode, confidence
+        except Exception:
+            return model.classification(img), 1.0
+
+    @classmethod
+    def decode(self, img):
+        """返回(验证码, 置信度), 每个替换字符降低置信度"""
+        vcode, confidence = self.classify(img)
+        fvcode, replaced = self.normalize(vcode)
+        if fvcode is None:
+            logger.warning('验证码不合法 %s, %d', vcode, len(vcode))
+            return None, 0
+        return fvcode, confidence * (0.8 ** replaced)
+
+    @classmethod
+    def attempt(self, session, url):
+        """获取并识别一张验证码, 返回(randNum, 验证码, 置信度)"""
+        rand_num = str(random.random())
+        start = time.time()
+        vcode, confidence = None, 0
+        try:
+            rsp = session.get(url + rand_num)
+            rsp.raise_for_status()
+            vcode, confidence = self.decode(rsp.content)
+        except Exception as e:
+            logger.error('captcha attempt error: %s', e)
+            logger.debug(format_exc())
+        self.attempts.append({'latency': round(time.time() - start, 3), 'vcode': vcode, 'confidence': round(confidence, 4)})
+        return rand_num, vcode, confidence
+
+    @classmethod
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.stats[key] += n
+
+    @classmethod
+    def solve(self, session, url):
+        """url为不含randNum值的验证码地址, 返回(验证码, randNum), 超出次数返回(None, None)"""
+        for fetched in range(1, self.max_attempts + 1):
+            if fetched % self.candidates == 1 or self.candidates == 1:
+                self.count('rounds')
+            self.count('fetched')
+            rand_num, vcode, confidence = self.attempt(session, url)
+            if not vcode:
+                continue
+            self.count('valid')
+            if confidence >= self.threshold or fetched % self.candidates == 0 or fetched == self.max_attempts:
+                return vcode, rand_num
+
+        self.count('exhausted')
+        logger.error('验证码识别失败, 已获取%d张', self.max_attempts)
+        return None, None
+
+    @classmethod
+    def report(self, accepted):
+        """记录登录时验证码是否被接受"""
+        self.count('accepted' if accepted else 'rejected')
+
+    @classmethod
+    def status(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        judged = stats['accepted'] + stats['rejected']
+        latencies = [a['latency'] for a in list(self.attempts)]
+        return {
+            **stats,
+            'model': self.model is not None,
+            'accuracy': stats['accepted'] / judged if judged else None,
+            'avg_latency': sum(latencies) / len(latencies) if latencies else None,
+            'attempts': list(self.attempts)[-10:]
+        }
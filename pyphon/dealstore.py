@@ -0,0 +1,143 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from traceback import format_exc
+from lofig import logger, Config
+
+
+class deal_store:
+    """本地成交存储(SQLite WAL)
+    orders: 当日委托(按委托编号), deals: 历史成交及其它资金流水, positions: 每日持仓快照
+    未调用open时所有写入均忽略
+    """
+    conn = None
+    lock = threading.Lock()
+
+    @classmethod
+    def default_path(self):
+        return os.path.join(os.path.dirname(Config._cfg_path()), 'deals.db')
+
+    @classmethod
+    def open(self, path=None):
+        if self.conn:
+            return
+        path = path or self.default_path()
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS orders (
+                acc TEXT NOT NULL, date TEXT NOT NULL, sid TEXT NOT NULL, code TEXT, tradeType TEXT,
+                status TEXT, price REAL, count INTEGER, updated TEXT,
+                PRIMARY KEY (acc, date, sid)
+            );
+            CREATE TABLE IF NOT EXISTS deals (
+                acc TEXT NOT NULL, time TEXT NOT NULL, sid TEXT NOT NULL, code TEXT NOT NULL, tradeType TEXT NOT NULL,
+                price REAL, count INTEGER, fee REAL, feeYh REAL, feeGh REAL,
+                PRIMARY KEY (acc, time, sid, code, tradeType, price, count)
+            );
+            CREATE INDEX IF NOT EXISTS idx_deals_code ON deals (acc, code, time);
+            CREATE TABLE IF NOT EXISTS positions (
+                acc TEXT NOT NULL, date TEXT NOT NULL, code TEXT NOT NULL, name TEXT,
+                holdCount INTEGER, availableCount INTEGER, holdCost REAL, latestPrice REAL,
+                PRIMARY KEY (acc, date, code)
+            );
+        ''')
+        conn.commit()
+        self.conn = conn
+        logger.info('deal store opened: %s', path)
+
+    @classmethod
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+
+    @classmethod
+    def execute_many(self, sql, rows):
+        if not self.conn or len(rows) == 0:
+            return
+        try:
+            with self.lock:
+                with self.conn:
+                    self.conn.executemany(sql, rows)
+        except Exception as e:
+            logger.error('deal store write error: %s', e)
+            logger.debug(format_exc())
+
+    @classmethod
+    def query(self, sql, params=()):
+        if not self.conn:
+            return []
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(sql, params).fetchall()]
+
+    @staticmethod
+    def order_sid(key):
+        """委托在orders表中的键, 没有委托编号的委托使用Account.order_key的成交内容元组, 以|连接"""
+        if isinstance(key, tuple):
+            return '|'.join('' if k is None else str(k) for k in key)
+        return str(key)
+
+    @classmethod
+    def save_orders(self, acc, deals, status='已成', keys=None):
+        """保存当日委托成交, deals为check_orders返回的成交格式
+        keys为对应的Account.order_key, 未提供时没有委托编号的成交无法区分, 不保存
+        """
+        updated = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        keys = keys or [d['sid'] for d in deals]
+        self.execute_many(
+            'INSERT INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (acc, date, sid) DO UPDATE SET '
+            'status = excluded.status, price = excluded.price, count = excluded.count, updated = excluded.updated',
+            [(acc, d['time'][:10], self.order_sid(k), d['code'], d['tradeType'], d.get('status', status), d['price'], d['count'], updated)
+             for d, k in zip(deals, keys) if k is not None])
+
+    @classmethod
+    def save_deals(self, acc, deals):
+        """保存历史成交/资金流水, deals为load_his_deals/load_other_deals解析后的格式"""
+        self.execute_many(
+            'INSERT OR IGNORE INTO deals VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(acc, d['time'], str(d['sid']), d['code'], d['tradeType'], d['price'], d['count'], d.get('fee', 0), d.get('feeYh', 0), d.get('feeGh', 0)) for d in deals])
+
+    @classmethod
+    def save_positions(self, acc, stocks, date=None):
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        self.execute_many(
+            'INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(acc, date, s['code'], s.get('name', ''), s.get('holdCount', 0), s.get('availableCount', 0), s.get('holdCost', 0), s.get('latestPrice', 0))
+             for s in stocks if 'holdCost' in s])
+
+    @classmethod
+    def today_deals(self, acc, date=None):
+        """当日已成交委托, 按代码分组, 格式同check_orders返回值"""
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        sdeals = {}
+        for r in self.query('SELECT * FROM orders WHERE acc = ? AND date = ? AND count > 0 ORDER BY rowid', (acc, date)):
+            sdeals.setdefault(r['code'], []).append({
+                'code': r['code'], 'price': r['price'], 'count': r['count'], 'sid': None if '|' in r['sid'] else r['sid'],
+                'tradeType': r['tradeType'], 'time': r['date']
+            })
+        return sdeals
+
+    @classmethod
+    def deals(self, acc, since=None, until=None, code=None):
+        sql = 'SELECT * FROM deals WHERE acc = ?'
+        params = [acc]
+        if code:
+            sql += ' AND code = ?'
+            params.append(code)
+        if since:
+            sql += ' AND time >= ?'
+            params.append(since)
+        if until:
+            sql += ' AND time <= ?'
+            params.append(until)
+        return self.query(sql + ' ORDER BY time', params)
+
+    @classmethod
+    def positions(self, acc, date=None):
+        date = date or datetime.now().strftime('%Y-%m-%d')
+        return self.query('SELECT * FROM positions WHERE acc = ? AND date = ? ORDER BY code', (acc, date))
@@ -1,23 +1,55 @@
 import os
+import time
+import uuid
 import base64
+import asyncio
+import threading
+from functools import partial
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from traceback import format_exc
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from fastapi import FastAPI, Request, Response, HTTPException, Body, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from pydantic import BaseModel, Field
+from requests.exceptions import Timeout
 from lofig import logger, Config
 from jywg import jywg
-from accounts import accld
-from timers import alarm_hub
-from misc import is_today_trading_day, delay_seconds
+from captcha import captcha
+from accounts import accld, AccountLoader
+from timers import alarm_hub, AlarmHub, scheduler
+from quotes import quote_hub
+from warmup import warmup, Warmup
+from dealstore import deal_store
+from uploader import deal_uploader
+from snapshot import state_snapshot
+from events import event_hub
+from transport import transport
+from misc import is_today_trading_day, delay_seconds, quote_cache, join_url, get_rt_prices
 
 
 # 获取配置
 tconfig = Config.trade_config()
 port = tconfig['port']
+# 部署方式: standalone 单进程; core 交易核心进程, 只监听本机core_port并发布状态快照;
+# api 无状态的API进程, 多个worker从快照读取状态, 启动和交易请求转发给交易核心
+role = os.environ.get('EMTRADER_ROLE', tconfig.get('server_role', 'standalone'))
+core_port = tconfig.get('core_port', port + 1)
+core_url = tconfig.get('core_url', f'http://127.0.0.1:{core_port}')
+# 交易核心的/start包含验证码登录和盘前预热, 转发时使用单独的超时
+start_timeout = tconfig.get('start_timeout', 300)
+
+# 券商/行情请求都是同步阻塞的, 放到有界线程池中执行, 避免阻塞事件循环
+executor = ThreadPoolExecutor(max_workers=tconfig.get('max_workers', 8), thread_name_prefix='emtrader')
+
+
+async def run_blocking(func, *args, **kwargs):
+    """在线程池中执行阻塞调用"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(func, *args, **kwargs))
 
 # 创建FastAPI应用
 app = FastAPI(title="EMTrader API", description="Trading API for East Money Securities")
@@ -33,10 +65,20 @@ app.add_middleware(
 
 
 class TradingExtension:
-    def __init__(self):
+    """一个券商登录的交易扩展
+    name为空时是默认登录, 使用unp/fha配置和默认的accld, alarm_hub, warmup;
+    其他登录各自创建jywg会话、账户、定时任务和预热, 行情缓存和连接池由所有登录共享
+    """
+    def __init__(self, name=None, unp=None, fha=None):
+        self.name = name
         self.running = False
         self.status = None
-        acc = Config.account()
+        self.unp = unp or Config.account()
+        self.fha = fha
+        self.accld = accld if name is None else AccountLoader.register(AccountLoader(name))
+        self.alarm_hub = alarm_hub if name is None else AlarmHub(self.accld)
+        self.warmup = warmup if name is None else Warmup(self.accld)
+        acc = self.unp
         self.jywg = None
         if acc['account']:
             self.jywg = jywg(**acc, active_time=1800)
@@ -44,6 +86,9 @@ class TradingExtension:
             logger.error('account not set in config file!')
         # 初始化定时器存储
         self.start_timers = []
+        # 已处理的交易请求id, API进程转发超时后重发时不重复下单
+        self.trade_ids = OrderedDict()
+        self.trade_lock = threading.Lock()
 
     def schedule(self):
         """
@@ -56,16 +101,16 @@ class TradingExtension:
             logger.info("已收盘，不设置定时任务")
             return
 
-        if not is_today_trading_day():
+        if not scheduler.is_trading_day():
             logger.info("今天不是交易日，不设置定时任务")
             return
 
         # 处理上午交易时段
-        tid = alarm_hub.add_timer_task(self.start, '9:12', '11:30')
+        tid = self.alarm_hub.add_timer_task(self.start, '9:12', '11:30')
         if tid:
             self.start_timers.append({'id': tid, 'start': '9:12', 'end': '11:30'})
         # 处理下午交易时段
-        tid = alarm_hub.add_timer_task(self.start, '12:45', '15:0')
+        tid = self.alarm_hub.add_timer_task(self.start, '12:45', '15:0')
         if tid:
             self.start_timers.append({'id': tid, 'start':'12:45', 'end': '15:0'})
 
@@ -76,7 +121,7 @@ class TradingExtension:
 
         for task in self.start_timers:
             if delay_seconds(task['end']) < 3*60*60:
-                alarm_hub.cancel_task(task['id'])
+                self.alarm_hub.cancel_task(task['id'])
 
     def start(self):
         self.running = True
@@ -86,38 +131,60 @@ class TradingExtension:
 
     def on_login_success(self):
         self.status = 'success'
-        if accld.jywg:
+        self.jywg.start_keepalive()
+        if self.accld.jywg:
             return
-        accld.jywg = self.jywg
-        acc = Config.account()
-        fha = Config.data_service()
+        self.accld.jywg = self.jywg
+        acc = self.unp
+        fha = self.fha or Config.data_service()
         if 'pwd' in fha:
             bearer = base64.b64encode(f"{fha['uemail']}:{Config.simple_decrypt(fha['pwd'])}".encode()).decode()
             fha['headers'] = {'Authorization': f'Basic {bearer}'}
-        accld.enable_credit = acc['credit']
-        accld.fha = fha
-        accld.load_accounts()
-        accld.normal_account.load_assets()
+        self.accld.enable_credit = acc['credit']
+        self.accld.fha = fha
+        deal_uploader.start(fha, self.name)
+        if tconfig.get('deal_store', True):
+            deal_store.open()
+        self.warmup.run()
+        for account in self.accld.all_accounts.values():
+            account.today_deals = deal_store.today_deals(account.uid) or None
         if acc['credit']:
-            accld.collateral_account.load_assets()
-            logger.info('load assets for collateral_account %s', accld.collateral_account.stocks)
-        accld.init_track_accounts()
+            logger.info('load assets for collateral_account %s', self.accld.collateral_account.stocks)
+        quote_hub.add_listener(self.accld.on_quote_changed)
+        quote_hub.start()
         # costDog.init()
-        alarm_hub.purchase_new_stocks = tconfig['purchase_new_stocks']
-        alarm_hub.on_trade_closed = self.on_trade_closed
-        alarm_hub.setup_alarms()
+        self.alarm_hub.purchase_new_stocks = tconfig['purchase_new_stocks']
+        self.alarm_hub.on_trade_closed = self.on_trade_closed
+        self.alarm_hub.setup_alarms()
+        self.notify_status()
+
+    def notify_status(self):
+        event_hub.publish('status', self.handleStatus(), self.name)
 
     def on_trade_closed(self):
         self.running = False
         self.status = "closed"
+        # 行情由所有登录共享, 全部收盘后再停止
+        if not any(e.running for e in extensions.values()):
+            quote_hub.stop()
+        if self.jywg:
+            self.jywg.stop_keepalive()
+        self.notify_status()
         logger.info("已收盘")
 
     def handleStatus(self):
         # 返回交易状态
         return {
+            "login": self.name,
             "running": self.running,
             "status": self.status if self.status else ("running" if self.running else "stopped"),
-            "accounts": list(accld.all_accounts.keys()) if accld.all_accounts else []
+            "accounts": list(self.accld.all_accounts.keys()) if self.accld.all_accounts else [],
+            "quote_cache": quote_cache.stats(),
+            "order_polling": self.alarm_hub.poll_status(),
+            "warmup": self.warmup.status(),
+            "upload_queue": deal_uploader.stats(),
+            "captcha": captcha.status(),
+            "events": event_hub.stats()
         }
 
     def handleStart(self):
@@ -134,54 +201,79 @@ class TradingExtension:
 
     def handleTrade(self, trade_data):
         # 处理交易请求
-        code = trade_data.get('code')
-        tradeType = trade_data.get('tradeType')
-        count = trade_data.get('count', 0)
-        price = trade_data.get('price', 0)
-        account = trade_data.get('account')
-        strategies = trade_data.get('strategies')
-
-        # 验证必填参数
-        if not code or not tradeType:
-            logger.error(f"Missing required parameters: code={code}, tradeType={tradeType}")
-            return False
+        return self.handleTrades([trade_data])
+
+    def new_trades(self, trades):
+        """去掉tradeId已处理过的交易请求"""
+        fresh = []
+        with self.trade_lock:
+            for trade_data in trades:
+                tid = trade_data.get('tradeId')
+                if tid:
+                    if tid in self.trade_ids:
+                        logger.warning('重复的交易请求 %s, 忽略', tid)
+                        continue
+                    self.trade_ids[tid] = time.time()
+                    while len(self.trade_ids) > tconfig.get('trade_id_cache', 1000):
+                        self.trade_ids.popitem(last=False)
+                fresh.append(trade_data)
+        return fresh
+
+    def handleTrades(self, trades):
+        """处理一组交易请求, 买卖委托通过trade_batch一次获取行情后依次下单
+        带tradeId的请求只处理一次, 重复的请求直接返回成功
+        """
+        for trade_data in trades:
+            code = trade_data.get('code')
+            tradeType = trade_data.get('tradeType')
+            account = trade_data.get('account')
+            strategies = trade_data.get('strategies')
+
+            # 验证必填参数
+            if not code or not tradeType:
+                logger.error(f"Missing required parameters: code={code}, tradeType={tradeType}")
+                return False
 
-        if tradeType == 'B':
-            if not account:
-                # 买入时如果没有指定账户，自动选择
-                rzrq = accld.check_rzrq(code)
-                account = 'credit' if rzrq else 'normal'
-                logger.info(f"Auto-selected account: {account} for code: {code}")
-            accld.buy_stock(code, price, count, account, strategies)
-        elif tradeType == 'S':
-            if not account:
+            if tradeType == 'S' and not account:
                 logger.error("Account is required for sell orders")
                 return False
-            accld.sell_stock(code, price, count, account)
-        elif strategies and code and account:
-            # 仅添加监控股票
-            accld.all_accounts[account].addWatchStock(code, strategies)
-        else:
-            logger.error(f"Invalid trade request: tradeType={tradeType}, code={code}, account={account}")
-            return False
+            if tradeType not in ('B', 'S') and not (strategies and account):
+                logger.error(f"Invalid trade request: tradeType={tradeType}, code={code}, account={account}")
+                return False
+
+        trades = self.new_trades(trades)
+        orders = [t for t in trades if t['tradeType'] in ('B', 'S')]
+        prices = get_rt_prices([o['code'] for o in orders if o['tradeType'] == 'B' and not o.get('account')])
+        for trade_data in trades:
+            code = trade_data['code']
+            if trade_data['tradeType'] == 'B' and not trade_data.get('account'):
+                # 买入时如果没有指定账户，自动选择
+                rzrq = self.accld.check_rzrq(code, prices.get(code))
+                trade_data['account'] = 'credit' if rzrq else 'normal'
+                logger.info(f"Auto-selected account: {trade_data['account']} for code: {code}")
+            elif trade_data['tradeType'] not in ('B', 'S'):
+                # 仅添加监控股票
+                self.accld.all_accounts[trade_data['account']].addWatchStock(code, trade_data['strategies'])
+
+        if orders:
+            self.accld.trade_batch(orders)
         return True
 
     def handleAccountStocks(self, account='normal'):
         # 获取账户股票信息
-        if account not in accld.all_accounts:
+        if account not in self.accld.all_accounts:
             logger.error(f"Invalid account: {account}")
             return {"error": f"Invalid account: {account}", "stocks": []}
 
         try:
             stocks = []
-            for s in accld.all_accounts[account].stocks:
+            # 交易线程同时在修改持仓, 先复制再组装, 不修改账户中的数据
+            for s in list(self.accld.all_accounts[account].stocks):
+                s = dict(s)
                 sobj = {k: v for k,v in s.items() if k not in ('buydetail', 'buydetail_full')}
                 if s.get('buydetail', None) or s.get('buydetail_full', None):
-                    if 'strategies' not in sobj or not sobj['strategies']:
-                        sobj['strategies'] = {'buydetail': s['buydetail'], 'buydetail_full': s['buydetail_full']}
-                    else:
-                        sobj['strategies']['buydetail'] = s['buydetail']
-                        sobj['strategies']['buydetail_full'] = s['buydetail_full']
+                    details = {'buydetail': list(s.get('buydetail') or []), 'buydetail_full': list(s.get('buydetail_full') or [])}
+                    sobj['strategies'] = {**(sobj.get('strategies') or {}), **details}
                 stocks.append(sobj)
             return {"account": account, "stocks": stocks}
         except Exception as e:
@@ -190,32 +282,175 @@ class TradingExtension:
             return {"error": str(e), "stocks": []}
 
     def handleAccountDeals(self, account='normal'):
-        # 获取账户当日交易记录
-        if not self.running:
-            logger.warning("Trading system is not running")
-            if account in accld.all_accounts and accld.all_accounts[account].today_deals:
-                return {"account": account, "deals": accld.all_accounts[account].today_deals}
-            return {"account": account, "deals": []}
+        # 获取账户当日交易记录, 委托轮询已把成交写入本地存储, 不再查询券商
+        if account not in self.accld.all_accounts:
+            logger.error(f"Invalid account: {account}")
+            return {"error": f"Invalid account: {account}", "deals": []}
 
         if account == 'credit':
+            # 融资账户的委托在担保品账户中
             return {"account": account, "deals": []}
 
-        if account not in accld.all_accounts:
-            logger.error(f"Invalid account: {account}")
-            return {"error": f"Invalid account: {account}", "deals": []}
-
+        acc = self.accld.all_accounts[account]
         try:
-            deals = accld.all_accounts[account].check_orders()
-            accld.all_accounts[account].today_deals = deals
-            return {"account": account, "deals": deals}
+            deals = deal_store.today_deals(acc.uid) if deal_store.conn else None
+            return {"account": account, "deals": deals or acc.today_deals or {}}
         except Exception as e:
             logger.error(f"Error getting deals for account {account}: {str(e)}")
             logger.debug(format_exc())
             return {"error": str(e), "deals": []}
 
+    def handleAccountAssets(self, account='normal'):
+        # 获取账户资产信息
+        if not self.running:
+            return {"error": "Trading system is not running", "assets": {}}
+
+        if account not in self.accld.all_accounts:
+            return {"error": f"Invalid account: {account}", "assets": {}}
+
+        acc = self.accld.all_accounts[account]
+        assets = {
+            "pure_assets": acc.pure_assets,
+            "available_money": acc.available_money,
+            "account_type": account
+        }
+        return {"account": account, "assets": assets}
+
+    def handleRzrq(self, code):
+        if not self.running:
+            return False
+        return self.accld.check_rzrq(code)
+
+    def snapshot(self):
+        """发布给API进程的状态, 成交使用委托轮询缓存的当日成交, 不查询券商"""
+        accounts = list(self.accld.all_accounts.keys())
+        return {
+            "status": self.handleStatus(),
+            "stocks": {a: self.handleAccountStocks(a) for a in accounts},
+            "deals": {a: {"account": a, "deals": dict(self.accld.all_accounts[a].today_deals or {})} for a in accounts},
+            "assets": {a: self.handleAccountAssets(a) for a in accounts}
+        }
+
+
+class RemoteExtension:
+    """API进程中的交易扩展
+    读请求从交易核心进程发布的状态快照返回, 启动、交易和融资融券查询转发给交易核心
+    """
+    def __init__(self, name=None):
+        self.name = name
+
+    def state(self):
+        snap = state_snapshot.load() or {}
+        return snap.get('logins', {}).get(self.name or '', {})
+
+    @property
+    def running(self):
+        return self.state().get('status', {}).get('running', False)
+
+    def snapshot(self):
+        return self.state()
+
+    def handleStatus(self):
+        age = state_snapshot.age(state_snapshot.load())
+        state = self.state()
+        if not state:
+            return {"login": self.name, "running": False, "status": "core unavailable", "snapshot_age": age}
+        return {**state['status'], "snapshot_age": age}
+
+    def handleAccountStocks(self, account='normal'):
+        return self.state().get('stocks', {}).get(account, {"error": f"Invalid account: {account}", "stocks": []})
+
+    def handleAccountDeals(self, account='normal'):
+        return self.state().get('deals', {}).get(account, {"account": account, "deals": []})
+
+    def handleAccountAssets(self, account='normal'):
+        if not self.running:
+            return {"error": "Trading system is not running", "assets": {}}
+        return self.state().get('assets', {}).get(account, {"error": f"Invalid account: {account}", "assets": {}})
+
+    def forward(self, method, path, params=None, **kwargs):
+        params = dict(params or {})
+        if self.name:
+            params['login'] = self.name
+        url = join_url(core_url, path)
+        if method == 'GET':
+            return transport.get(url, params=params, **kwargs)
+        return transport.post(url, params=params, **kwargs)
+
+    def handleStart(self):
+        try:
+            r = self.forward('GET', 'start', timeout=start_timeout)
+        except Timeout:
+            # 交易核心仍在登录, 结果通过/status查看
+            logger.warning('forward start timeout after %ss', start_timeout)
+            return {"status": "starting"}
+        r.raise_for_status()
+        return r.json()
+
+    def forward_trade(self, path, payload):
+        """转发交易请求, 超时或交易核心返回5xx时用同一个tradeId重发一次
+        交易核心按tradeId去重, 仍然失败时无法确定是否已下单, 返回None
+        """
+        for retry in range(2):
+            try:
+                r = self.forward('POST', path, json=payload)
+            except Exception as e:
+                logger.error('forward %s error (try %d): %s', path, retry + 1, e)
+                continue
+            if r.status_code < 500:
+                if r.status_code != 200:
+                    logger.error('forward %s failed: %s %s', path, r.status_code, r.text)
+                return r.status_code == 200
+            logger.error('forward %s failed (try %d): %s %s', path, retry + 1, r.status_code, r.text)
+        return None
+
+    def handleTrade(self, trade_data):
+        trade_data['tradeId'] = trade_data.get('tradeId') or uuid.uuid4().hex
+        return self.forward_trade('trade', trade_data)
+
+    def handleTrades(self, trades):
+        for trade_data in trades:
+            trade_data['tradeId'] = trade_data.get('tradeId') or uuid.uuid4().hex
+        return self.forward_trade('trades', trades)
+
+    def handleRzrq(self, code):
+        r = self.forward('GET', 'rzrq', params={'code': code})
+        r.raise_for_status()
+        return r.json()
+
+
+# 创建交易扩展实例, logins中配置的每个登录各创建一个实例
+if role == 'api':
+    ext = RemoteExtension()
+    extensions = {None: ext}
+    for lcfg in Config.logins():
+        extensions[lcfg['name']] = RemoteExtension(lcfg['name'])
+else:
+    ext = TradingExtension()
+    extensions = {None: ext}
+    for lcfg in Config.logins():
+        extensions[lcfg['name']] = TradingExtension(lcfg['name'], lcfg['unp'], lcfg.get('fha'))
+
+
+def get_ext(login=None):
+    """按登录名获取交易扩展, 为空时为默认登录"""
+    if login not in extensions:
+        raise HTTPException(status_code=404, detail=f"Unknown login: {login}")
+    return extensions[login]
+
+
+def publish_state():
+    """交易核心进程发布的状态, 默认登录的键为空字符串"""
+    return {
+        "logins": {name or '': trader.snapshot() for name, trader in extensions.items()},
+        "jobs": scheduler.stats()
+    }
+
+
+def state_version():
+    """持仓、资产、成交和状态事件的版本, 版本不变时不重新发布快照"""
+    return event_hub.version(('positions', 'assets', 'deals', 'status'))
 
-# 创建交易扩展实例
-ext = TradingExtension()
 
 
 # 静态文件目录
@@ -238,20 +473,34 @@ async def root():
 
 
 @app.get("/status")
-async def status():
+async def status(login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """获取交易系统状态"""
+    trader = get_ext(login)
     try:
-        return ext.handleStatus()
+        return {**trader.handleStatus(), "logins": [k for k in extensions if k is not None]}
     except Exception as e:
         logger.error(f"Error getting status: {str(e)}")
         logger.debug(format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@app.get("/jobs")
+async def jobs():
+    """获取定时任务状态"""
+    try:
+        if role == 'api':
+            return (state_snapshot.load() or {}).get('jobs', {})
+        return scheduler.stats()
+    except Exception as e:
+        logger.error(f"Error getting jobs: {str(e)}")
+        logger.debug(format_exc())
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
 @app.get("/start")
-async def start():
+async def start(login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """启动交易系统"""
+    trader = get_ext(login)
     try:
-        return ext.handleStart()
+        return await run_blocking(trader.handleStart)
     except Exception as e:
         logger.error(f"Error starting system: {str(e)}")
         logger.debug(format_exc())
@@ -265,44 +514,111 @@ class TradeRequest(BaseModel):
     price: float = Field(0, description="价格，0表示市价")
     count: int = Field(0, description="数量")
     strategies: Optional[Dict[str, Any]] = Field(None, description="策略参数，可选")
+    tradeId: Optional[str] = Field(None, description="交易请求id，可选，重发时使用同一个id避免重复下单")
 
 @app.post("/trade")
-async def trade(request: TradeRequest):
+async def trade(request: TradeRequest, login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     if hasattr(request, 'model_dump'):
         request_dict = request.model_dump()
     else:
         request_dict = request.dict()
 
+    trader = get_ext(login)
     try:
-        if ext.handleTrade(request_dict):
-            return {"status": "success", "message": "Trade executed successfully"}
-        else:
-            raise HTTPException(status_code=400, detail="Trade execution failed")
+        result = await run_blocking(trader.handleTrade, request_dict)
     except Exception as e:
         logger.error("Trade error: %s %s", e, request_dict)
         logger.debug(format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    if result is None:
+        # 转发超时, 交易核心可能已经下单, 客户端应使用同一个tradeId重发
+        raise HTTPException(status_code=504, detail=f"Trade status unknown, retry with tradeId {request_dict.get('tradeId')}")
+    if not result:
+        raise HTTPException(status_code=400, detail="Trade execution failed")
+    return {"status": "success", "message": "Trade executed successfully", "tradeId": request_dict.get('tradeId')}
+
+@app.post("/trades")
+async def trades(requests: List[TradeRequest], login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
+    """批量交易, 市价委托的行情一次获取"""
+    request_list = [r.model_dump() if hasattr(r, 'model_dump') else r.dict() for r in requests]
+    trader = get_ext(login)
+    try:
+        result = await run_blocking(trader.handleTrades, request_list)
+    except Exception as e:
+        logger.error("Trades error: %s %s", e, request_list)
+        logger.debug(format_exc())
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=504, detail=f"Trade status unknown, retry with tradeIds {[r.get('tradeId') for r in request_list]}")
+    if not result:
+        raise HTTPException(status_code=400, detail="Trade execution failed")
+    return {"status": "success", "message": f"{len(request_list)} trades executed", "tradeIds": [r.get('tradeId') for r in request_list]}
 
 @app.get("/stocks")
-async def stocks(account: str = Query('normal', description="账户类型: normal, collateral, credit, track")):
+async def stocks(account: str = Query('normal', description="账户类型: normal, collateral, credit, track"), login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """获取指定账户的股票持仓信息"""
+    trader = get_ext(login)
     try:
-        return ext.handleAccountStocks(account)
+        return trader.handleAccountStocks(account)
     except Exception as e:
         logger.error(f"Error in /stocks endpoint: {str(e)}")
         logger.debug(format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/deals")
-async def deals(account: str = Query('normal', description="账户类型: normal, collateral, credit, track")):
+async def deals(account: str = Query('normal', description="账户类型: normal, collateral, credit, track"), login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """获取指定账户的交易记录"""
+    trader = get_ext(login)
     try:
-        return ext.handleAccountDeals(account)
+        return await run_blocking(trader.handleAccountDeals, account)
     except Exception as e:
         logger.error(f"Error in /deals endpoint: {str(e)}")
         logger.debug(format_exc())
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def stream_events(request, trader):
+    """连接后先推送完整状态, 之后推送该登录的增量事件, 空闲时定期发送注释保持连接"""
+    keepalive = tconfig.get('event_keepalive', 15)
+    queue = event_hub.subscribe()
+    try:
+        yield event_hub.format({'id': event_hub.last_id, 'type': 'snapshot', 'data': await run_blocking(trader.snapshot)})
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ': keepalive\n\n'
+                continue
+            if event['login'] == trader.name:
+                yield event_hub.format(event)
+    finally:
+        event_hub.unsubscribe(queue)
+
+async def stream_snapshots(request, trader):
+    """API进程没有账户层事件, 交易核心的快照变化时推送完整状态"""
+    last = None
+    idle = 0
+    while not await request.is_disconnected():
+        state = trader.snapshot()
+        if state != last:
+            last = state
+            idle = 0
+            yield event_hub.format({'id': event_hub.last_id, 'type': 'snapshot', 'data': state})
+        elif idle >= tconfig.get('event_keepalive', 15):
+            idle = 0
+            yield ': keepalive\n\n'
+        await asyncio.sleep(state_snapshot.interval)
+        idle += state_snapshot.interval
+
+@app.get("/events")
+async def events(request: Request, login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
+    """推送持仓、资产、成交、行情和系统状态的变化(Server-Sent Events)"""
+    trader = get_ext(login)
+    stream = stream_snapshots if role == 'api' else stream_events
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(stream(request, trader), media_type='text/event-stream', headers=headers)
+
 @app.get("/iunstrs")
 async def iunstrs():
     """获取配置的iunstrs信息"""
@@ -314,16 +630,14 @@ async def iunstrs():
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/rzrq")
-async def rzrq(code: str = Query(..., description="股票代码，必填")):
+async def rzrq(code: str = Query(..., description="股票代码，必填"), login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """检查股票是否支持融资融券"""
+    trader = get_ext(login)
     try:
-        if not ext.running:
-            return False
-
         if not code:
             raise HTTPException(status_code=400, detail="Stock code is required")
 
-        return accld.check_rzrq(code)
+        return await run_blocking(trader.handleRzrq, code)
     except Exception as e:
         logger.error(f"Error checking rzrq for code {code}: {str(e)}")
         logger.debug(format_exc())
@@ -333,7 +647,7 @@ async def rzrq(code: str = Query(..., description="股票代码，必填")):
 async def istradingdate():
     """获取当天是否是交易日"""
     try:
-        return {"isTradeDay": is_today_trading_day()}
+        return {"isTradeDay": await run_blocking(is_today_trading_day)}
     except Exception as e:
         logger.error(f"Error in /istradingdate endpoint: {str(e)}")
         logger.debug(format_exc())
@@ -412,23 +726,11 @@ async def update_config(request: ConfigUpdateRequest):
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
 @app.get("/assets")
-async def get_assets(account: str = Query('normal', description="账户类型")):
+async def get_assets(account: str = Query('normal', description="账户类型"), login: Optional[str] = Query(None, description="登录名, 为空时为默认登录")):
     """获取账户资产信息"""
+    trader = get_ext(login)
     try:
-        if not ext.running:
-            return {"error": "Trading system is not running", "assets": {}}
-
-        if account not in accld.all_accounts:
-            return {"error": f"Invalid account: {account}", "assets": {}}
-
-        acc = accld.all_accounts[account]
-        assets = {
-            "pure_assets": acc.pure_assets,
-            "available_money": acc.available_money,
-            "account_type": account
-        }
-
-        return {"account": account, "assets": assets}
+        return trader.handleAccountAssets(account)
     except Exception as e:
         logger.error(f"Error getting assets for account {account}: {str(e)}")
         logger.debug(format_exc())
@@ -437,17 +739,38 @@ async def get_assets(account: str = Query('normal', description="账户类型"))
 
 
 def start_server():
+    if role == 'api':
+        # API进程不登录券商也不设置定时任务, 由uvicorn启动多个worker进程
+        uvicorn.run(
+            "emtrader:app",
+            host="0.0.0.0",
+            port=port,
+            workers=tconfig.get('api_workers', 4),
+            log_config=None,
+            access_log=True
+        )
+        return
+
     # 设置定时任务
-    ext.schedule()
+    scheduler.calendar = is_today_trading_day
+    # 启动时加载验证码识别模型, 避免登录时再加载
+    captcha.load_model()
+    for trader in extensions.values():
+        trader.schedule()
+    if role == 'core':
+        state_snapshot.start(publish_state, state_version)
 
     # 启动服务器 - 禁用uvicorn的默认日志配置，使用我们的自定义logger
     uvicorn.run(
         app,
-        host="0.0.0.0",
-        port=port,
+        host="127.0.0.1" if role == 'core' else "0.0.0.0",
+        port=core_port if role == 'core' else port,
         log_config=None,  # 禁用默认日志配置
         access_log=True
     )
+    state_snapshot.stop()
+    # 退出前上传队列中剩余的成交
+    deal_uploader.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import json
+import time
+import asyncio
+import threading
+from lofig import Config
+
+
+class event_hub:
+    """服务器推送事件
+    账户层在任意线程中publish持仓、资产、成交、行情和系统状态的增量事件,
+    每个SSE连接在自己的事件循环中subscribe一个有界队列, 队列满时丢弃最早的事件并计数
+    versions记录每种事件最后的id, 用于判断状态是否变化
+    """
+    queue_size = Config.trade_config().get('event_queue_size', 256)
+    subscribers = []
+    last_id = 0
+    versions = {}
+    metrics = {'published': 0, 'dropped': 0}
+    lock = threading.Lock()
+
+    @classmethod
+    def publish(self, etype, data, login=None):
+        with self.lock:
+            self.last_id += 1
+            self.versions[etype] = self.last_id
+            event = {'id': self.last_id, 'type': etype, 'login': login, 'time': time.time(), 'data': data}
+            self.metrics['published'] += 1
+            subscribers = list(self.subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.deliver, queue, event)
+            except RuntimeError:
+                # 事件循环已关闭
+                self.unsubscribe(queue)
+        return event
+
+    @classmethod
+    def deliver(self, queue, event):
+        if queue.full():
+            queue.get_nowait()
+            self.metrics['dropped'] += 1
+        queue.put_nowait(event)
+
+    @classmethod
+    def subscribe(self):
+        """在事件循环中调用, 返回接收事件的队列"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.append((asyncio.get_running_loop(), queue))
+        return queue
+
+    @classmethod
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s[1] is not queue]
+
+    @staticmethod
+    def format(event):
+        """SSE格式的事件"""
+        data = json.dumps(event['data'], default=str, ensure_ascii=False)
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {data}\n\n"
+
+    @classmethod
+    def version(self, etypes):
+        with self.lock:
+            return tuple(self.versions.get(t) for t in etypes)
+
+    @classmethod
+    def stats(self):
+        with self.lock:
+            return {**self.metrics, 'subscribers': len(self.subscribers), 'last_id': self.last_id}
@@ -1,19 +1,81 @@
+import os
 import rsa
+import json
+import time
 import base64
-import random
-import requests
+import hashlib
 import re
-from functools import lru_cache, cached_property
-import importlib.util
-if importlib.util.find_spec("ddddocr"):
-    from ddddocr import DdddOcr
+import threading
+import requests
 from misc import join_url
 from lofig import logger, Config
+from transport import transport
+from captcha import captcha
+from scheduler import scheduler
+
+
+class BrokerSession(requests.Session):
+    """券商交易接口session
+    带validatekey的请求遇到登录失效时, 等待jywg在后台重新登录, 然后用新的validatekey重发请求
+    下单、撤单等提交类接口可能已被券商受理, 重新登录后不重发, 由调用方按失败处理
+    请求成功时延长登录有效期
+    """
+    auth_status = Config.trade_config().get('auth_fail_status', [])
+    auth_messages = Config.trade_config().get('auth_fail_messages', ['会话已超时，请重新登录'])
+    no_replay = ('submittradev2', 'submitbattradev2', 'submitzjhk', 'securitieslendingrepurchasetrade', 'revokeorders')
+
+    def __init__(self):
+        super().__init__()
+        self.manager = None
+
+    def auth_failed(self, rsp):
+        if rsp.status_code in (401, 403) or '/Login' in rsp.url:
+            return True
+        if 'json' not in rsp.headers.get('Content-Type', ''):
+            return False
+        try:
+            robj = rsp.json()
+        except Exception:
+            return False
+        if not isinstance(robj, dict) or robj.get('Status', 0) == 0:
+            return False
+        if robj['Status'] in self.auth_status:
+            return True
+        # 业务错误的Message中也可能出现登录等字样, 只匹配完整的登录失效消息
+        return str(robj.get('Message', '')).strip().rstrip('!！。') in self.auth_messages
+
+    def replayable(self, url):
+        return url.split('?')[0].rstrip('/').rsplit('/', 1)[-1].lower() not in self.no_replay
+
+    def request(self, method, url, *args, **kwargs):
+        rsp = super().request(method, url, *args, **kwargs)
+        if self.manager is None or 'validatekey=' not in url:
+            return rsp
+        if not self.auth_failed(rsp):
+            self.manager.touch()
+            return rsp
+
+        logger.warning('登录已失效: %s', url.split('?')[0])
+        if not self.replayable(url):
+            # 提交类请求不重发, 不等待登录完成, 立即返回失败
+            self.manager.start_relogin()
+            return rsp
+        if not self.manager.relogin():
+            return rsp
+        url = re.sub(r'validatekey=[^&]*', f'validatekey={self.manager.validate_key}', url)
+        rsp = super().request(method, url, *args, **kwargs)
+        if not self.auth_failed(rsp):
+            self.manager.touch()
+        return rsp
 
 
 class jywg:
+    keepalive_margin = Config.trade_config().get('keepalive_margin', 120)
+    relogin_timeout = Config.trade_config().get('relogin_timeout', 60)
+
     def __init__(self, account, pwd, credit=False, active_time=30):
-        self.session = requests.session()
+        self.session = transport.new_session(session_class=BrokerSession)
+        self.session.manager = self
         self.session.headers.update({
             "User-Agent": 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:138.0) Gecko/20100101 Firefox/138.0',
             'Connection': 'keep-alive',
@@ -25,65 +87,50 @@ class jywg:
         self.margin_trade = credit
         self.basejs = None
         self.validate_key = None
+        self.rand_num = None
         self.mxretry = 5
+        self.expires = 0
+        self.pubkey_pem = None
+        self.pubkey = None
+        self.pubkey_cached = False
+        self.encrypted = None
+        self.lock = threading.Lock()
+        self.relogin_event = None
+        self.relogin_ok = False
+        self.keepalive_job = None
 
-    @lru_cache(maxsize=1)
     def load_page(self):
+        # 登录前访问首页获取初始cookie, 同时得到BaseJS地址
         rsp = self.session.get(self.jywg)
         bjsreg = re.compile('<script src="(/JsBundles/BaseJS.*)"></script>')
         match = bjsreg.search(rsp.text)
         self.basejs = self.jywg + (match.group(1) if match else '/JsBundles/BaseJS')
 
-    @cached_property
-    def rand_num(self) -> str:
-        """随机数属性，可以通过清除缓存"""
-        return str(random.random())
-
     @property
     def vcodeurl(self):
-        if hasattr(self, 'rand_num'):
-            del self.rand_num
-        return 'https://jywg.eastmoneysec.com/Login/YZM?randNum=' + self.rand_num
-
-    @cached_property
-    def ocr(self):
-        if importlib.util.find_spec("ddddocr"):
-            return DdddOcr(show_ad=False)
-        return None
+        return 'https://jywg.eastmoneysec.com/Login/YZM?randNum='
 
     def get_refreshed_vcode(self):
-        rsp = self.session.get(self.vcodeurl)
-        vcode = ''
-        if self.ocr:
-            vcode = self.ocr.classification(rsp.content)
-        else:
-            url = join_url(Config.data_service()['server'], 'api/captcha')
-            data = {'img': base64.b64encode(rsp.content).decode('utf-8')}
-            r = requests.post(url, data=data)
-            r.raise_for_status()
-            vcode = r.text.replace('"', '').strip()
+        vcode, rand_num = captcha.solve(self.session, self.vcodeurl)
+        self.rand_num = rand_num
+        return vcode
 
-        if len(vcode) != 4:
-            logger.warning('验证码不合法 %s, %d', vcode, len(vcode))
-            return self.get_refreshed_vcode()
+    default_public_key = (
+        "-----BEGIN PUBLIC KEY-----\n"
+        "MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDHdsyxT66pDG4p73yope7jxA92\n"
+        "c0AT4qIJ/xtbBcHkFPK77upnsfDTJiVEuQDH+MiMeb+XhCLNKZGp0yaUU6GlxZdp\n"
+        "+nLW8b7Kmijr3iepaDhcbVTsYBWchaWUXauj9Lrhz58/6AE/NF0aMolxIGpsi+ST\n"
+        "2hSHPu3GSXMdhPCkWQIDAQAB\n-----END PUBLIC KEY-----")
 
-        replace_map = {
-            'g': '9', 'Q': '0', 'i': '1', 'D': '0', 'C': '0', 'u': '0',
-            'U': '0', 'z': '7', 'Z': '7', 'c': '0', 'o': '0', 'q': '9'
-        }
-        fvcode = ''
-        for c in vcode:
-            if c.isdigit():
-                fvcode += c
-                continue
-            if c in replace_map:
-                fvcode += replace_map[c]
-            else:
-                return self.get_refreshed_vcode()
-        return fvcode
+    @property
+    def pubkey_path(self):
+        return os.path.join(os.path.dirname(Config._cfg_path()), 'pubkey.json')
 
-    @cached_property
-    def public_key(self) -> str:
+    @staticmethod
+    def fingerprint(pem):
+        return hashlib.sha256(pem.encode('utf-8')).hexdigest()
+
+    def fetch_public_key(self):
         if self.basejs is None:
             self.load_page()
         rsp = self.session.get(self.basejs)
@@ -91,18 +138,66 @@ class jywg:
         match = reg.search(rsp.text)
         if match:
             return match.group(1).replace('\\n', '\n')
+        return None
+
+    def load_public_key(self):
+        """读取保存的公钥, 指纹不符或超过pubkey_ttl时返回None"""
+        if not os.path.isfile(self.pubkey_path):
+            return None
+        try:
+            with open(self.pubkey_path, 'r') as f:
+                saved = json.load(f)
+        except Exception as e:
+            logger.error('load public key error: %s', e)
+            return None
+        if saved.get('fingerprint') != self.fingerprint(saved.get('pem', '')):
+            return None
+        if time.time() - saved.get('fetched', 0) > Config.trade_config().get('pubkey_ttl', 7 * 86400):
+            return None
+        return saved['pem']
+
+    def save_public_key(self, pem):
+        try:
+            tmp = self.pubkey_path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'pem': pem, 'fingerprint': self.fingerprint(pem), 'fetched': time.time()}, f)
+            os.replace(tmp, self.pubkey_path)
+        except Exception as e:
+            logger.error('save public key error: %s', e)
 
-        return (
-            "-----BEGIN PUBLIC KEY-----\n"
-            "MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDHdsyxT66pDG4p73yope7jxA92\n"
-            "c0AT4qIJ/xtbBcHkFPK77upnsfDTJiVEuQDH+MiMeb+XhCLNKZGp0yaUU6GlxZdp\n"
-            "+nLW8b7Kmijr3iepaDhcbVTsYBWchaWUXauj9Lrhz58/6AE/NF0aMolxIGpsi+ST\n"
-            "2hSHPu3GSXMdhPCkWQIDAQAB\n-----END PUBLIC KEY-----")
+    @property
+    def public_key(self) -> str:
+        if self.pubkey_pem is None:
+            pem = self.load_public_key()
+            self.pubkey_cached = pem is not None
+            if pem is None:
+                pem = self.fetch_public_key()
+                if pem:
+                    self.save_public_key(pem)
+            self.pubkey_pem = pem or self.default_public_key
+        return self.pubkey_pem
+
+    @property
+    def rsa_key(self):
+        if self.pubkey is None:
+            self.pubkey = rsa.PublicKey.load_pkcs1_openssl_pem(self.public_key.encode('utf-8'))
+        return self.pubkey
+
+    def refresh_public_key(self):
+        """登录提示密钥错误时重新获取公钥"""
+        logger.info('重新获取登录公钥')
+        if os.path.isfile(self.pubkey_path):
+            os.remove(self.pubkey_path)
+        self.pubkey_pem = None
+        self.pubkey = None
+        self.encrypted = None
 
     def encrypted_pwd(self):
-        pub_key = rsa.PublicKey.load_pkcs1_openssl_pem(self.public_key.encode('utf-8'))
-        encrypted = rsa.encrypt(Config.simple_decrypt(self.mypassword).encode('utf-8'), pub_key)
-        return base64.b64encode(encrypted).decode('utf-8')
+        # 同一公钥只加密一次, 登录重试时直接使用
+        if self.encrypted is None:
+            encrypted = rsa.encrypt(Config.simple_decrypt(self.mypassword).encode('utf-8'), self.rsa_key)
+            self.encrypted = base64.b64encode(encrypted).decode('utf-8')
+        return self.encrypted
 
     @property
     def login_url(self):
@@ -125,12 +220,22 @@ class jywg:
             logger.error("请提供交易密码")
             return False
 
+        if self.restore_session():
+            return True
+
+        self.load_page()
+        self.encrypted_pwd()
+        key_refreshed = False
         retry = 0
         while retry < self.mxretry:
+            vcode = self.get_refreshed_vcode()
+            if not vcode:
+                return False
+
             data = {
                 'userId': self.myuserid,
                 'password': self.encrypted_pwd(),
-                'identifyCode': self.get_refreshed_vcode(),
+                'identifyCode': vcode,
                 'randNumber': self.rand_num,
                 'duration': str(self.keep_active),
                 'authCode': "",
@@ -148,8 +253,18 @@ class jywg:
                 # 处理登录响应
                 if result.get('Status') == 0:
                     logger.info("登录成功")
+                    captcha.report(True)
                     return self.fetch_validate_key()
                 else:
+                    if '验证码' in result.get('Message', ''):
+                        captcha.report(False)
+                    # 保存的公钥可能已被券商更换, 指纹只能发现文件损坏, 登录失败时重新获取一次
+                    message = result.get('Message', '')
+                    key_error = any(k in message for k in ['密钥', '解密', '公钥'])
+                    if not key_refreshed and (key_error or (self.pubkey_cached and '验证码' not in message)):
+                        key_refreshed = True
+                        self.refresh_public_key()
+                        self.encrypted_pwd()
                     if result.get('ErrCode') == -1:
                         logger.error(f"登录失败: {result.get('Message', '未知错误')}")
                         retry += 1
@@ -185,6 +300,8 @@ class jywg:
             if match:
                 self.validate_key = match.group(1)
                 logger.info(f"获取验证密钥成功: {self.validate_key[:8]}...{self.validate_key[-4:]}")
+                self.touch()
+                self.save_session()
                 return True
             else:
                 logger.error("未找到验证密钥")
@@ -194,4 +311,110 @@ class jywg:
             logger.error(f"跳转到交易页面失败: {str(e)}")
             return False
 
+    @property
+    def session_path(self):
+        return os.path.join(os.path.dirname(Config._cfg_path()), f'session_{self.myuserid}.json')
+
+    def save_session(self):
+        """保存登录状态, 重启后在有效期内可以跳过登录"""
+        state = {
+            'cookies': [{
+                'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path
+            } for c in self.session.cookies],
+            'validate_key': self.validate_key,
+            'expires': self.expires
+        }
+        try:
+            tmp = self.session_path + '.tmp'
+            with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.session_path)
+        except Exception as e:
+            logger.error('save session error: %s', e)
+
+    def clear_session(self):
+        if os.path.isfile(self.session_path):
+            os.remove(self.session_path)
+
+    def restore_session(self):
+        """加载保存的登录状态, 访问交易页面验证仍然有效"""
+        if not os.path.isfile(self.session_path):
+            return False
+        try:
+            with open(self.session_path, 'r') as f:
+                state = json.load(f)
+        except Exception as e:
+            logger.error('load session error: %s', e)
+            return False
+
+        if state.get('expires', 0) < time.time():
+            logger.info('保存的登录状态已过期')
+            self.clear_session()
+            return False
+
+        for c in state.get('cookies', []):
+            self.session.cookies.set(c['name'], c['value'], domain=c['domain'], path=c['path'])
+        self.validate_key = state.get('validate_key')
+        if self.fetch_validate_key():
+            logger.info('使用保存的登录状态')
+            return True
+
+        logger.info('保存的登录状态已失效')
+        self.session.cookies.clear()
+        self.validate_key = None
+        self.clear_session()
+        return False
+
+    def touch(self):
+        # 登录有效期从最后一次成功请求开始计算
+        self.expires = time.time() + self.keep_active
+
+    def start_relogin(self):
+        """开始后台重新登录, 已在登录时不重复登录, 返回登录完成的事件"""
+        with self.lock:
+            if self.relogin_event is None:
+                self.relogin_event = threading.Event()
+                threading.Thread(target=self.do_relogin, args=(self.relogin_event,), name='relogin', daemon=True).start()
+            return self.relogin_event
+
+    def relogin(self):
+        """后台重新登录并等待, 多个请求同时失效时只登录一次, 返回是否登录成功"""
+        event = self.start_relogin()
+        if not event.wait(self.relogin_timeout):
+            logger.error('重新登录超时')
+            return False
+        return self.relogin_ok
+
+    def do_relogin(self, event):
+        logger.info('重新登录...')
+        self.clear_session()
+        try:
+            self.relogin_ok = self.validate()
+        except Exception as e:
+            logger.error('重新登录失败: %s', e)
+            self.relogin_ok = False
+        with self.lock:
+            self.relogin_event = None
+        event.set()
+
+    def keepalive(self):
+        """scheduler任务, 返回下次检查的延迟"""
+        wait = self.expires - self.keepalive_margin - time.time()
+        if wait > 0:
+            return wait
+        if not self.fetch_validate_key():
+            self.relogin()
+            if not self.relogin_ok:
+                return self.keepalive_margin
+        return max(self.expires - self.keepalive_margin - time.time(), 0)
+
+    def start_keepalive(self):
+        """登录有效期结束前访问交易页面保持登录"""
+        if self.keepalive_job in scheduler.jobs:
+            return
+        self.keepalive_job = scheduler.add_job(self.keepalive, name='keepalive')
 
+    def stop_keepalive(self):
+        if self.keepalive_job is not None:
+            scheduler.cancel(self.keepalive_job)
+        self.keepalive_job = None
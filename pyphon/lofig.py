@@ -54,6 +54,11 @@ class Config:
         if 'pwd' in allconfigs['fha'] and not allconfigs['fha']['pwd'].startswith('*'):
             allconfigs['fha']['pwd'] = self.simple_encrypt(allconfigs['fha']['pwd'])
             bsave = True
+        for login in allconfigs.get('logins', []):
+            for sec in ('unp', 'fha'):
+                if sec in login and login[sec].get('pwd') and not login[sec]['pwd'].startswith('*'):
+                    login[sec]['pwd'] = self.simple_encrypt(login[sec]['pwd'])
+                    bsave = True
         if bsave:
             self.save(allconfigs)
 
@@ -90,6 +95,11 @@ class Config:
     def account(self):
         return self.all_configs()['unp']
 
+    @classmethod
+    def logins(self):
+        # 额外的券商登录, 每项为 {"name": 登录名, "unp": 账户配置, "fha": 可选的数据服务配置}
+        return self.all_configs().get('logins', [])
+
     @classmethod
     def trade_config(self):
         return self.all_configs()['client']
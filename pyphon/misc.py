@@ -1,8 +1,15 @@
-import requests
 import math
 import re
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime
 from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from transport import transport
+from lofig import logger, Config
+
+quote_server = Config.trade_config().get('quote_server', 'https://hsmarketwg.eastmoney.com')
 
 def delay_seconds(daytime:str)->float:
     '''计算当前时间到daytime的时间间隔'''
@@ -14,6 +21,10 @@ def delay_seconds(daytime:str)->float:
     target_time = dnow.replace(hour=hr, minute=minutes, second=secs)
     return (target_time - dnow).total_seconds()
 
+def is_trading_time():
+    '''当前是否处于交易时段(含集合竞价)'''
+    return (delay_seconds('9:15') <= 0 <= delay_seconds('11:30')) or (delay_seconds('13:00') <= 0 <= delay_seconds('15:00'))
+
 def join_url(srv, path):
     if srv.endswith('/') and path.startswith('/'):
         return srv + path[1:]
@@ -21,12 +32,67 @@ def join_url(srv, path):
         return srv + path
     return srv + '/' + path
 
+class quote_cache:
+    """行情快照缓存, 按代码保存最近一次快照, 超过ttl秒视为过期, 超过maxsize时淘汰最久未使用的代码"""
+    ttl = Config.trade_config().get('quote_ttl', 2)
+    maxsize = Config.trade_config().get('quote_cache_size', 512)
+    hits = 0
+    misses = 0
+    snapshots = OrderedDict()
+    lock = threading.Lock()
+
+    @classmethod
+    def get(self, code, max_age=None):
+        """获取未过期的快照, max_age为None时使用写入时指定的ttl, 为0时总是返回None"""
+        with self.lock:
+            item = self.snapshots.get(code)
+            if item is None or time.time() - item[0] > (item[2] if max_age is None else max_age):
+                self.misses += 1
+                return None
+            self.snapshots.move_to_end(code)
+            self.hits += 1
+            return item[1]
+
+    @classmethod
+    def put(self, code, snap, ttl=None):
+        with self.lock:
+            self.snapshots[code] = (time.time(), snap, self.ttl if ttl is None else ttl)
+            self.snapshots.move_to_end(code)
+            while len(self.snapshots) > self.maxsize:
+                self.snapshots.popitem(last=False)
+
+    @classmethod
+    def clear(self):
+        with self.lock:
+            self.snapshots.clear()
+            self.hits = 0
+            self.misses = 0
+
+    @classmethod
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.snapshots), 'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+            'hit_rate': self.hits / total if total > 0 else 0
+        }
+
+
 def get_stock_snapshot(code):
-    url = f'https://hsmarketwg.eastmoney.com/api/SHSZQuoteSnapshot?id={code}&callback=?'
-    response = requests.get(url)
+    url = join_url(quote_server, f'api/SHSZQuoteSnapshot?id={code}&callback=?')
+    response = transport.get(url)
     response.raise_for_status()
-    snapshot = response.json()
+    snap = parse_stock_snapshot(code, response.json())
+    quote_cache.put(code, snap)
+    return snap
+
+def get_cached_snapshot(code, max_age=None):
+    """优先使用缓存中的快照, 过期或fresh请求(max_age=0)时重新获取"""
+    snap = quote_cache.get(code, max_age)
+    if snap is None:
+        snap = get_stock_snapshot(code)
+    return snap
 
+def parse_stock_snapshot(code, snapshot):
     realtimequote = snapshot.get('realtimequote', {})
     fivequote = snapshot.get('fivequote', {})
     buysells = {k: v for k, v in fivequote.items() if k.startswith('buy') or k.startswith('sale')}
@@ -60,20 +126,51 @@ def safe_float(v):
     except Exception as e:
         return .0
 
-def get_rt_price(code):
-    try:
-        snap = get_stock_snapshot(code)
-        top_price = snap['top_price']
-        bottom_price = snap['bottom_price']
-        price = snap['price']
-        bid5 = safe_float(snap['buysells']['buy5'])
-        ask5 = safe_float(snap['buysells']['sale5'])
-        if snap['buysells']['sale1'] == snap['buysells']['buy1']:
-            ask5 = min(price * 1.03, top_price)
-            bid5 = max(price * 0.97, bottom_price)
-        return {'top_price': top_price, 'bottom_price': bottom_price, 'price': price, 'ask5': ask5, 'bid5': bid5}
-    except Exception as e:
-        raise e
+def get_stock_snapshots(codes, max_age=None):
+    """并发获取多只股票的快照, 返回 {code: snapshot}, 获取失败的代码不在结果中
+    缓存中未过期的快照直接使用, max_age=0 时全部重新获取
+    """
+    codes = list(dict.fromkeys(codes))
+    snaps = {}
+    for code in codes:
+        snap = quote_cache.get(code, max_age)
+        if snap is not None:
+            snaps[code] = snap
+
+    missing = [c for c in codes if c not in snaps]
+    if len(missing) > 0:
+        def fetch(code):
+            try:
+                return get_stock_snapshot(code)
+            except Exception as e:
+                logger.warning('get snapshot failed %s: %s', code, e)
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(len(missing), transport.pool_size)) as executor:
+            for code, snap in zip(missing, executor.map(fetch, missing)):
+                if snap:
+                    snaps[code] = snap
+
+    return {c: snaps[c] for c in codes if c in snaps}
+
+def rt_price_from_snapshot(snap):
+    top_price = snap['top_price']
+    bottom_price = snap['bottom_price']
+    price = snap['price']
+    bid5 = safe_float(snap['buysells']['buy5'])
+    ask5 = safe_float(snap['buysells']['sale5'])
+    if snap['buysells']['sale1'] == snap['buysells']['buy1']:
+        ask5 = min(price * 1.03, top_price)
+        bid5 = max(price * 0.97, bottom_price)
+    return {'top_price': top_price, 'bottom_price': bottom_price, 'price': price, 'ask5': ask5, 'bid5': bid5}
+
+def get_rt_price(code, max_age=None):
+    """获取实时价格, 默认使用quote_cache.ttl内的缓存快照, max_age=0强制获取最新行情"""
+    return rt_price_from_snapshot(get_cached_snapshot(code, max_age))
+
+def get_rt_prices(codes, max_age=None):
+    """批量获取实时价格, 返回 {code: rt_price}"""
+    return {code: rt_price_from_snapshot(snap) for code, snap in get_stock_snapshots(codes, max_age).items()}
 
 def get_mkt_code(code):
     assert len(code) == 6, f"stock code length should be 6 not {code}"
@@ -97,7 +194,7 @@ def get_system_date():
     从上交所获取系统日期信息
     """
     url = 'http://www.sse.com.cn/js/common/systemDate_global.js'
-    response = requests.get(url, timeout=5)
+    response = transport.get(url, timeout=5)
     response.raise_for_status()
 
     js_content = response.text
@@ -0,0 +1,112 @@
+import threading
+from traceback import format_exc
+from lofig import logger, Config
+from misc import get_stock_snapshots, quote_cache, is_trading_time
+from accounts import AccountLoader
+from scheduler import scheduler
+
+
+class quote_hub:
+    """行情订阅
+    scheduler周期任务定时批量刷新所有账户持仓/关注股票及额外订阅代码的行情, 维护内存盘口并通知监听者
+    刷新得到的快照同时写入quote_cache, 交易路径调用get_rt_price时直接命中
+    """
+    interval = Config.trade_config().get('quote_interval', 3)
+    book = {}
+    watched = set()
+    listeners = []
+    lock = threading.Lock()
+    job = None
+
+    @classmethod
+    def watch(self, codes):
+        with self.lock:
+            self.watched.update(codes)
+
+    @classmethod
+    def unwatch(self, codes):
+        with self.lock:
+            self.watched.difference_update(codes)
+
+    @classmethod
+    def add_listener(self, callback):
+        """callback(code, snapshot, old_snapshot), 行情变化时在刷新线程中调用"""
+        if callback not in self.listeners:
+            self.listeners.append(callback)
+
+    @classmethod
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    @classmethod
+    def codes(self):
+        codes = set(self.watched)
+        # 所有登录共用同一份行情缓存
+        for loader in list(AccountLoader.loaders):
+            for acc in list(loader.all_accounts.values()):
+                codes.update(s['code'] for s in list(acc.stocks) if s.get('code'))
+        return sorted(codes)
+
+    @classmethod
+    def get(self, code):
+        return self.book.get(code)
+
+    @classmethod
+    def price(self, code):
+        snap = self.book.get(code)
+        return snap['price'] if snap else None
+
+    @staticmethod
+    def changed(snap, old):
+        if old is None:
+            return True
+        return any(snap.get(k) != old.get(k) for k in ('price', 'buysells', 'top_price', 'bottom_price'))
+
+    @classmethod
+    def refresh(self):
+        """刷新一次所有订阅代码的行情, 返回发生变化的代码"""
+        codes = self.codes()
+        if len(codes) == 0:
+            return []
+
+        changes = []
+        for code, snap in get_stock_snapshots(codes, 0).items():
+            # 订阅中的代码在下次刷新前都视为最新
+            quote_cache.put(code, snap, self.interval + 1)
+            old = self.book.get(code)
+            self.book[code] = snap
+            if self.changed(snap, old):
+                changes.append((code, snap, old))
+
+        for code, snap, old in changes:
+            for callback in list(self.listeners):
+                try:
+                    callback(code, snap, old)
+                except Exception as e:
+                    logger.error('quote listener error %s: %s', code, e)
+                    logger.debug(format_exc())
+        return [c[0] for c in changes]
+
+    @classmethod
+    def run(self):
+        if not is_trading_time():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.error('refresh quotes error: %s', e)
+            logger.debug(format_exc())
+
+    @classmethod
+    def start(self):
+        if self.job in scheduler.jobs:
+            return
+        self.job = scheduler.add_job(self.run, interval=self.interval, name='quote_hub')
+        logger.info('quote_hub started, interval %ss', self.interval)
+
+    @classmethod
+    def stop(self):
+        if self.job is not None:
+            scheduler.cancel(self.job)
+        self.job = None
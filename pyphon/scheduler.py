@@ -0,0 +1,173 @@
+import time
+import heapq
+import threading
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from traceback import format_exc
+from lofig import logger, Config
+
+
+class scheduler:
+    """单线程调度器, 任务按执行时间存放在堆中, 到期后提交到线程池执行
+    支持一次性和周期任务, 任务回调返回秒数时在该延迟后再次执行, 长时间轮询的任务不占用线程池
+    calendar用于判断当天是否为交易日
+    """
+    jobs = {}
+    queue = []
+    history = deque(maxlen=50)
+    last_id = 0
+    calendar = None
+    trading_days = {}
+    cond = threading.Condition()
+    thread = None
+    # 每个登录有各自的委托轮询和保持登录任务
+    executor = ThreadPoolExecutor(max_workers=Config.trade_config().get('scheduler_workers', 4 + 2 * len(Config.logins())), thread_name_prefix='scheduler')
+
+    @classmethod
+    def add_job(self, callback, delay=0, interval=None, name=None, trading_day_only=False):
+        """添加任务, delay秒后执行, interval不为空时按间隔重复执行, 返回任务id"""
+        with self.cond:
+            self.last_id += 1
+            job = {
+                'id': self.last_id,
+                'name': name or getattr(callback, '__name__', str(callback)),
+                'callback': callback,
+                'interval': interval,
+                'trading_day_only': trading_day_only,
+                'next_run': time.time() + max(delay, 0),
+                'status': 'pending',
+                'runs': 0,
+                'last_duration': None,
+                'max_duration': 0,
+                'total_duration': 0,
+                'last_error': None,
+            }
+            self.jobs[job['id']] = job
+            heapq.heappush(self.queue, (job['next_run'], job['id']))
+            self.cond.notify()
+        self.start()
+        return job['id']
+
+    @classmethod
+    def cancel(self, jid):
+        with self.cond:
+            job = self.jobs.pop(jid, None)
+            if not job:
+                return False
+            job['status'] = 'cancelled'
+            self.history.append(job)
+            self.cond.notify()
+        return True
+
+    @classmethod
+    def reschedule(self, jid, delay=0):
+        """等待中的任务提前到delay秒后执行, 任务正在执行或已结束时返回False"""
+        with self.cond:
+            job = self.jobs.get(jid)
+            if not job or job['status'] != 'pending':
+                return False
+            next_run = time.time() + max(delay, 0)
+            if next_run < job['next_run']:
+                job['next_run'] = next_run
+                heapq.heappush(self.queue, (next_run, jid))
+                self.cond.notify()
+        return True
+
+    @classmethod
+    def is_trading_day(self):
+        if not callable(self.calendar):
+            return True
+        today = datetime.now().strftime('%Y-%m-%d')
+        if today not in self.trading_days:
+            try:
+                self.trading_days[today] = self.calendar()
+            except Exception as e:
+                logger.error('trading calendar error: %s', e)
+                return True
+        return self.trading_days[today]
+
+    @classmethod
+    def start(self):
+        with self.cond:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+            self.thread.start()
+
+    @classmethod
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    # 跳过已取消或已重新排期的堆元素
+                    while self.queue and (self.queue[0][1] not in self.jobs or self.jobs[self.queue[0][1]]['next_run'] != self.queue[0][0]):
+                        heapq.heappop(self.queue)
+                    if self.queue and self.queue[0][0] <= time.time():
+                        _, jid = heapq.heappop(self.queue)
+                        job = self.jobs[jid]
+                        job['status'] = 'running'
+                        break
+                    self.cond.wait(self.queue[0][0] - time.time() if self.queue else None)
+            self.executor.submit(self.execute, job)
+
+    @classmethod
+    def execute(self, job):
+        if job['trading_day_only'] and not self.is_trading_day():
+            logger.info('今天不是交易日，跳过定时任务%s', job['name'])
+            self.finish(job, 'skipped')
+            return
+
+        start = time.time()
+        status = 'done'
+        delay = None
+        try:
+            delay = job['callback']()
+        except Exception as e:
+            status = 'failed'
+            job['last_error'] = str(e)
+            logger.error('job %s error: %s', job['name'], e)
+            logger.debug(format_exc())
+        duration = time.time() - start
+        job['runs'] += 1
+        job['last_duration'] = duration
+        job['total_duration'] += duration
+        job['max_duration'] = max(job['max_duration'], duration)
+        if isinstance(delay, bool) or not isinstance(delay, (int, float)):
+            delay = None
+        self.finish(job, status, delay)
+
+    @classmethod
+    def finish(self, job, status, delay=None):
+        with self.cond:
+            if job['id'] not in self.jobs:
+                return
+            if delay is not None:
+                job['status'] = 'pending'
+                job['next_run'] = time.time() + max(delay, 0)
+                heapq.heappush(self.queue, (job['next_run'], job['id']))
+                self.cond.notify()
+                return
+            if job['interval']:
+                job['status'] = 'pending'
+                job['next_run'] = max(job['next_run'] + job['interval'], time.time())
+                heapq.heappush(self.queue, (job['next_run'], job['id']))
+                self.cond.notify()
+                return
+            job['status'] = status
+            self.history.append(self.jobs.pop(job['id']))
+
+    @classmethod
+    def job_info(self, job):
+        info = {k: v for k, v in job.items() if k != 'callback'}
+        info['next_run'] = datetime.fromtimestamp(job['next_run']).strftime('%Y-%m-%d %H:%M:%S')
+        return info
+
+    @classmethod
+    def stats(self):
+        with self.cond:
+            jobs = sorted(self.jobs.values(), key=lambda j: j['next_run'])
+            return {
+                'jobs': [self.job_info(j) for j in jobs],
+                'history': [self.job_info(j) for j in self.history]
+            }
@@ -0,0 +1,99 @@
+import os
+import json
+import time
+import threading
+from traceback import format_exc
+from lofig import logger, Config
+from scheduler import scheduler
+
+
+class state_snapshot:
+    """交易核心进程发布的状态快照
+    核心进程每interval秒检查一次状态版本, 有变化或距上次发布超过max_age秒时
+    把各登录的状态、持仓、成交和资产写入config目录下的json文件(先写临时文件再替换),
+    API进程只读取快照, 文件修改后才重新解析
+    """
+    interval = Config.trade_config().get('snapshot_interval', 1)
+    max_age = Config.trade_config().get('snapshot_max_age', 10)
+    builder = None
+    version = None
+    last_version = None
+    last_publish = 0
+    cache = None
+    cache_mtime = None
+    lock = threading.Lock()
+    run_lock = threading.Lock()
+    stopped = False
+    job = None
+
+    @classmethod
+    def path(self):
+        return Config.trade_config().get('snapshot_path') or os.path.join(os.path.dirname(Config._cfg_path()), 'state_snapshot.json')
+
+    @classmethod
+    def publish(self, data):
+        data = {**data, 'time': time.time(), 'pid': os.getpid()}
+        pth = self.path()
+        tmp = f'{pth}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(data, f, default=str)
+        os.replace(tmp, pth)
+        return data
+
+    @classmethod
+    def load(self):
+        """读取最新的快照, 没有快照时返回None"""
+        pth = self.path()
+        try:
+            mtime = os.stat(pth).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if mtime != self.cache_mtime:
+                try:
+                    with open(pth, 'r') as f:
+                        self.cache = json.load(f)
+                    self.cache_mtime = mtime
+                except Exception as e:
+                    logger.error('load state snapshot error: %s', e)
+            return self.cache
+
+    @classmethod
+    def age(self, snap):
+        return round(time.time() - snap['time'], 3) if snap else None
+
+    @classmethod
+    def run(self):
+        with self.run_lock:
+            if self.stopped:
+                return
+            version = self.version() if callable(self.version) else None
+            if version is not None and version == self.last_version and time.time() - self.last_publish < self.max_age:
+                return
+            try:
+                self.publish(self.builder())
+                self.last_version = version
+                self.last_publish = time.time()
+            except Exception as e:
+                logger.error('publish state snapshot error: %s', e)
+                logger.debug(format_exc())
+
+    @classmethod
+    def start(self, builder, version=None):
+        """builder返回要发布的状态, version返回状态的版本, 版本不变时不调用builder"""
+        self.builder = builder
+        self.version = version
+        self.last_version = None
+        self.stopped = False
+        if self.job in scheduler.jobs:
+            return
+        self.job = scheduler.add_job(self.run, interval=self.interval, name='state_snapshot')
+
+    @classmethod
+    def stop(self):
+        # 等待正在执行的发布完成, 停止后不再写入快照
+        with self.run_lock:
+            self.stopped = True
+            if self.job is not None:
+                scheduler.cancel(self.job)
+            self.job = None
@@ -0,0 +1,81 @@
+import os
+import json
+import threading
+from lofig import logger, Config
+
+
+class sync_state:
+    """历史成交同步水位
+    按账户和类型记录已上传成交的最新时间, 以及该时间点已上传的成交, 保存在config目录下
+    {acc: {kind: {'time': '2025-01-15 14:30:00', 'keys': ['sid|code|tradeType', ...]}}}
+    """
+    lock = threading.Lock()
+    states = None
+
+    @classmethod
+    def path(self):
+        return os.path.join(os.path.dirname(Config._cfg_path()), 'sync_state.json')
+
+    @classmethod
+    def load(self):
+        if self.states is not None:
+            return self.states
+        self.states = {}
+        pth = self.path()
+        if os.path.isfile(pth):
+            try:
+                with open(pth, 'r') as f:
+                    self.states = json.load(f)
+            except Exception as e:
+                logger.error('load sync state error: %s', e)
+        return self.states
+
+    @classmethod
+    def save(self):
+        pth = self.path()
+        tmp = pth + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.states, f, indent=4)
+        os.replace(tmp, pth)
+
+    @staticmethod
+    def deal_key(deal):
+        return f"{deal.get('sid', '')}|{deal.get('code', '')}|{deal.get('tradeType', '')}"
+
+    @classmethod
+    def watermark(self, acc, kind):
+        with self.lock:
+            return self.load().get(acc, {}).get(kind)
+
+    @classmethod
+    def since_date(self, acc, kind, date):
+        """有水位时从水位所在日期开始查询, 否则使用date"""
+        wm = self.watermark(acc, kind)
+        if not wm:
+            return date
+        return wm['time'][:10]
+
+    @classmethod
+    def filter_new(self, acc, kind, deals):
+        """过滤出水位之后的成交"""
+        wm = self.watermark(acc, kind)
+        if not wm:
+            return deals
+        keys = set(wm['keys'])
+        return [d for d in deals if d['time'] > wm['time'] or (d['time'] == wm['time'] and self.deal_key(d) not in keys)]
+
+    @classmethod
+    def advance(self, acc, kind, deals):
+        """上传成功后推进水位"""
+        if len(deals) == 0:
+            return
+        latest = max(d['time'] for d in deals)
+        with self.lock:
+            states = self.load()
+            wm = states.setdefault(acc, {}).get(kind)
+            if wm and wm['time'] > latest:
+                return
+            keys = set(wm['keys']) if wm and wm['time'] == latest else set()
+            keys.update(self.deal_key(d) for d in deals if d['time'] == latest)
+            states[acc][kind] = {'time': latest, 'keys': sorted(keys)}
+            self.save()
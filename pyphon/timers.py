@@ -1,112 +1,145 @@
 import random
 from time import sleep
-from threading import Timer
+from datetime import datetime
 from traceback import format_exc
-from lofig import logger
+from lofig import logger, Config
 from accounts import accld
 from misc import delay_seconds
+from scheduler import scheduler
 
 
-class alarm_hub:
-    timers = []
-    last_tid = 0
-    purchase_new_stocks = False
-    on_trade_closed = None
+class AlarmHub:
+    """一个登录的交易日定时任务和委托轮询, 所有登录共用同一个scheduler"""
+    poll_fast = Config.trade_config().get('poll_fast', 5)
+    poll_slow = Config.trade_config().get('poll_slow', 600)
 
-    @classmethod
-    def add_timer_task(self, callback, target_time, end_time=None) -> int:
+    def __init__(self, loader=None):
+        self._loader = loader
+        self.purchase_new_stocks = False
+        self.on_trade_closed = None
+        self.poll_interval = None
+        self.poll_job = None
+        self.last_poll = None
+
+    @property
+    def accld(self):
+        return self._loader or accld
+
+    @property
+    def name(self):
+        return self._loader.name if self._loader else None
+
+    def add_timer_task(self, callback, target_time, end_time=None, trading_day_only=False) -> int:
         seconds_until = delay_seconds(target_time)
         if seconds_until < 0:
             if end_time is None or delay_seconds(end_time) < 0:
                 return
             seconds_until = 0.1
 
-        timer = Timer(seconds_until, callback)
-        timer.daemon = True
-        timer.start()
-        tid = self.last_tid + 1
-        self.timers.append({'id': tid, 'timer': timer})
+        name = f'{self.name}:{callback.__name__}' if self.name else None
+        tid = scheduler.add_job(callback, seconds_until, name=name, trading_day_only=trading_day_only)
         logger.info(f"已设置定时任务{callback.__name__}，将在 {target_time if seconds_until > 1 else '现在'} 执行")
         return tid
 
-    @classmethod
+    def add_interval_task(self, callback, interval, delay=0, trading_day_only=False) -> int:
+        return scheduler.add_job(callback, delay, interval=interval, trading_day_only=trading_day_only)
+
     def cancel_task(self, tid):
-        t = next((t for t in self.timers if t['id'] == tid), None)
-        if t:
-            t['timer'].cancel()
+        return scheduler.cancel(tid)
 
-    @classmethod
-    def check_orders(self):
-        short_seconds_wait = 600
-        waiting_ids = []
-        while True:
+    def order_accounts(self):
+        # 融资账户的委托记录在担保品账户中, 不需要单独查询
+        return [acc for acc in list(self.accld.all_accounts.values()) if acc.hold_account is acc]
+
+    def poll_orders(self):
+        """查询所有账户的委托, 返回是否还有未成交的委托"""
+        pending = False
+        for acc in self.order_accounts():
             try:
-                accld.normal_account.check_orders()
-                if accld.collateral_account:
-                    accld.collateral_account.check_orders()
+                acc.check_orders()
             except Exception as e:
                 logger.error(e)
                 logger.debug(format_exc())
+            if acc.pending_orders():
+                pending = True
+        self.last_poll = datetime.now().strftime('%H:%M:%S')
+        return pending
+
+    def next_poll_interval(self, pending):
+        """有未成交委托时快速轮询, 否则逐步退避, 午休期间等到13:00"""
+        if pending or self.poll_interval is None:
+            interval = self.poll_fast
+        else:
+            interval = min(self.poll_interval * 2, self.poll_slow)
+        if delay_seconds('11:30') < 0 and delay_seconds('13:00') > 0:
+            return max(delay_seconds('13:0:5'), interval)
+        return interval
+
+    def poll_status(self):
+        return {
+            'interval': self.poll_interval,
+            'last_poll': self.last_poll,
+            'pending': sum(len(acc.pending_orders()) for acc in self.order_accounts())
+        }
+
+    def check_orders(self):
+        """查询一次委托, 返回下次查询的延迟, 14:55之后返回None结束轮询
+        作为scheduler任务执行, 等待期间不占用线程池
+        """
+        self.accld.order_signal.clear()
+        pending = self.poll_orders()
+        if delay_seconds('14:55') < 0:
+            self.poll_interval = None
+            return None
+
+        # 查询期间有新委托提交时尽快再查一次
+        if self.accld.order_signal.is_set():
+            pending = True
+        self.poll_interval = self.next_poll_interval(pending)
+        return self.poll_interval
+
+    def wakeup(self):
+        """有新委托提交时立即唤醒轮询"""
+        if self.poll_job is not None:
+            scheduler.reschedule(self.poll_job, 0)
 
-            if delay_seconds('14:55') < 0:
-                break
-
-            seconds = 600
-            if delay_seconds('11:00') < 0 and delay_seconds('13:00') > 0:
-                seconds = delay_seconds('13:0:5')
-            wids = []
-            for r in accld.normal_account.trading_records:
-                if r['sid'] not in waiting_ids:
-                    wids.append(r['sid'])
-            if accld.collateral_account:
-                for r in accld.collateral_account.trading_records:
-                    if r['sid'] not in waiting_ids:
-                        wids.append(r['sid'])
-            if len(wids) > 0:
-                waiting_ids.extend(wids)
-                short_seconds_wait = 5
-            else:
-                short_seconds_wait *= 2
-
-            sleep(min(short_seconds_wait, seconds))
-
-    @classmethod
     def daily_routine_tasks(self):
         if self.purchase_new_stocks:
-            accld.buy_new_stocks()
-        accld.buy_new_bonds()
+            self.accld.buy_new_stocks()
+        self.accld.buy_new_bonds()
 
-    @classmethod
     def before_trade_close(self):
-        accld.normal_account.buy_fund_before_close()
-        if accld.collateral_account:
-            accld.collateral_account.buy_fund_before_close()
+        self.accld.normal_account.buy_fund_before_close()
+        if self.accld.collateral_account:
+            self.accld.collateral_account.buy_fund_before_close()
 
-    @classmethod
     def trade_closed(self):
         """收盘后处理逻辑
         先执行一遍before close的国债逆回购和融资还款流程, 然后进行盘后处理
         """
-        accld.normal_account.buy_fund_before_close()
-        if accld.collateral_account:
-            accld.repay_margin_loan()
+        self.accld.normal_account.buy_fund_before_close()
+        if self.accld.collateral_account:
+            self.accld.repay_margin_loan()
 
         sleep(30)
         logger.info("交易日结束，执行收盘后处理")
 
         # 保存当日交易数据
-        for acc in accld.all_accounts.values():
+        for acc in self.accld.all_accounts.values():
             acc.load_deals()
 
         # 更新状态
         if callable(self.on_trade_closed):
             self.on_trade_closed()
 
-    @classmethod
     def setup_alarms(self):
-        accld.upload_every_monday()
-        self.add_timer_task(self.check_orders, '9:30:10', '14:53')
+        self.accld.upload_every_monday()
+        self.accld.order_signal.add_callback(self.wakeup)
+        self.poll_job = self.add_timer_task(self.check_orders, '9:30:10', '14:53', trading_day_only=True)
         timerand = random.choice([f'9:{random.randint(40, 59)}', f'10:{random.randint(0, 40)}'])
-        self.add_timer_task(self.daily_routine_tasks, timerand)
-        self.add_timer_task(self.before_trade_close, '14:59:48')
-        self.add_timer_task(self.trade_closed, '15:0:10')
+        self.add_timer_task(self.daily_routine_tasks, timerand, trading_day_only=True)
+        self.add_timer_task(self.before_trade_close, '14:59:48', trading_day_only=True)
+        self.add_timer_task(self.trade_closed, '15:0:10', trading_day_only=True)
+
+
+alarm_hub = AlarmHub()
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import importlib.util
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+if importlib.util.find_spec("httpx"):
+    import httpx
+from lofig import Config
+
+
+class transport:
+    """按host复用长连接的HTTP传输层
+    同步接口基于requests, 异步接口优先使用httpx(安装h2时启用HTTP/2), 否则退回线程池执行同步请求
+    """
+    pool_size = Config.trade_config().get('pool_size', 10)
+    timeout = Config.trade_config().get('http_timeout', 10)
+    sessions = {}
+    aclients = {}
+    lock = threading.Lock()
+
+    @classmethod
+    def configure(self, pool_size=None, timeout=None):
+        if pool_size:
+            self.pool_size = pool_size
+        if timeout:
+            self.timeout = timeout
+
+    @classmethod
+    def host(self, url):
+        parts = urlsplit(url)
+        return f'{parts.scheme}://{parts.netloc}'
+
+    @classmethod
+    def new_session(self, pool_size=None, session_class=requests.Session):
+        """创建独立的连接池session, 用于需要独立cookie的场景(如券商登录)"""
+        pool_size = pool_size or self.pool_size
+        session = session_class()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    @classmethod
+    def session(self, url):
+        """获取url所在host共享的session"""
+        host = self.host(url)
+        with self.lock:
+            if host not in self.sessions:
+                self.sessions[host] = self.new_session()
+            return self.sessions[host]
+
+    @classmethod
+    def get(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).get(url, **kwargs)
+
+    @classmethod
+    def post(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session(url).post(url, **kwargs)
+
+    @classmethod
+    def http2_enabled(self):
+        return importlib.util.find_spec("h2") is not None
+
+    @classmethod
+    def async_client(self, url):
+        host = self.host(url)
+        with self.lock:
+            if host not in self.aclients:
+                limits = httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size)
+                self.aclients[host] = httpx.AsyncClient(http2=self.http2_enabled(), limits=limits, timeout=self.timeout)
+            return self.aclients[host]
+
+    @classmethod
+    async def arequest(self, method, url, **kwargs):
+        if importlib.util.find_spec("httpx"):
+            return await self.async_client(url).request(method, url, **kwargs)
+        return await asyncio.to_thread(self.get if method == 'GET' else self.post, url, **kwargs)
+
+    @classmethod
+    async def aget(self, url, **kwargs):
+        return await self.arequest('GET', url, **kwargs)
+
+    @classmethod
+    async def apost(self, url, **kwargs):
+        return await self.arequest('POST', url, **kwargs)
+
+    @classmethod
+    async def aclose(self):
+        clients = list(self.aclients.values())
+        self.aclients.clear()
+        for c in clients:
+            await c.aclose()
+
+    @classmethod
+    def close(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+            self.sessions.clear()
+        for s in sessions:
+            s.close()
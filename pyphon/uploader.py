@@ -0,0 +1,289 @@
+import os
+import gzip
+import json
+import time
+import heapq
+import threading
+from urllib.parse import urlencode
+from traceback import format_exc
+from lofig import logger, Config
+from transport import transport
+from misc import join_url
+from scheduler import scheduler
+
+
+class deal_uploader:
+    """成交上传队列
+    各账户待上传的成交先合并到队列, scheduler周期任务按数量或时间阈值批量上传,
+    失败时指数退避重试, 队列有变化时由周期任务写入config目录, 未上传的成交在重启后继续上传
+    fha的deals接口每次只接受一个账户, 同一账户的多次调用合并为一次请求
+    队列长度超过max_pending时丢弃最早的成交并记录在metrics中, 成交仍保存在本地存储中,
+    有成交被丢弃的账户下次flush返回False; 历史成交回补等显式上传的成交不会被丢弃
+    多个登录时队列的账户标识为'登录名/账户', 按登录名使用各自的fha上传
+    表单默认以gzip压缩发送(Content-Encoding: gzip), fha服务器不支持时设置upload_gzip为false
+    """
+    batch_size = Config.trade_config().get('upload_batch', 500)
+    interval = Config.trade_config().get('upload_interval', 2)
+    max_retry = Config.trade_config().get('upload_retry', 3)
+    backoff = Config.trade_config().get('upload_backoff', 1)
+    compress = Config.trade_config().get('upload_gzip', True)
+    max_pending = Config.trade_config().get('upload_queue_size', 10000)
+    fha = None
+    fhas = {}
+    queues = None
+    dirty = False
+    protected = set()
+    dropped_accs = {}
+    metrics = {
+        'enqueued': 0, 'sent': 0, 'failed': 0, 'dropped': 0, 'saves': 0,
+        'max_depth': 0, 'last_flush': None, 'last_error': None
+    }
+    lock = threading.Condition()
+    send_lock = threading.Lock()
+    stop_event = threading.Event()
+    job = None
+
+    @classmethod
+    def path(self):
+        return os.path.join(os.path.dirname(Config._cfg_path()), 'upload_queue.json')
+
+    @classmethod
+    def load(self):
+        if self.queues is not None:
+            return self.queues
+        self.queues = {}
+        pth = self.path()
+        if os.path.isfile(pth):
+            try:
+                with open(pth, 'r') as f:
+                    self.queues = json.load(f)
+            except Exception as e:
+                logger.error('load upload queue error: %s', e)
+        return self.queues
+
+    @classmethod
+    def save(self):
+        pth = self.path()
+        tmp = pth + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.queues, f)
+        os.replace(tmp, pth)
+        self.dirty = False
+        self.metrics['saves'] += 1
+
+    @classmethod
+    def persist(self):
+        """队列有变化时写入文件"""
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    @staticmethod
+    def deal_key(deal):
+        return f"{deal.get('time', '')}|{deal.get('sid', '')}|{deal.get('code', '')}|{deal.get('tradeType', '')}"
+
+    @staticmethod
+    def split_key(acc):
+        # 返回(登录名, 账户), 默认登录的登录名为None
+        if '/' in acc:
+            login, keyword = acc.rsplit('/', 1)
+            return login, keyword
+        return None, acc
+
+    @classmethod
+    def fha_for(self, acc):
+        login, _ = self.split_key(acc)
+        return self.fha if login is None else self.fhas.get(login)
+
+    @classmethod
+    def depth(self):
+        return sum(len(q) for q in self.load().values())
+
+    @classmethod
+    def worker_alive(self):
+        return self.job in scheduler.jobs
+
+    @classmethod
+    def wakeup(self):
+        # 上传任务提前执行
+        if self.job is not None:
+            scheduler.reschedule(self.job, 0)
+
+    @classmethod
+    def drop_oldest(self, n):
+        """丢弃所有账户中最早的n条可丢弃的成交, 返回丢弃的数量"""
+        queues = self.load()
+        candidates = [(d.get('time', ''), a, i) for a, q in queues.items() for i, d in enumerate(q) if self.deal_key(d) not in self.protected]
+        drops = {}
+        for _, a, i in heapq.nsmallest(n, candidates):
+            drops.setdefault(a, set()).add(i)
+        for a, idx in drops.items():
+            queues[a] = [d for i, d in enumerate(queues[a]) if i not in idx]
+            if not queues[a]:
+                queues.pop(a)
+            self.dropped_accs[a] = self.dropped_accs.get(a, 0) + len(idx)
+        dropped = sum(len(idx) for idx in drops.values())
+        self.metrics['dropped'] += dropped
+        logger.warning('upload queue full (%d), dropped %d oldest deals', self.max_pending, dropped)
+        return dropped
+
+    @classmethod
+    def enqueue(self, acc, deals, droppable=True):
+        """加入上传队列, 已在队列中的成交不重复加入, 不等待上传
+        droppable为False时(显式回补的成交)队列满时也不丢弃
+        """
+        with self.lock:
+            queue = self.load().setdefault(acc, [])
+            n = len(queue)
+            keys = {self.deal_key(d) for d in queue}
+            for d in deals:
+                key = self.deal_key(d)
+                if key not in keys:
+                    keys.add(key)
+                    queue.append(d)
+                if not droppable:
+                    self.protected.add(key)
+            self.metrics['enqueued'] += len(queue) - n
+            if len(queue) > n:
+                self.dirty = True
+            self.metrics['max_depth'] = max(self.metrics['max_depth'], self.depth())
+            overflow = self.depth() - self.max_pending
+            if overflow > 0:
+                self.drop_oldest(overflow)
+            if not self.worker_alive():
+                # 没有上传任务时立即写入文件
+                self.save()
+            if len(queue) >= self.batch_size or overflow > 0:
+                self.wakeup()
+
+    @classmethod
+    def pending(self, acc=None):
+        with self.lock:
+            if acc is not None:
+                return len(self.load().get(acc, []))
+            return self.depth()
+
+    @classmethod
+    def stats(self):
+        with self.lock:
+            return {**self.metrics, 'pending': self.depth(), 'max_pending': self.max_pending, 'running': self.worker_alive()}
+
+    @classmethod
+    def post(self, acc, deals, fha):
+        url = join_url(fha['server'], 'stock')
+        data = {
+            'act': 'deals',
+            'acc': self.split_key(acc)[1],
+            'data': json.dumps(deals)
+        }
+        if not self.compress:
+            return transport.post(url, headers=fha['headers'], data=data)
+
+        headers = {
+            **fha['headers'],
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Content-Encoding': 'gzip'
+        }
+        return transport.post(url, headers=headers, data=gzip.compress(urlencode(data).encode('utf-8')))
+
+    @classmethod
+    def send(self, acc, deals, fha):
+        retry = 0
+        while True:
+            try:
+                r = self.post(acc, deals, fha)
+                r.raise_for_status()
+                if r.status_code == 200:
+                    logger.info('%s uploadDeals success, %d deals', acc, len(deals))
+                    self.metrics['sent'] += len(deals)
+                    return True
+                logger.error('%s uploadDeals failed: %s', acc, r.text)
+                self.metrics['last_error'] = r.text
+            except Exception as e:
+                logger.error('%s uploadDeals error (try %d): %s', acc, retry + 1, e)
+                logger.debug(format_exc())
+                self.metrics['last_error'] = str(e)
+            retry += 1
+            if retry >= self.max_retry or self.stop_event.is_set():
+                logger.error('%s uploadDeals failed after %d retries', acc, retry)
+                self.metrics['failed'] += 1
+                return False
+            time.sleep(min(self.backoff * 2 ** (retry - 1), 60))
+
+    @classmethod
+    def flush(self, acc=None, fha=None):
+        """上传队列中的成交, acc为空时上传所有账户, 全部成功返回True"""
+        success = True
+        with self.send_lock:
+            with self.lock:
+                accs = [acc] if acc is not None else list(self.load().keys())
+            for a in accs:
+                afha = fha or self.fha_for(a)
+                if not afha or not afha.get('headers', None):
+                    logger.warning('%s uploadDeals no fha server configured', a)
+                    success = False
+                    continue
+                with self.lock:
+                    deals = list(self.load().get(a, []))
+                for i in range(0, len(deals), self.batch_size):
+                    batch = deals[i: i + self.batch_size]
+                    if not self.send(a, batch, afha):
+                        success = False
+                        break
+                    sent = {self.deal_key(d) for d in batch}
+                    with self.lock:
+                        queues = self.load()
+                        queues[a] = [d for d in queues.get(a, []) if self.deal_key(d) not in sent]
+                        if len(queues[a]) == 0:
+                            queues.pop(a)
+                        self.protected -= sent
+                        self.dirty = True
+                        self.lock.notify_all()
+                with self.lock:
+                    lost = self.dropped_accs.pop(a, 0)
+                if lost:
+                    # 丢弃的成交没有上传, 调用方不能认为已全部上传
+                    logger.error('%s %d deals were dropped from the upload queue before sending', a, lost)
+                    success = False
+            self.metrics['last_flush'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.persist()
+        return success
+
+    @classmethod
+    def run(self):
+        if self.pending() > 0:
+            self.flush()
+        self.persist()
+
+    @classmethod
+    def start(self, fha, login=None):
+        if login is None:
+            self.fha = fha
+        else:
+            self.fhas[login] = fha
+        self.stop_event.clear()
+        if self.worker_alive():
+            return
+        self.job = scheduler.add_job(self.run, self.interval, interval=self.interval, name='deal_uploader')
+
+    @classmethod
+    def drain(self, timeout=None):
+        """等待队列中的成交全部上传, 没有上传任务时在当前线程上传, 队列清空返回True"""
+        if not self.worker_alive():
+            return self.pending() == 0 or self.flush()
+        self.wakeup()
+        with self.lock:
+            return self.lock.wait_for(lambda: self.depth() == 0, timeout)
+
+    @classmethod
+    def stop(self, timeout=30):
+        """退出前上传剩余成交并停止上传任务"""
+        drained = self.drain(timeout)
+        self.stop_event.set()
+        if self.job is not None:
+            scheduler.cancel(self.job)
+            self.job = None
+        self.persist()
+        if not drained:
+            logger.warning('deal uploader stopped with %d deals pending', self.pending())
+        return drained
@@ -0,0 +1,87 @@
+import time
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from traceback import format_exc
+from lofig import logger, Config
+from accounts import accld
+
+
+class Warmup:
+    """登录后的盘前预热, 每个登录一个实例
+    并发加载各账户关注股票、资产持仓和跟踪账户
+    登录时已获取公钥, 行情由quote_hub在交易时段刷新, 都不需要在9:12预热
+    state: idle -> warming -> ready/failed, steps记录每一步的耗时和错误
+    """
+    workers = Config.trade_config().get('warmup_workers', 6)
+
+    def __init__(self, loader=None):
+        self._loader = loader
+        self.state = 'idle'
+        self.steps = {}
+        self.started = None
+        self.finished = None
+        self.lock = threading.Lock()
+
+    @property
+    def accld(self):
+        return self._loader or accld
+
+    def step(self, name, func, *args):
+        start = time.time()
+        info = {'status': 'running'}
+        self.steps[name] = info
+        try:
+            result = func(*args)
+            info['status'] = 'done'
+            return result
+        except Exception as e:
+            info['status'] = 'failed'
+            info['error'] = str(e)
+            logger.error('warmup %s error: %s', name, e)
+            logger.debug(format_exc())
+            return None
+        finally:
+            info['duration'] = round(time.time() - start, 3)
+
+    def run(self):
+        with self.lock:
+            self.state = 'warming'
+            self.steps = {}
+            self.started = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.finished = None
+
+            self.accld.create_accounts()
+            accounts = self.accld.trade_accounts()
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='warmup') as pool:
+                track = pool.submit(self.step, 'track_accounts', self.accld.init_track_accounts)
+                watchings = [pool.submit(self.step, f'watchings:{acc.keyword}', acc.fetch_watchings) for acc in accounts]
+                assets = [pool.submit(self.step, f'assets:{acc.keyword}', acc.get_assets_and_positions) for acc in accounts]
+
+                # 先合并关注股票再更新持仓, 与顺序加载的结果一致
+                for acc, w, a in zip(accounts, watchings, assets):
+                    acc.apply_watchings(w.result())
+                    sp = a.result()
+                    if sp:
+                        acc.on_assets_loaded(sp[0])
+                        acc.on_positions_loaded(sp[1])
+                track.result()
+
+            self.finished = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.state = 'failed' if any(s['status'] == 'failed' for s in self.steps.values()) else 'ready'
+            logger.info('warmup %s: %s', self.state, self.steps)
+            return self.state == 'ready'
+
+    def ready(self):
+        return self.state == 'ready'
+
+    def status(self):
+        return {
+            'state': self.state,
+            'started': self.started,
+            'finished': self.finished,
+            'steps': {k: dict(v) for k, v in self.steps.items()}
+        }
+
+
+warmup = Warmup()
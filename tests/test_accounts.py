@@ -9,6 +9,8 @@ import unittest
 import sys
 import os
 import json
+import time
+import tempfile
 from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock, Mock
 
@@ -16,7 +18,7 @@ from unittest.mock import patch, MagicMock, Mock
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
 
-from pyphon.accounts import NormalAccount, CollateralAccount, TrackingAccount
+from pyphon.accounts import NormalAccount, CollateralAccount, TrackingAccount, sync_state
 
 
 class TestNormalAccountCheckOrders(unittest.TestCase):
@@ -264,6 +266,63 @@ class TestNormalAccountGetHistoryDeals(unittest.TestCase):
         self.assertGreater(mock_session.post.call_count, 1)
 
 
+class TestNormalAccountBatchesDealData(unittest.TestCase):
+    """测试 NormalAccount.iter_batches_deal_data 分页查询"""
+
+    def setUp(self):
+        self.account = NormalAccount()
+
+    def make_response(self, rows):
+        response = Mock()
+        response.json.return_value = {'Status': 0, 'Data': rows}
+        response.raise_for_status.return_value = None
+        return response
+
+    @patch('pyphon.accounts.accld')
+    def test_pages_follow_cursor(self, mock_accld):
+        """测试按Dwc游标翻页, 数据按顺序返回"""
+        pages = {
+            '': [{'id': 1, 'Dwc': 'c1'}, {'id': 2, 'Dwc': 'c2'}],
+            'c2': [{'id': 3, 'Dwc': 'c3'}, {'id': 4, 'Dwc': 'c4'}],
+            'c4': [{'id': 5, 'Dwc': 'c5'}],
+        }
+        mock_accld.jywg.session.post.side_effect = lambda url, data: self.make_response(pages[data['dwc']])
+
+        rows = list(self.account.iter_batches_deal_data('http://test.com', {'qqhs': '2', 'dwc': ''}))
+
+        self.assertEqual([r['id'] for r in rows], [1, 2, 3, 4, 5])
+        dwcs = [c[1]['data']['dwc'] for c in mock_accld.jywg.session.post.call_args_list]
+        self.assertEqual(dwcs, ['', 'c2', 'c4'])
+
+    @patch('pyphon.accounts.accld')
+    def test_next_page_requested_before_rows_consumed(self, mock_accld):
+        """测试拿到游标后下一页请求先于当前页数据处理发出"""
+        pages = {
+            '': [{'id': 1, 'Dwc': 'c1'}, {'id': 2, 'Dwc': 'c2'}],
+            'c2': [{'id': 3, 'Dwc': ''}],
+        }
+        mock_accld.jywg.session.post.side_effect = lambda url, data: self.make_response(pages[data['dwc']])
+
+        it = self.account.iter_batches_deal_data('http://test.com', {'qqhs': '2', 'dwc': ''})
+        self.assertEqual(next(it)['id'], 1)
+        # 第一页的数据还未处理完, 第二页已经请求
+        for _ in range(100):
+            if mock_accld.jywg.session.post.call_count == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(mock_accld.jywg.session.post.call_count, 2)
+        self.assertEqual([r['id'] for r in it], [2, 3])
+
+    @patch('pyphon.accounts.accld')
+    def test_error_status_stops(self, mock_accld):
+        """测试查询失败时停止并返回已获取的数据"""
+        response = Mock()
+        response.json.return_value = {'Status': -1, 'Message': 'error'}
+        mock_accld.jywg.session.post.return_value = response
+
+        self.assertEqual(self.account.fetch_batches_deal_data('http://test.com', {'qqhs': '2', 'dwc': ''}), [])
+
+
 class TestNormalAccountLoadHisDeals(unittest.TestCase):
     """测试 NormalAccount.load_his_deals 方法"""
 
@@ -346,6 +405,68 @@ class TestNormalAccountLoadHisDeals(unittest.TestCase):
                     self.assertEqual(len(uploaded_deals), 0)
 
 
+class TestNormalAccountSyncHisDeals(unittest.TestCase):
+    """测试 NormalAccount.sync_his_deals 增量同步"""
+
+    def setUp(self):
+        self.account = NormalAccount()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch.object(sync_state, 'path', return_value=os.path.join(self.tmpdir.name, 'sync_state.json'))
+        self.patcher.start()
+        self.accld_patcher = patch('pyphon.accounts.accld')
+        mock_accld = self.accld_patcher.start()
+        mock_accld.jywg.jywg = 'http://test.com'
+        mock_accld.jywg.validate_key = 'test_key'
+        sync_state.states = None
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.accld_patcher.stop()
+        sync_state.states = None
+        self.tmpdir.cleanup()
+
+    def history_row(self, sid, rq, sj):
+        return {
+            'Mmsm': '证券买入', 'Zqdm': '600000', 'Cjrq': rq, 'Cjsj': sj, 'Cjsl': '100',
+            'Cjjg': '12.50', 'Wtbh': sid, 'Sxf': '5.0', 'Yhs': '0', 'Ghf': '0'
+        }
+
+    def test_sync_uploads_only_new_deals(self):
+        """测试第二次同步只上传水位之后的成交"""
+        rows = [self.history_row('001', '20250113', '100000'), self.history_row('002', '20250114', '143000')]
+        with patch.object(self.account, 'get_history_deals', return_value=rows) as mock_history:
+            with patch.object(self.account, '_upload_deals', return_value=True) as mock_upload:
+                self.account.sync_his_deals('2025-01-01')
+
+                mock_history.assert_called_with(self.account.hisdeals_url, '2025-01-01', stream=True)
+                self.assertEqual(len(mock_upload.call_args[0][0]), 2)
+
+        # 水位持久化, 重新加载后仍生效
+        sync_state.states = None
+        rows.append(self.history_row('003', '20250114', '143000'))
+        rows.append(self.history_row('004', '20250115', '093000'))
+        with patch.object(self.account, 'get_history_deals', return_value=rows) as mock_history:
+            with patch.object(self.account, '_upload_deals', return_value=True) as mock_upload:
+                self.account.sync_his_deals('2025-01-01')
+
+                # 从水位所在日期开始查询
+                mock_history.assert_called_with(self.account.hisdeals_url, '2025-01-14', stream=True)
+                uploaded = mock_upload.call_args[0][0]
+                self.assertEqual([d['sid'] for d in uploaded], ['003', '004'])
+
+        self.assertEqual(sync_state.watermark('normal', 'deals')['time'], '2025-01-15 09:30:00')
+
+    def test_sync_failed_upload_keeps_watermark(self):
+        """测试上传失败时不推进水位"""
+        rows = [self.history_row('001', '20250113', '100000')]
+        with patch.object(self.account, 'get_history_deals', return_value=rows):
+            with patch.object(self.account, '_upload_deals', return_value=False):
+                self.account.sync_his_deals('2025-01-01')
+
+        self.assertIsNone(sync_state.watermark('normal', 'deals'))
+        self.assertFalse(os.path.exists(sync_state.path()))
+
+
 class TestNormalAccountLoadOtherDeals(unittest.TestCase):
     """测试 NormalAccount.load_other_deals 方法"""
 
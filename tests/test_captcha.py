@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/captcha.py 验证码识别
+"""
+
+import unittest
+import sys
+import os
+import time
+import threading
+from urllib.parse import urlparse, parse_qs
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.captcha import captcha
+
+
+class FakeModel:
+    """按图片内容返回预设识别结果和概率"""
+
+    charsets = ['', '0', '1', '2', '3', 'g', 'x']
+
+    def __init__(self, results):
+        self.results = results
+
+    def classification(self, img, probability=False):
+        text, prob = self.results[img.decode()]
+        time.sleep(0.1)
+        return {
+            'charsets': self.charsets,
+            'probability': [[prob if c == ch else 0.01 for c in self.charsets] for ch in text]
+        }
+
+
+class FakeSession:
+    """每次请求按顺序返回一张验证码图片, 记录请求的randNum"""
+
+    def __init__(self, images):
+        self.images = list(images)
+        self.rand_nums = []
+
+    def get(self, url):
+        self.rand_nums.append(parse_qs(urlparse(url).query)['randNum'][0])
+        rsp = MagicMock()
+        rsp.content = self.images.pop(0).encode() if self.images else b'bad'
+        return rsp
+
+
+class TestCaptcha(unittest.TestCase):
+    """测试候选验证码选择、重试上限和统计"""
+
+    url = 'https://jywg.eastmoneysec.com/Login/YZM?randNum='
+
+    def setUp(self):
+        self.patchers = [
+            patch.object(captcha, 'model_loaded', True),
+            patch.object(captcha, 'candidates', 3),
+            patch.object(captcha, 'max_attempts', 6),
+            patch.object(captcha, 'stats', {k: 0 for k in captcha.stats}),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_normalize(self):
+        """测试字符替换和非法结果"""
+        self.assertEqual(captcha.normalize('12g3'), ('1293', 1))
+        self.assertEqual(captcha.normalize('12x3'), (None, 0))
+        self.assertEqual(captcha.normalize('123'), (None, 0))
+
+    def test_stop_at_confident_result(self):
+        """测试依次获取验证码, 置信度达到阈值时立即使用最后获取的一张"""
+        model = FakeModel({'a': ('1203', 0.6), 'b': ('3210', 0.95), 'c': ('1230', 0.99), 'bad': ('', 0)})
+        session = FakeSession(['a', 'b', 'c'])
+        with patch.object(captcha, 'model', model):
+            vcode, rand_num = captcha.solve(session, self.url)
+
+        self.assertEqual(vcode, '3210')
+        self.assertEqual(len(session.rand_nums), 2)
+        self.assertEqual(rand_num, session.rand_nums[-1])
+        self.assertEqual(captcha.stats['valid'], 2)
+
+    def test_accept_last_of_round(self):
+        """测试一轮中都低于阈值时使用本轮最后一张合法的验证码"""
+        model = FakeModel({'a': ('1203', 0.5), 'b': ('12x3', 0.9), 'c': ('3012', 0.4), 'bad': ('', 0)})
+        session = FakeSession(['a', 'b', 'c'])
+        with patch.object(captcha, 'model', model):
+            vcode, rand_num = captcha.solve(session, self.url)
+
+        self.assertEqual(vcode, '3012')
+        self.assertEqual(rand_num, session.rand_nums[2])
+        self.assertEqual(captcha.stats['rounds'], 1)
+
+    def test_retry_budget(self):
+        """测试全部识别失败时在重试上限内停止"""
+        model = FakeModel({'bad': ('12x', 0.9)})
+        session = FakeSession([])
+        with patch.object(captcha, 'model', model):
+            self.assertEqual(captcha.solve(session, self.url), (None, None))
+        self.assertEqual(len(session.rand_nums), 6)
+        self.assertEqual(captcha.stats['rounds'], 2)
+        self.assertEqual(captcha.stats['exhausted'], 1)
+
+    def test_status(self):
+        """测试识别耗时和登录准确率统计"""
+        captcha.report(True)
+        captcha.report(False)
+        captcha.report(True)
+        status = captcha.status()
+        self.assertAlmostEqual(status['accuracy'], 2 / 3)
+
+    def test_stats_from_threads(self):
+        """测试多个线程同时更新统计"""
+        threads = [threading.Thread(target=lambda: [captcha.report(True) for _ in range(1000)]) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(captcha.stats['accepted'], 4000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/dealstore.py 本地成交存储
+"""
+
+import unittest
+import sys
+import os
+import tempfile
+import unittest.mock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.dealstore import deal_store
+
+
+class TestDealStore(unittest.TestCase):
+    """测试成交、委托和持仓的读写"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'deals.db')
+        deal_store.open(self.path)
+
+    def tearDown(self):
+        deal_store.close()
+        self.tmpdir.cleanup()
+
+    def test_wal_mode(self):
+        """测试使用WAL模式"""
+        self.assertEqual(deal_store.conn.execute('PRAGMA journal_mode').fetchone()[0], 'wal')
+
+    def test_today_deals_survive_reopen(self):
+        """测试当日成交重启后可从本地读取"""
+        deals = [
+            {'code': '600000', 'price': 12.5, 'count': 100, 'sid': 'ORDER001', 'tradeType': 'B', 'time': '2025-01-15'},
+            {'code': '600000', 'price': 12.8, 'count': 100, 'sid': 'ORDER002', 'tradeType': 'S', 'time': '2025-01-15'},
+            {'code': '000001', 'price': 10.8, 'count': 200, 'sid': 'ORDER003', 'tradeType': 'B', 'time': '2025-01-15'},
+        ]
+        deal_store.save_orders('normal', deals)
+        # 重复写入不会产生重复记录
+        deal_store.save_orders('normal', deals[:1])
+        deal_store.close()
+        deal_store.open(self.path)
+
+        result = deal_store.today_deals('normal', '2025-01-15')
+
+        self.assertEqual(list(result.keys()), ['600000', '000001'])
+        self.assertEqual([d['sid'] for d in result['600000']], ['ORDER001', 'ORDER002'])
+        self.assertEqual(result['000001'][0]['count'], 200)
+        self.assertEqual(deal_store.today_deals('collat', '2025-01-15'), {})
+
+    def test_orders_without_sid(self):
+        """测试没有委托编号的成交按order_key保存, 不会互相覆盖"""
+        from pyphon.accounts import Account
+        orders = [
+            {'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtsj': '093000', 'Cjsl': '100', 'Cjjg': '12.50'},
+            {'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtsj': '100000', 'Cjsl': '100', 'Cjjg': '12.50'},
+        ]
+        deals = [{'code': '600000', 'price': 12.5, 'count': 100, 'sid': None, 'tradeType': 'B', 'time': '2025-01-15'} for _ in orders]
+        deal_store.save_orders('normal', deals, keys=[Account.order_key(o) for o in orders])
+        deal_store.save_orders('normal', deals[:1], keys=[Account.order_key(orders[0])])
+
+        result = deal_store.today_deals('normal', '2025-01-15')
+        self.assertEqual(len(result['600000']), 2)
+        self.assertEqual([d['sid'] for d in result['600000']], [None, None])
+
+        # 没有提供keys时无法区分, 不保存
+        deal_store.save_orders('normal', [dict(deals[0], code='000001')])
+        self.assertNotIn('000001', deal_store.today_deals('normal', '2025-01-15'))
+
+    def test_history_deals_query(self):
+        """测试历史成交按代码和时间查询"""
+        deals = [
+            {'time': '2025-01-13 10:00:00', 'sid': '001', 'code': '600000', 'tradeType': 'B', 'price': 12.5, 'count': 100, 'fee': 5.0, 'feeYh': 0, 'feeGh': 0},
+            {'time': '2025-01-14 10:00:00', 'sid': '002', 'code': '000001', 'tradeType': 'B', 'price': 10.5, 'count': 100, 'fee': 5.0, 'feeYh': 0, 'feeGh': 0},
+            {'time': '2025-01-15 10:00:00', 'sid': '003', 'code': '600000', 'tradeType': 'S', 'price': 13.5, 'count': 100, 'fee': 5.0, 'feeYh': 1.0, 'feeGh': 0},
+        ]
+        deal_store.save_deals('normal', deals)
+        deal_store.save_deals('normal', deals)
+
+        self.assertEqual(len(deal_store.deals('normal')), 3)
+        self.assertEqual([d['sid'] for d in deal_store.deals('normal', code='600000')], ['001', '003'])
+        self.assertEqual([d['sid'] for d in deal_store.deals('normal', since='2025-01-14')], ['002', '003'])
+
+    def test_positions_snapshot(self):
+        """测试持仓快照, 只保存券商返回的持仓"""
+        stocks = [
+            {'code': '600000', 'name': '浦发银行', 'holdCount': 100, 'availableCount': 100, 'holdCost': 12.5, 'latestPrice': 13.0},
+            {'code': '000001', 'name': '', 'holdCount': 0, 'availableCount': 0, 'strategies': {}},
+        ]
+        deal_store.save_positions('normal', stocks, '2025-01-15')
+
+        positions = deal_store.positions('normal', '2025-01-15')
+        self.assertEqual(len(positions), 1)
+        self.assertEqual(positions[0]['holdCost'], 12.5)
+
+    def test_closed_store_ignores_writes(self):
+        """测试未打开时写入被忽略"""
+        deal_store.close()
+        deal_store.save_orders('normal', [{'code': '600000', 'price': 1, 'count': 1, 'sid': '1', 'tradeType': 'B', 'time': '2025-01-15'}])
+        self.assertEqual(deal_store.today_deals('normal', '2025-01-15'), {})
+
+
+class TestDealsFromStore(unittest.TestCase):
+    """测试/deals在交易时段也从本地存储返回, 不查询券商"""
+
+    def setUp(self):
+        # emtrader使用pyphon目录下的模块, 使用同一个deal_store
+        from pyphon.emtrader import TradingExtension, deal_store as store
+        from accounts import NormalAccount
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.store = store
+        self.store.open(os.path.join(self.tmpdir.name, 'deals.db'))
+        self.ext = TradingExtension()
+        self.ext.running = True
+        self.account = self.ext.accld.add_account(NormalAccount())
+        self.account.check_orders = unittest.mock.MagicMock()
+
+    def tearDown(self):
+        self.ext.accld.all_accounts.pop('normal', None)
+        self.store.close()
+        self.tmpdir.cleanup()
+
+    def test_running_reads_store(self):
+        from datetime import datetime
+        today = datetime.now().strftime('%Y-%m-%d')
+        self.store.save_orders(self.account.uid, [{'code': '600000', 'price': 12.5, 'count': 100, 'sid': 'ORDER001', 'tradeType': 'B', 'time': today}])
+        result = self.ext.handleAccountDeals('normal')
+        self.assertEqual(result['deals']['600000'][0]['sid'], 'ORDER001')
+        self.account.check_orders.assert_not_called()
+        self.assertIn('error', self.ext.handleAccountDeals('unknown'))
+
+
+if __name__ == '__main__':
+    unittest.main()
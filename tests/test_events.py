@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/events.py 服务器推送事件
+"""
+
+import unittest
+import sys
+import os
+import json
+import asyncio
+import threading
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.events import event_hub
+from pyphon.accounts import NormalAccount, AccountLoader
+
+
+class TestEventHub(unittest.TestCase):
+    """测试跨线程发布和有界队列"""
+
+    def test_publish_from_thread(self):
+        """测试其他线程发布的事件送到订阅者的事件循环"""
+        async def run():
+            queue = event_hub.subscribe()
+            try:
+                thread = threading.Thread(target=event_hub.publish, args=('deals', {'account': 'normal'}, 'second'))
+                thread.start()
+                event = await asyncio.wait_for(queue.get(), 1)
+                thread.join()
+                return event
+            finally:
+                event_hub.unsubscribe(queue)
+
+        event = asyncio.run(run())
+        self.assertEqual(event['type'], 'deals')
+        self.assertEqual(event['login'], 'second')
+        self.assertEqual(event['data'], {'account': 'normal'})
+        self.assertEqual(event_hub.stats()['subscribers'], 0)
+
+    def test_full_queue_drops_oldest(self):
+        """测试队列满时丢弃最早的事件"""
+        async def run():
+            queue = event_hub.subscribe()
+            try:
+                for i in range(5):
+                    event_hub.publish('quote', {'price': i})
+                await asyncio.sleep(0.01)
+                return [queue.get_nowait()['data']['price'] for _ in range(queue.qsize())]
+            finally:
+                event_hub.unsubscribe(queue)
+
+        dropped = event_hub.metrics['dropped']
+        with patch.object(event_hub, 'queue_size', 3):
+            prices = asyncio.run(run())
+        self.assertEqual(prices, [2, 3, 4])
+        self.assertEqual(event_hub.metrics['dropped'] - dropped, 2)
+
+    def test_format(self):
+        """测试SSE格式"""
+        text = event_hub.format({'id': 7, 'type': 'status', 'data': {'status': '运行'}})
+        self.assertTrue(text.startswith('id: 7\nevent: status\n'))
+        self.assertTrue(text.endswith('\n\n'))
+        self.assertEqual(json.loads(text.split('data: ')[1]), {'status': '运行'})
+
+
+class TestAccountEvents(unittest.TestCase):
+    """测试账户层推送成交和持仓变化"""
+
+    @patch('pyphon.accounts.deal_store')
+    @patch('pyphon.accounts.event_hub')
+    def test_check_orders_publishes_new_deals(self, mock_hub, mock_store):
+        """测试只推送新增成交, 以及成交股票的持仓"""
+        loader = AccountLoader('second')
+        account = loader.add_account(NormalAccount())
+        account.stocks.append({'code': '600000', 'holdCount': 0, 'buydetail': []})
+        orders = [{'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtzt': '已成', 'Cjjg': '12.50', 'Cjsl': '100', 'Wtbh': 'ORDER001'}]
+        with patch.object(account, 'get_orders', return_value=orders), patch.object(account, 'extend_stock_buydetail'):
+            account.check_orders()
+            account.check_orders()
+
+        events = [c[0] for c in mock_hub.publish.call_args_list]
+        self.assertEqual([e[0] for e in events], ['deals', 'positions'])
+        self.assertEqual(events[0][1]['deals']['600000'][0]['sid'], 'ORDER001')
+        self.assertEqual(events[0][2], 'second')
+        self.assertEqual(events[1][1]['stocks'], [{'code': '600000', 'holdCount': 0}])
+        self.assertFalse(events[1][1]['full'])
+
+
+if __name__ == '__main__':
+    unittest.main()
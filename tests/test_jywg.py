@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/jywg.py 登录状态保存、恢复、重新登录和公钥缓存
+"""
+
+import unittest
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+import rsa
+import requests
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.jywg import jywg, BrokerSession
+from pyphon.lofig import Config
+
+
+TRADE_PAGE = '<input id="em_validatekey" type="hidden" value="key-1234567890abcdef" />'
+
+
+class TestSessionPersistence(unittest.TestCase):
+    """测试重启后复用登录状态"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch('pyphon.jywg.Config._cfg_path', return_value=os.path.join(self.tmpdir.name, 'config.json'))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def new_jywg(self, page=TRADE_PAGE):
+        jy = jywg('123456789012', Config.simple_encrypt('pwd'), active_time=30)
+        rsp = MagicMock()
+        rsp.text = page
+        jy.session.get = MagicMock(return_value=rsp)
+        return jy
+
+    def test_restore_skips_login(self):
+        """测试保存的登录状态有效时不再登录"""
+        jy = self.new_jywg()
+        jy.session.cookies.set('Uuid', 'abc', domain='jywg.eastmoneysec.com', path='/')
+        self.assertTrue(jy.fetch_validate_key())
+        self.assertEqual(os.stat(jy.session_path).st_mode & 0o777, 0o600)
+
+        restarted = self.new_jywg()
+        with patch.object(restarted, 'get_refreshed_vcode') as mock_vcode:
+            self.assertTrue(restarted.validate())
+            mock_vcode.assert_not_called()
+        self.assertEqual(restarted.validate_key, 'key-1234567890abcdef')
+        self.assertEqual(restarted.session.cookies.get('Uuid'), 'abc')
+
+    def test_invalid_session_falls_back_to_login(self):
+        """测试保存的登录状态失效时删除并重新登录"""
+        self.new_jywg().fetch_validate_key()
+
+        restarted = self.new_jywg(page='<html>login</html>')
+        with patch.object(restarted, 'get_refreshed_vcode', return_value=None) as mock_vcode:
+            self.assertFalse(restarted.validate())
+            mock_vcode.assert_called_once()
+        self.assertFalse(os.path.isfile(restarted.session_path))
+
+    def test_expired_session(self):
+        """测试过期的登录状态不再验证"""
+        jy = self.new_jywg()
+        jy.fetch_validate_key()
+        with open(jy.session_path) as f:
+            state = json.load(f)
+        state['expires'] = time.time() - 1
+        with open(jy.session_path, 'w') as f:
+            json.dump(state, f)
+
+        restarted = self.new_jywg()
+        self.assertFalse(restarted.restore_session())
+        restarted.session.get.assert_not_called()
+
+
+
+def json_response(url, obj):
+    rsp = requests.Response()
+    rsp.status_code = 200
+    rsp.url = url
+    rsp.headers['Content-Type'] = 'application/json; charset=utf-8'
+    rsp._content = json.dumps(obj).encode('utf-8')
+    return rsp
+
+
+class TestBrokerSession(unittest.TestCase):
+    """测试登录失效检测、后台重新登录和请求重发"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch('pyphon.jywg.Config._cfg_path', return_value=os.path.join(self.tmpdir.name, 'config.json'))
+        self.patcher.start()
+        self.jy = jywg('123456789012', 'pwd', active_time=1800)
+        self.jy.validate_key = 'old'
+        self.urls = []
+        self.logins = 0
+
+    def tearDown(self):
+        self.jy.stop_keepalive()
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def fake_request(self, method, url, *args, **kwargs):
+        self.urls.append(url)
+        if 'validatekey=old' in url:
+            return json_response(url, {'Status': -1, 'Message': '会话已超时，请重新登录'})
+        return json_response(url, {'Status': 0, 'Data': [{'Wtbh': '1'}]})
+
+    def fake_validate(self):
+        self.logins += 1
+        time.sleep(0.1)
+        self.jy.validate_key = 'new'
+        return True
+
+    def test_relogin_and_replay(self):
+        """测试并发请求登录失效时只重新登录一次并用新的validatekey重发"""
+        url = 'https://jywg.eastmoneysec.com/Search/GetOrdersData?validatekey=old'
+        results = []
+        with patch.object(requests.Session, 'request', side_effect=self.fake_request):
+            with patch.object(self.jy, 'validate', side_effect=self.fake_validate):
+                threads = [threading.Thread(target=lambda: results.append(self.jy.session.post(url, data={}).json())) for _ in range(3)]
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join(5)
+
+        self.assertEqual(self.logins, 1)
+        self.assertEqual([r['Status'] for r in results], [0, 0, 0])
+        self.assertEqual(len([u for u in self.urls if u.endswith('validatekey=new')]), 3)
+        self.assertGreater(self.jy.expires, time.time() + 1000)
+
+    def test_submit_not_replayed(self):
+        """测试下单请求登录失效时在后台重新登录, 不等待也不重发"""
+        url = 'https://jywg.eastmoneysec.com/Trade/SubmitTradeV2?validatekey=old'
+        release = threading.Event()
+
+        def validate():
+            release.wait(2)
+            return self.fake_validate()
+
+        with patch.object(requests.Session, 'request', side_effect=self.fake_request):
+            with patch.object(self.jy, 'validate', side_effect=validate):
+                rsp = self.jy.session.post(url, data={})
+                # 登录还未完成时请求已经返回
+                event = self.jy.relogin_event
+                self.assertIsNotNone(event)
+                release.set()
+                self.assertTrue(event.wait(2))
+        self.assertEqual(rsp.json()['Status'], -1)
+        self.assertEqual(self.logins, 1)
+        self.assertEqual(self.urls, [url])
+
+    def test_business_error_is_not_auth_failure(self):
+        """测试普通业务错误不触发重新登录, 消息中带登录字样也不触发"""
+        url = 'https://jywg.eastmoneysec.com/Trade/SubmitTradeV2?validatekey=key'
+        for message in ('可用资金不足', '当前会话不允许该业务', '请先登录融资融券账户'):
+            rsp = json_response(url, {'Status': -1, 'Message': message})
+            with patch.object(requests.Session, 'request', return_value=rsp):
+                with patch.object(self.jy, 'relogin') as mock_relogin:
+                    self.assertIs(self.jy.session.post(url), rsp)
+                    mock_relogin.assert_not_called()
+
+    def test_keepalive_before_expiry(self):
+        """测试登录有效期结束前访问交易页面保持登录"""
+        self.jy.expires = time.time() + 0.1
+        with patch.object(jywg, 'keepalive_margin', 0.05):
+            with patch.object(self.jy, 'fetch_validate_key', side_effect=self.jy.touch) as mock_fetch:
+                self.jy.start_keepalive()
+                time.sleep(0.3)
+                self.jy.stop_keepalive()
+        mock_fetch.assert_called_once()
+
+
+class TestPublicKeyCache(unittest.TestCase):
+    """测试公钥持久化和加密结果复用"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.patcher = patch('pyphon.jywg.Config._cfg_path', return_value=os.path.join(self.tmpdir.name, 'config.json'))
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def new_jywg(self):
+        jy = jywg('123456789012', Config.simple_encrypt('pwd'), active_time=1800)
+        jy.fetch_public_key = MagicMock(return_value=jy.default_public_key)
+        return jy
+
+    def test_persist_and_reuse(self):
+        """测试公钥只获取一次, 重启后从本地读取"""
+        jy = self.new_jywg()
+        pem = jy.public_key
+        self.assertEqual(jy.public_key, pem)
+        jy.fetch_public_key.assert_called_once()
+
+        restarted = self.new_jywg()
+        self.assertEqual(restarted.public_key, pem)
+        restarted.fetch_public_key.assert_not_called()
+
+    def test_tampered_or_expired_key_refetched(self):
+        """测试指纹不符或过期时重新获取"""
+        jy = self.new_jywg()
+        jy.public_key
+        with open(jy.pubkey_path) as f:
+            saved = json.load(f)
+        saved['pem'] = saved['pem'].replace('MIGf', 'MIGe')
+        with open(jy.pubkey_path, 'w') as f:
+            json.dump(saved, f)
+        self.assertIsNone(self.new_jywg().load_public_key())
+
+        jy.save_public_key(jy.default_public_key)
+        with patch('pyphon.jywg.time.time', return_value=time.time() + 30 * 86400):
+            self.assertIsNone(self.new_jywg().load_public_key())
+
+    def test_encrypt_once(self):
+        """测试登录重试时不重复解析公钥和加密"""
+        jy = self.new_jywg()
+        with patch('pyphon.jywg.rsa.PublicKey.load_pkcs1_openssl_pem', wraps=rsa.PublicKey.load_pkcs1_openssl_pem) as mock_load:
+            first = jy.encrypted_pwd()
+            self.assertEqual(jy.encrypted_pwd(), first)
+            mock_load.assert_called_once()
+
+    def test_refresh_on_key_error(self):
+        """测试登录返回密钥错误时重新获取公钥"""
+        jy = self.new_jywg()
+        responses = [{'Status': -1, 'ErrCode': -1, 'Message': '密码解密失败'}, {'Status': 0}]
+
+        def post(url, data):
+            rsp = MagicMock()
+            rsp.json.return_value = responses.pop(0)
+            return rsp
+
+        with patch.object(jy, 'restore_session', return_value=False), \
+                patch.object(jy, 'load_page') as mock_page, \
+                patch.object(jy, 'get_refreshed_vcode', return_value='1234'), \
+                patch.object(jy, 'fetch_validate_key', return_value=True), \
+                patch.object(jy.session, 'post', side_effect=post):
+            self.assertTrue(jy.validate())
+        self.assertEqual(jy.fetch_public_key.call_count, 2)
+        # 使用保存的公钥时也访问首页获取初始cookie
+        mock_page.assert_called_once()
+
+    def test_refresh_rotated_cached_key(self):
+        """测试使用保存的公钥登录失败时重新获取一次, 只有一次"""
+        self.new_jywg().public_key
+        jy = self.new_jywg()
+        responses = [{'Status': -1, 'ErrCode': -1, 'Message': '密码错误'}] * 3 + [{'Status': 0}]
+
+        def post(url, data):
+            rsp = MagicMock()
+            rsp.json.return_value = responses.pop(0)
+            return rsp
+
+        with patch.object(jy, 'restore_session', return_value=False), \
+                patch.object(jy, 'load_page'), \
+                patch.object(jy, 'get_refreshed_vcode', return_value='1234'), \
+                patch.object(jy, 'fetch_validate_key', return_value=True), \
+                patch.object(jy.session, 'post', side_effect=post):
+            self.assertTrue(jy.validate())
+        jy.fetch_public_key.assert_called_once()
+        self.assertFalse(jy.pubkey_cached)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/quotes.py 行情订阅
+使用本地mock行情服务器代替 hsmarketwg.eastmoney.com
+"""
+
+import unittest
+import sys
+import os
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from unittest.mock import patch
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+import misc
+from pyphon import quotes
+from pyphon.quotes import quote_hub
+
+
+class MockQuoteServer:
+    """本地mock行情服务器, 按 SHSZQuoteSnapshot 接口格式返回 prices 中的价格"""
+
+    def __init__(self, prices):
+        self.prices = prices
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                code = parse_qs(urlparse(self.path).query)['id'][0]
+                server.requests.append(code)
+                if code not in server.prices:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = json.dumps(server.snapshot(code, server.prices[code])).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @staticmethod
+    def snapshot(code, price):
+        fivequote = {'yesClosePrice': str(price)}
+        for i in range(1, 6):
+            fivequote[f'buy{i}'] = f'{price - 0.01 * i:.2f}'
+            fivequote[f'sale{i}'] = f'{price + 0.01 * i:.2f}'
+        return {
+            'code': code, 'name': code, 'topprice': f'{price * 1.1:.2f}', 'bottomprice': f'{price * 0.9:.2f}',
+            'realtimequote': {'currentPrice': str(price), 'zdf': '0.00%', 'zd': '0', 'date': '20250115', 'time': '10:00:00'},
+            'fivequote': fivequote
+        }
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestQuoteHub(unittest.TestCase):
+    """测试行情订阅刷新与通知"""
+
+    def setUp(self):
+        quote_hub.book.clear()
+        quote_hub.watched.clear()
+        quote_hub.listeners.clear()
+        misc.quote_cache.clear()
+
+    def tearDown(self):
+        quote_hub.book.clear()
+        quote_hub.watched.clear()
+        quote_hub.listeners.clear()
+
+    def test_refresh_and_notify(self):
+        """测试刷新行情并通知监听者"""
+        with MockQuoteServer({'600000': 10.0, '000001': 12.5}) as server, patch.object(misc, 'quote_server', server.url):
+            quote_hub.watch(['600000', '000001'])
+            events = []
+            quote_hub.add_listener(lambda code, snap, old: events.append((code, snap['price'], old)))
+
+            changed = quote_hub.refresh()
+
+            self.assertEqual(sorted(changed), ['000001', '600000'])
+            self.assertEqual(quote_hub.price('000001'), 12.5)
+            self.assertEqual(quote_hub.get('600000')['buysells']['sale5'], '10.05')
+            self.assertEqual(len(events), 2)
+
+            # 行情不变时不再通知
+            events.clear()
+            self.assertEqual(quote_hub.refresh(), [])
+            self.assertEqual(events, [])
+
+            # 价格变化时只通知变化的代码
+            server.prices['600000'] = 10.2
+            self.assertEqual(quote_hub.refresh(), ['600000'])
+            self.assertEqual(events[0][0], '600000')
+            self.assertEqual(events[0][2]['price'], 10.0)
+
+    def test_refresh_feeds_quote_cache(self):
+        """测试刷新后get_rt_price直接命中缓存"""
+        with MockQuoteServer({'600000': 10.0}) as server, patch.object(misc, 'quote_server', server.url):
+            quote_hub.watch(['600000'])
+            quote_hub.refresh()
+            server.requests.clear()
+
+            rp = misc.get_rt_price('600000')
+
+            self.assertEqual(rp['price'], 10.0)
+            self.assertEqual(server.requests, [])
+
+    def test_codes_include_account_stocks(self):
+        """测试订阅代码包含所有登录各账户的持仓/关注股票"""
+        account = quotes.AccountLoader.get().all_accounts
+        second = quotes.AccountLoader.register(quotes.AccountLoader('second'))
+        second.all_accounts['normal'] = type('acc', (), {'stocks': [{'code': '002594'}]})()
+        try:
+            with patch.dict(account, {'normal': type('acc', (), {'stocks': [{'code': '600000'}, {'code': '000001'}]})()}):
+                quote_hub.watch(['300750'])
+                self.assertEqual(quote_hub.codes(), ['000001', '002594', '300750', '600000'])
+        finally:
+            quotes.AccountLoader.unregister(second)
+
+    def test_listener_error_does_not_stop_refresh(self):
+        """测试监听者异常不影响其它监听者"""
+        with MockQuoteServer({'600000': 10.0}) as server, patch.object(misc, 'quote_server', server.url):
+            quote_hub.watch(['600000'])
+            events = []
+            quote_hub.add_listener(lambda code, snap, old: 1 / 0)
+            quote_hub.add_listener(lambda code, snap, old: events.append(code))
+
+            quote_hub.refresh()
+
+            self.assertEqual(events, ['600000'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/snapshot.py 交易核心发布的状态快照
+"""
+
+import unittest
+import sys
+import os
+import time
+import tempfile
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from requests.exceptions import Timeout
+
+# emtrader使用pyphon目录下的snapshot模块, 使用同一个state_snapshot
+from pyphon.emtrader import RemoteExtension, TradingExtension, state_snapshot, start_timeout
+
+
+class TestStateSnapshot(unittest.TestCase):
+    """测试快照发布和API进程读取"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'state_snapshot.json')
+        self.patcher = patch.object(state_snapshot, 'path', return_value=self.path)
+        self.patcher.start()
+        state_snapshot.cache = None
+        state_snapshot.cache_mtime = None
+        state_snapshot.stopped = False
+        self.state = {
+            'logins': {
+                '': {
+                    'status': {'login': None, 'running': True, 'status': 'success'},
+                    'stocks': {'normal': {'account': 'normal', 'stocks': [{'code': '600000', 'holdCount': 100}]}},
+                    'deals': {'normal': {'account': 'normal', 'deals': [{'code': '600000', 'sid': '1'}]}},
+                    'assets': {'normal': {'account': 'normal', 'assets': {'pure_assets': 1000.0}}}
+                }
+            },
+            'jobs': {'jobs': [], 'history': []}
+        }
+
+    def tearDown(self):
+        state_snapshot.stop()
+        self.patcher.stop()
+        self.tmpdir.cleanup()
+
+    def test_publish_and_load(self):
+        """测试原子写入后读取, 文件未变化时使用缓存"""
+        self.assertIsNone(state_snapshot.load())
+        state_snapshot.publish(self.state)
+        snap = state_snapshot.load()
+        self.assertEqual(snap['logins'], self.state['logins'])
+        self.assertEqual(snap['pid'], os.getpid())
+        self.assertEqual(os.listdir(self.tmpdir.name), ['state_snapshot.json'])
+        with patch('json.load') as mock_load:
+            self.assertIs(state_snapshot.load(), snap)
+            mock_load.assert_not_called()
+
+    def test_publisher_thread(self):
+        """测试发布线程按间隔调用builder"""
+        builder = MagicMock(return_value=self.state)
+        with patch.object(state_snapshot, 'interval', 0.02):
+            state_snapshot.start(builder)
+            time.sleep(0.1)
+            state_snapshot.stop()
+        self.assertGreaterEqual(builder.call_count, 2)
+        self.assertLess(state_snapshot.age(state_snapshot.load()), 1)
+
+    def test_publish_only_on_change(self):
+        """测试状态版本不变时不重新发布"""
+        builder = MagicMock(return_value=self.state)
+        versions = iter([1, 1, 2])
+        state_snapshot.builder = builder
+        state_snapshot.version = lambda: next(versions)
+        state_snapshot.last_version = None
+        for _ in range(3):
+            state_snapshot.run()
+        self.assertEqual(builder.call_count, 2)
+        state_snapshot.version = None
+
+        state_snapshot.stop()
+        state_snapshot.run()
+        self.assertEqual(builder.call_count, 2)
+
+    def test_remote_extension_reads_snapshot(self):
+        """测试API进程从快照返回持仓、成交和资产"""
+        remote = RemoteExtension()
+        self.assertEqual(remote.handleStatus()['status'], 'core unavailable')
+        self.assertEqual(remote.handleAccountAssets('normal')['assets'], {})
+
+        state_snapshot.publish(self.state)
+        self.assertTrue(remote.running)
+        self.assertEqual(remote.handleAccountStocks('normal')['stocks'][0]['code'], '600000')
+        self.assertEqual(remote.handleAccountDeals('normal')['deals'][0]['sid'], '1')
+        self.assertEqual(remote.handleAccountAssets('normal')['assets']['pure_assets'], 1000.0)
+        self.assertIn('error', remote.handleAccountStocks('credit'))
+        self.assertEqual(RemoteExtension('second').handleStatus()['status'], 'core unavailable')
+
+    def test_remote_extension_forwards_trade(self):
+        """测试交易请求转发给交易核心进程"""
+        rsp = MagicMock(status_code=200)
+        with patch('pyphon.emtrader.transport.post', return_value=rsp) as mock_post:
+            self.assertTrue(RemoteExtension('second').handleTrade({'code': '600000', 'tradeType': 'B'}))
+        url = mock_post.call_args[0][0]
+        self.assertTrue(url.endswith('/trade'))
+        self.assertEqual(mock_post.call_args[1]['params'], {'login': 'second'})
+        self.assertEqual(mock_post.call_args[1]['json']['code'], '600000')
+        self.assertTrue(mock_post.call_args[1]['json']['tradeId'])
+
+    def test_forward_start_timeout(self):
+        """测试转发启动请求使用单独的超时, 超时时返回正在启动"""
+        rsp = MagicMock(status_code=200)
+        rsp.json.return_value = {'status': 'started'}
+        with patch('pyphon.emtrader.transport.get', return_value=rsp) as mock_get:
+            self.assertEqual(RemoteExtension().handleStart(), {'status': 'started'})
+        self.assertEqual(mock_get.call_args[1]['timeout'], start_timeout)
+        self.assertGreater(start_timeout, 10)
+
+        with patch('pyphon.emtrader.transport.get', side_effect=Timeout('read timeout')):
+            self.assertEqual(RemoteExtension().handleStart(), {'status': 'starting'})
+
+    def test_forward_timeout_resends_same_trade_id(self):
+        """测试转发超时时用同一个tradeId重发, 仍然失败时返回状态未知"""
+        with patch('pyphon.emtrader.transport.post', side_effect=TimeoutError('timeout')) as mock_post:
+            trade = {'code': '600000', 'tradeType': 'B'}
+            self.assertIsNone(RemoteExtension().handleTrade(trade))
+        ids = [c[1]['json']['tradeId'] for c in mock_post.call_args_list]
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(trade['tradeId'], ids[0])
+
+        with patch('pyphon.emtrader.transport.post', side_effect=[MagicMock(status_code=502), MagicMock(status_code=200)]):
+            self.assertTrue(RemoteExtension().handleTrade({'code': '600000', 'tradeType': 'B'}))
+        with patch('pyphon.emtrader.transport.post', return_value=MagicMock(status_code=400)) as mock_post:
+            self.assertFalse(RemoteExtension().handleTrade({'code': '600000', 'tradeType': 'B'}))
+        mock_post.assert_called_once()
+
+
+class TestTradingExtensionCore(unittest.TestCase):
+    """测试交易核心按tradeId去重, 状态快照不修改账户数据"""
+
+    def setUp(self):
+        self.ext = TradingExtension()
+        self.ext.accld = MagicMock()
+
+    @patch('pyphon.emtrader.get_rt_prices', return_value={})
+    def test_duplicate_trade_id(self, mock_prices):
+        """测试同一个tradeId只下单一次"""
+        trade = {'code': '600000', 'tradeType': 'S', 'account': 'normal', 'price': 10.0, 'count': 100, 'tradeId': 't1'}
+        self.assertTrue(self.ext.handleTrade(dict(trade)))
+        self.assertTrue(self.ext.handleTrade(dict(trade)))
+        self.ext.accld.trade_batch.assert_called_once()
+        self.assertTrue(self.ext.handleTrade({**trade, 'tradeId': 't2'}))
+        self.assertEqual(self.ext.accld.trade_batch.call_count, 2)
+
+    def test_stocks_view_does_not_mutate(self):
+        """测试获取持仓不修改账户中的策略"""
+        strategies = {'grptype': 'GroupStandard'}
+        stock = {'code': '600000', 'holdCount': 100, 'strategies': strategies, 'buydetail': [{'count': 100}], 'buydetail_full': []}
+        self.ext.accld.all_accounts = {'normal': MagicMock(stocks=[stock])}
+        sobj = self.ext.handleAccountStocks('normal')['stocks'][0]
+        self.assertEqual(sobj['strategies']['buydetail'], [{'count': 100}])
+        self.assertEqual(strategies, {'grptype': 'GroupStandard'})
+        self.assertIsNot(sobj['strategies']['buydetail'], stock['buydetail'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/timers.py 定时任务调度和委托轮询
+"""
+
+import unittest
+import sys
+import os
+import time
+import threading
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.timers import alarm_hub, scheduler
+from pyphon.accounts import Account, TrackingAccount, CreditAccount, CollateralAccount, OrderSignal
+
+
+def wait_for(cond, timeout=3):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if cond():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class TestScheduler(unittest.TestCase):
+    """测试堆调度器"""
+
+    def setUp(self):
+        scheduler.calendar = None
+        scheduler.trading_days = {}
+
+    def test_unique_ids_and_order(self):
+        """测试任务id唯一, 按执行时间先后执行"""
+        runs = []
+        id1 = scheduler.add_job(lambda: runs.append(1), 0.2)
+        id2 = scheduler.add_job(lambda: runs.append(2), 0.05)
+        self.assertNotEqual(id1, id2)
+        self.assertTrue(wait_for(lambda: len(runs) == 2))
+        self.assertEqual(runs, [2, 1])
+        self.assertNotIn(id1, scheduler.jobs)
+
+    def test_cancel(self):
+        """测试取消指定任务不影响其他任务"""
+        runs = []
+        id1 = scheduler.add_job(lambda: runs.append(1), 0.1)
+        scheduler.add_job(lambda: runs.append(2), 0.1)
+        self.assertTrue(alarm_hub.cancel_task(id1))
+        self.assertTrue(wait_for(lambda: runs == [2]))
+        time.sleep(0.1)
+        self.assertEqual(runs, [2])
+
+    def test_recurring_job_metrics(self):
+        """测试周期任务和执行耗时统计"""
+        runs = []
+        jid = alarm_hub.add_interval_task(lambda: runs.append(time.sleep(0.01)), 0.02)
+        self.assertTrue(wait_for(lambda: len(runs) >= 3))
+        scheduler.cancel(jid)
+        info = next(j for j in scheduler.stats()['history'] if j['id'] == jid)
+        self.assertEqual(info['status'], 'cancelled')
+        self.assertGreaterEqual(info['runs'], 3)
+        self.assertGreater(info['max_duration'], 0)
+
+    def test_skip_non_trading_day(self):
+        """测试非交易日跳过交易日任务"""
+        runs = []
+        scheduler.calendar = lambda: False
+        jid = scheduler.add_job(lambda: runs.append(1), trading_day_only=True)
+        self.assertTrue(wait_for(lambda: jid not in scheduler.jobs))
+        time.sleep(0.05)
+        self.assertEqual(runs, [])
+        self.assertEqual(scheduler.history[-1]['status'], 'skipped')
+
+    def test_failed_job_recorded(self):
+        """测试任务异常被记录"""
+        def fail():
+            raise ValueError('boom')
+        jid = scheduler.add_job(fail)
+        self.assertTrue(wait_for(lambda: jid not in scheduler.jobs))
+        info = next(j for j in scheduler.stats()['history'] if j['id'] == jid)
+        self.assertEqual(info['status'], 'failed')
+        self.assertEqual(info['last_error'], 'boom')
+
+    def test_callback_returns_delay(self):
+        """测试回调返回秒数时再次执行, 返回None时结束"""
+        runs = []
+
+        def poll():
+            runs.append(1)
+            return 0.01 if len(runs) < 3 else None
+        jid = scheduler.add_job(poll)
+        self.assertTrue(wait_for(lambda: jid not in scheduler.jobs))
+        self.assertEqual(len(runs), 3)
+        self.assertEqual(scheduler.history[-1]['status'], 'done')
+
+    def test_reschedule(self):
+        """测试等待中的任务提前执行"""
+        runs = []
+        jid = scheduler.add_job(lambda: runs.append(1), 60)
+        self.assertTrue(scheduler.reschedule(jid, 0))
+        self.assertTrue(wait_for(lambda: runs == [1]))
+        self.assertFalse(scheduler.reschedule(jid, 0))
+
+
+class TestOrderPolling(unittest.TestCase):
+    """测试按未成交委托调整的轮询间隔"""
+
+    def setUp(self):
+        self.normal = Account()
+        self.normal.keyword = 'normal'
+        self.collateral = CollateralAccount()
+        self.credit = CreditAccount()
+        self.credit.hacc = self.collateral
+        self.track = TrackingAccount('track')
+        self.track.trading_records = [{'code': '600000', 'sid': 1, 'tradeType': 'B'}]
+        for acc in (self.normal, self.collateral, self.credit, self.track):
+            acc.check_orders = MagicMock()
+
+        self.accld = MagicMock()
+        self.accld.all_accounts = {'normal': self.normal, 'collateral': self.collateral, 'credit': self.credit, 'track': self.track}
+        self.accld.order_signal = OrderSignal()
+        self.patcher = patch('pyphon.timers.accld', self.accld)
+        self.patcher.start()
+        alarm_hub.poll_interval = None
+
+    def tearDown(self):
+        self.patcher.stop()
+        if alarm_hub.poll_job is not None:
+            scheduler.cancel(alarm_hub.poll_job)
+        alarm_hub.poll_job = None
+        alarm_hub.poll_interval = None
+
+    def test_poll_all_accounts_except_credit(self):
+        """测试轮询所有账户, 融资账户由担保品账户代查"""
+        self.assertFalse(alarm_hub.poll_orders())
+        for acc in (self.normal, self.collateral, self.track):
+            acc.check_orders.assert_called_once()
+        self.credit.check_orders.assert_not_called()
+
+    def test_pending_orders_poll_fast(self):
+        """测试有未成交委托时快速轮询"""
+        self.collateral.trading_records = [{'code': '600000', 'sid': 'ORDER001', 'tradeType': 'B'}]
+        self.assertTrue(alarm_hub.poll_orders())
+        with patch('pyphon.timers.delay_seconds', return_value=-3600):
+            alarm_hub.poll_interval = alarm_hub.poll_slow
+            self.assertEqual(alarm_hub.next_poll_interval(True), alarm_hub.poll_fast)
+
+    def test_backoff_without_pending(self):
+        """测试无未成交委托时逐步退避"""
+        with patch('pyphon.timers.delay_seconds', return_value=-3600):
+            intervals = []
+            for _ in range(10):
+                alarm_hub.poll_interval = alarm_hub.next_poll_interval(False)
+                intervals.append(alarm_hub.poll_interval)
+        self.assertEqual(intervals[0], alarm_hub.poll_fast)
+        self.assertEqual(intervals[1], alarm_hub.poll_fast * 2)
+        self.assertEqual(intervals[-1], alarm_hub.poll_slow)
+
+    def test_lunch_break_pause(self):
+        """测试午休期间等到13:00后再查询"""
+        delays = {'11:30': -60, '13:00': 5400, '13:0:5': 5405}
+        with patch('pyphon.timers.delay_seconds', side_effect=lambda t: delays[t]):
+            self.assertEqual(alarm_hub.next_poll_interval(True), 5405)
+
+    def test_check_orders_returns_next_delay(self):
+        """测试每次查询返回下次查询的延迟, 14:55之后结束轮询"""
+        with patch.object(alarm_hub, 'poll_orders', return_value=True):
+            with patch('pyphon.timers.delay_seconds', return_value=3600):
+                self.assertEqual(alarm_hub.check_orders(), alarm_hub.poll_fast)
+            with patch('pyphon.timers.delay_seconds', return_value=-1):
+                self.assertIsNone(alarm_hub.check_orders())
+        self.assertIsNone(alarm_hub.poll_interval)
+
+    def test_new_order_wakes_poller(self):
+        """测试提交新委托后立即唤醒等待中的轮询任务, 等待期间不占用线程"""
+        polls = []
+
+        def poll_orders():
+            polls.append(threading.current_thread().name)
+            return False
+
+        self.accld.order_signal.add_callback(alarm_hub.wakeup)
+        with patch.object(alarm_hub, 'poll_orders', side_effect=poll_orders):
+            with patch.object(alarm_hub, 'next_poll_interval', return_value=60):
+                with patch('pyphon.timers.delay_seconds', return_value=3600):
+                    alarm_hub.poll_job = scheduler.add_job(alarm_hub.check_orders)
+                    self.assertTrue(wait_for(lambda: scheduler.jobs[alarm_hub.poll_job]['status'] == 'pending' and len(polls) == 1))
+                    self.assertEqual(scheduler.jobs[alarm_hub.poll_job]['interval'], None)
+                    self.accld.order_signal.set()
+                    self.assertTrue(wait_for(lambda: len(polls) == 2))
+        self.assertTrue(all(name.startswith('scheduler') for name in polls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/transport.py 中按host复用连接池的逻辑
+"""
+
+import unittest
+import sys
+import os
+import asyncio
+from unittest.mock import patch, Mock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.transport import transport
+
+
+class TestTransportSessions(unittest.TestCase):
+    """测试共享session"""
+
+    def tearDown(self):
+        transport.close()
+
+    def test_same_host_shares_session(self):
+        """同一host复用同一个session"""
+        s1 = transport.session('https://hsmarketwg.eastmoney.com/api/SHSZQuoteSnapshot?id=600000')
+        s2 = transport.session('https://hsmarketwg.eastmoney.com/api/other')
+        self.assertIs(s1, s2)
+
+    def test_different_hosts_use_different_sessions(self):
+        """不同host使用不同session"""
+        s1 = transport.session('https://hsmarketwg.eastmoney.com/api')
+        s2 = transport.session('http://www.sse.com.cn/js/common/systemDate_global.js')
+        self.assertIsNot(s1, s2)
+
+    def test_new_session_pool_size(self):
+        """独立session按配置的连接池大小挂载adapter"""
+        s = transport.new_session(pool_size=3)
+        adapter = s.get_adapter('https://jywg.eastmoneysec.com')
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertIsNot(s, transport.session('https://jywg.eastmoneysec.com'))
+
+    def test_get_sets_default_timeout(self):
+        """get默认带超时"""
+        session = Mock()
+        with patch.object(transport, 'session', return_value=session):
+            transport.get('https://example.com/a')
+            session.get.assert_called_once_with('https://example.com/a', timeout=transport.timeout)
+
+    def test_async_fallback_without_httpx(self):
+        """未安装httpx时异步接口退回同步请求"""
+        with patch('pyphon.transport.importlib.util.find_spec', return_value=None):
+            with patch.object(transport, 'get', return_value='resp') as mock_get:
+                result = asyncio.run(transport.aget('https://example.com/a'))
+                self.assertEqual(result, 'resp')
+                mock_get.assert_called_once_with('https://example.com/a')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/uploader.py 成交上传队列
+"""
+
+import unittest
+import sys
+import os
+import gzip
+import json
+import time
+import tempfile
+import threading
+from urllib.parse import parse_qs
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.uploader import deal_uploader
+
+
+def decode_form(headers, data):
+    """还原上传的表单, 默认上传gzip压缩的表单"""
+    if not (headers or {}).get('Content-Encoding') == 'gzip':
+        return data
+    return {k: v[0] for k, v in parse_qs(gzip.decompress(data).decode('utf-8')).items()}
+
+
+class TestDealUploader(unittest.TestCase):
+    """测试合并、压缩、重试和持久化"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'upload_queue.json')
+        self.patchers = [
+            patch.object(deal_uploader, 'path', return_value=self.path),
+            patch.object(deal_uploader, 'backoff', 0),
+        ]
+        for p in self.patchers:
+            p.start()
+        deal_uploader.queues = None
+        deal_uploader.protected.clear()
+        deal_uploader.dropped_accs.clear()
+        self.fha = {'server': 'http://fha.test/', 'headers': {'Authorization': 'Basic x'}}
+        self.posts = []
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        deal_uploader.queues = None
+        self.tmpdir.cleanup()
+
+    def deal(self, sid, code='SH600000'):
+        return {'time': '2025-01-15 10:00:00', 'sid': sid, 'code': code, 'tradeType': 'B', 'price': 12.5, 'count': 100}
+
+    def mock_post(self, status=200):
+        def post(url, headers=None, data=None):
+            self.posts.append({'url': url, 'headers': headers, 'body': data, 'data': decode_form(headers, data)})
+            rsp = MagicMock()
+            rsp.status_code = status
+            if status != 200:
+                rsp.raise_for_status.side_effect = Exception(f'HTTP {status}')
+            return rsp
+        return post
+
+    def test_coalesce_per_account(self):
+        """测试同一账户多次加入的成交合并为一次请求, 重复成交只上传一次"""
+        deal_uploader.enqueue('normal', [self.deal('001')])
+        deal_uploader.enqueue('normal', [self.deal('002'), self.deal('001')])
+        deal_uploader.enqueue('collat', [self.deal('003')])
+        with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+            self.assertTrue(deal_uploader.flush(fha=self.fha))
+
+        self.assertEqual(len(self.posts), 2)
+        normal = next(p for p in self.posts if p['data']['acc'] == 'normal')
+        self.assertEqual([d['sid'] for d in json.loads(normal['data']['data'])], ['001', '002'])
+        self.assertEqual(deal_uploader.pending(), 0)
+
+    def test_fha_per_login(self):
+        """测试其他登录的成交使用该登录的fha上传, 上传时账户不带登录名"""
+        other = {'server': 'http://other.test/', 'headers': {'Authorization': 'Basic y'}}
+        deal_uploader.enqueue('normal', [self.deal('001')])
+        deal_uploader.enqueue('second/normal', [self.deal('002')])
+        with patch.object(deal_uploader, 'fha', self.fha), patch.dict(deal_uploader.fhas, {'second': other}):
+            with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+                self.assertTrue(deal_uploader.flush())
+
+        urls = {json.loads(p['data']['data'])[0]['sid']: (p['url'], p['data']['acc']) for p in self.posts}
+        self.assertEqual(urls['001'], ('http://fha.test/stock', 'normal'))
+        self.assertEqual(urls['002'], ('http://other.test/stock', 'normal'))
+
+    def test_gzip(self):
+        """测试默认发送gzip表单, 关闭压缩时发送普通表单"""
+        self.assertTrue(deal_uploader.compress)
+        deal_uploader.enqueue('normal', [self.deal('001')])
+        with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+            self.assertTrue(deal_uploader.flush('normal', self.fha))
+
+        post = self.posts[0]
+        self.assertEqual(post['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(post['headers']['Authorization'], 'Basic x')
+        form = parse_qs(gzip.decompress(post['body']).decode('utf-8'))
+        self.assertEqual(form['acc'], ['normal'])
+        self.assertEqual(json.loads(form['data'][0])[0]['sid'], '001')
+
+        deal_uploader.enqueue('normal', [self.deal('002')])
+        with patch.object(deal_uploader, 'compress', False):
+            with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+                self.assertTrue(deal_uploader.flush('normal', self.fha))
+        self.assertEqual(self.posts[1]['headers'], self.fha['headers'])
+        self.assertEqual(json.loads(self.posts[1]['body']['data'])[0]['sid'], '002')
+
+    def test_retry_and_persist(self):
+        """测试失败重试后保留在队列中, 重启后继续上传"""
+        deal_uploader.enqueue('normal', [self.deal('001')])
+        with patch('pyphon.uploader.transport.post', side_effect=self.mock_post(500)):
+            self.assertFalse(deal_uploader.flush('normal', self.fha))
+        self.assertEqual(len(self.posts), deal_uploader.max_retry)
+
+        deal_uploader.queues = None
+        self.assertEqual(deal_uploader.pending('normal'), 1)
+        with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+            self.assertTrue(deal_uploader.flush('normal', self.fha))
+        deal_uploader.queues = None
+        self.assertEqual(deal_uploader.pending(), 0)
+
+    def test_batch_size(self):
+        """测试按批量大小拆分请求"""
+        deal_uploader.enqueue('normal', [self.deal(str(i)) for i in range(5)])
+        with patch.object(deal_uploader, 'batch_size', 2):
+            with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+                self.assertTrue(deal_uploader.flush('normal', self.fha))
+        self.assertEqual([len(json.loads(p['data']['data'])) for p in self.posts], [2, 2, 1])
+
+    def test_dropped_deals_fail_flush(self):
+        """测试有成交被丢弃时flush不返回成功"""
+        with patch.object(deal_uploader, 'max_pending', 100):
+            deal_uploader.enqueue('normal', [self.deal(str(i)) for i in range(150)])
+            with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+                self.assertFalse(deal_uploader.flush('normal', self.fha))
+                self.assertEqual(sum(len(json.loads(p['data']['data'])) for p in self.posts), 100)
+                # 丢弃只报告一次
+                deal_uploader.enqueue('normal', [self.deal('new')])
+                self.assertTrue(deal_uploader.flush('normal', self.fha))
+
+    def test_backfill_never_dropped(self):
+        """测试回补的成交在队列满时不被丢弃"""
+        with patch.object(deal_uploader, 'max_pending', 100):
+            deal_uploader.enqueue('normal', [self.deal(f'h{i}') for i in range(150)], droppable=False)
+            deal_uploader.enqueue('collat', [self.deal('001')])
+            self.assertEqual(deal_uploader.pending('normal'), 150)
+            self.assertEqual(deal_uploader.pending('collat'), 0)
+            with patch('pyphon.uploader.transport.post', side_effect=self.mock_post()):
+                self.assertTrue(deal_uploader.flush('normal', self.fha))
+                self.assertFalse(deal_uploader.flush('collat', self.fha))
+        self.assertEqual(sum(len(json.loads(p['data']['data'])) for p in self.posts), 150)
+        self.assertEqual(deal_uploader.protected, set())
+
+    def test_no_fha(self):
+        """测试未配置fha时不上传"""
+        deal_uploader.enqueue('normal', [self.deal('001')])
+        self.assertFalse(deal_uploader.flush('normal', {}))
+        self.assertEqual(deal_uploader.pending('normal'), 1)
+
+
+
+class TestDealUploaderWorker(unittest.TestCase):
+    """测试后台上传线程、队列上限和退出前清空队列"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'upload_queue.json')
+        self.patchers = [
+            patch.object(deal_uploader, 'path', return_value=self.path),
+            patch.object(deal_uploader, 'interval', 0.05),
+        ]
+        for p in self.patchers:
+            p.start()
+        deal_uploader.queues = None
+        deal_uploader.protected.clear()
+        deal_uploader.dropped_accs.clear()
+        self.release = threading.Event()
+        self.posts = []
+
+    def tearDown(self):
+        self.release.set()
+        deal_uploader.stop(timeout=2)
+        for p in self.patchers:
+            p.stop()
+        deal_uploader.queues = None
+        self.tmpdir.cleanup()
+
+    def post(self, url, headers=None, data=None):
+        self.release.wait(2)
+        self.posts.append(decode_form(headers, data))
+        rsp = MagicMock()
+        rsp.status_code = 200
+        return rsp
+
+    def deal(self, sid):
+        return {'time': '2025-01-15 10:00:00', 'sid': sid, 'code': 'SH600000', 'tradeType': 'B', 'price': 12.5, 'count': 100}
+
+    def test_enqueue_does_not_block_on_slow_server(self):
+        """测试服务器慢时加入队列立即返回, stop时上传剩余成交"""
+        with patch('pyphon.uploader.transport.post', side_effect=self.post):
+            deal_uploader.start({'server': 'http://fha.test/', 'headers': {'Authorization': 'Basic x'}})
+            start = time.time()
+            deal_uploader.enqueue('normal', [self.deal('001')])
+            time.sleep(0.1)
+            deal_uploader.enqueue('normal', [self.deal('002')])
+            self.assertLess(time.time() - start, 0.5)
+
+            self.release.set()
+            self.assertTrue(deal_uploader.stop(timeout=2))
+        self.assertEqual(deal_uploader.pending(), 0)
+        self.assertEqual(sum(len(json.loads(p['data'])) for p in self.posts), 2)
+        self.assertEqual(deal_uploader.stats()['running'], False)
+
+    def test_full_queue_drops_oldest(self):
+        """测试队列满时丢弃最早的成交, 不阻塞加入队列的线程"""
+        with patch.object(deal_uploader, 'max_pending', 2):
+            dropped = deal_uploader.stats()['dropped']
+            deal_uploader.enqueue('normal', [{**self.deal('001'), 'time': '2025-01-15 09:31:00'}])
+            deal_uploader.enqueue('collat', [{**self.deal('002'), 'time': '2025-01-15 09:30:00'}])
+            deal_uploader.enqueue('normal', [{**self.deal('003'), 'time': '2025-01-15 09:32:00'}])
+            self.assertEqual(deal_uploader.pending(), 2)
+            self.assertEqual(deal_uploader.pending('collat'), 0)
+            self.assertEqual(deal_uploader.stats()['dropped'], dropped + 1)
+
+    def test_batched_saves(self):
+        """测试上传任务运行时加入队列不写文件, 由上传任务批量写入"""
+        with patch('pyphon.uploader.transport.post', side_effect=self.post):
+            with patch.object(deal_uploader, 'interval', 60):
+                deal_uploader.start({'server': 'http://fha.test/', 'headers': {'Authorization': 'Basic x'}})
+                saves = deal_uploader.stats()['saves']
+                for i in range(5):
+                    deal_uploader.enqueue('normal', [self.deal(str(i))])
+                self.assertEqual(deal_uploader.stats()['saves'], saves)
+                self.assertFalse(os.path.exists(self.path))
+                deal_uploader.persist()
+                self.assertEqual(deal_uploader.stats()['saves'], saves + 1)
+                with open(self.path) as f:
+                    self.assertEqual(len(json.load(f)['normal']), 5)
+
+                self.release.set()
+                self.assertTrue(deal_uploader.stop(timeout=2))
+        with open(self.path) as f:
+            self.assertEqual(json.load(f), {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+测试 pyphon/warmup.py 盘前预热
+"""
+
+import unittest
+import sys
+import os
+import time
+from unittest.mock import patch, MagicMock
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
+
+from pyphon.warmup import warmup
+
+
+def slow(result, seconds=0.2):
+    def func(*args):
+        time.sleep(seconds)
+        return result
+    return func
+
+
+class TestWarmup(unittest.TestCase):
+    """测试并发预热和就绪状态"""
+
+    def setUp(self):
+        self.calls = []
+        self.account = MagicMock()
+        self.account.keyword = 'normal'
+        self.account.fetch_watchings.side_effect = slow({'SH600000': {'strategies': {}}})
+        self.account.get_assets_and_positions.side_effect = slow(({'Zzc': '1'}, [{'Zqdm': '600000'}]))
+        self.account.apply_watchings.side_effect = lambda w: self.calls.append('watchings')
+        self.account.on_positions_loaded.side_effect = lambda p: self.calls.append('positions')
+
+        self.accld = MagicMock()
+        self.accld.trade_accounts.return_value = [self.account]
+        self.accld.init_track_accounts.side_effect = slow(None)
+
+        self.patchers = [
+            patch('pyphon.warmup.accld', self.accld),
+        ]
+        for p in self.patchers:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+
+    def test_concurrent_fetch_then_apply(self):
+        """测试各步骤并发执行, 先合并关注再更新持仓"""
+        start = time.time()
+        self.assertTrue(warmup.run())
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEqual(self.calls, ['watchings', 'positions'])
+        self.account.apply_watchings.assert_called_once_with({'SH600000': {'strategies': {}}})
+        self.accld.create_accounts.assert_called_once()
+
+        status = warmup.status()
+        self.assertEqual(status['state'], 'ready')
+        self.assertEqual(set(status['steps']), {'track_accounts', 'watchings:normal', 'assets:normal'})
+        self.assertTrue(warmup.ready())
+
+    def test_failed_step(self):
+        """测试某一步失败时其他步骤继续, 状态为failed"""
+        self.accld.init_track_accounts.side_effect = RuntimeError('fha down')
+        self.assertFalse(warmup.run())
+        self.assertEqual(warmup.state, 'failed')
+        self.assertEqual(warmup.steps['track_accounts']['error'], 'fha down')
+        self.assertEqual(self.calls, ['watchings', 'positions'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,8 @@ import unittest
 import sys
 import os
 import json
+import time
+import threading
 from datetime import datetime, timedelta
 from unittest.mock import patch, MagicMock, Mock
 
@@ -9,7 +11,7 @@ from unittest.mock import patch, MagicMock, Mock
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'pyphon'))
 
-from pyphon.accounts import Account, NormalAccount, CollateralAccount, TrackingAccount, accld
+from pyphon.accounts import Account, NormalAccount, CollateralAccount, TrackingAccount, PositionList, BuyDetailList, AccountLoader, accld
 from pyphon.misc import *
 
 
@@ -49,6 +51,94 @@ class TestAccount(Account):
         return "http://test.com/trade"
 
 
+class TestPositionList(unittest.TestCase):
+    """测试按代码索引的持仓列表"""
+
+    def setUp(self):
+        self.account = Account()
+        self.account.stocks = [
+            {'code': '600000', 'name': '浦发银行', 'holdCount': 100},
+            {'code': '000001', 'name': '平安银行', 'holdCount': 200}
+        ]
+
+    def test_assign_list_is_indexed(self):
+        """测试直接赋值list后可按代码查找"""
+        self.assertIsInstance(self.account.stocks, PositionList)
+        self.assertIs(self.account.get_stock('000001'), self.account.stocks[1])
+
+    def test_append_and_remove(self):
+        """测试追加和删除后索引同步更新"""
+        self.account.stocks.append({'code': '300750', 'name': '', 'holdCount': 0})
+        self.assertEqual(self.account.get_stock('300750')['holdCount'], 0)
+
+        self.account.stocks.remove(self.account.get_stock('600000'))
+        self.assertIsNone(self.account.get_stock('600000'))
+        self.assertEqual([s['code'] for s in self.account.stocks], ['000001', '300750'])
+
+    def test_keeps_list_behaviour(self):
+        """测试保持list的顺序和JSON序列化"""
+        self.assertEqual(json.loads(json.dumps(self.account.stocks))[0]['code'], '600000')
+        self.assertEqual(len(self.account.stocks), 2)
+
+
+class TestBuyDetailList(unittest.TestCase):
+    """测试按(sid, date, type)索引的买卖明细"""
+
+    def test_extend_indexed_buydetail(self):
+        """测试扩展带索引的明细时去重并保持顺序"""
+        buydetail = BuyDetailList([
+            {'sid': '001', 'date': '2025-01-01', 'type': 'B', 'count': 100}
+        ])
+        exdetail = [
+            {'sid': '001', 'date': '2025-01-01', 'type': 'B', 'count': 100},
+            {'sid': '001', 'date': '2025-01-01', 'type': 'S', 'count': 100},
+            {'sid': '002', 'date': '2025-01-02', 'type': 'B', 'count': 200},
+            {'sid': '002', 'date': '2025-01-02', 'type': 'B', 'count': 200}
+        ]
+        cnt = Account.extend_buydetail(buydetail, exdetail)
+        self.assertEqual(cnt, 2)
+        self.assertEqual([(b['sid'], b['type']) for b in buydetail], [('001', 'B'), ('001', 'S'), ('002', 'B')])
+        self.assertTrue(buydetail.has(('002', '2025-01-02', 'B')))
+
+    def test_of_wraps_list_only(self):
+        """测试of只包装list"""
+        details = [{'sid': '001', 'date': '2025-01-01', 'type': 'B'}]
+        wrapped = BuyDetailList.of(details)
+        self.assertIsInstance(wrapped, BuyDetailList)
+        self.assertIs(BuyDetailList.of(wrapped), wrapped)
+        self.assertIsNone(BuyDetailList.of(None))
+
+    def test_pickle_roundtrip(self):
+        """测试序列化后索引仍然可用"""
+        import pickle
+        buydetail = pickle.loads(pickle.dumps(BuyDetailList([{'sid': '001', 'date': '2025-01-01', 'type': 'B'}])))
+        self.assertIsInstance(buydetail, BuyDetailList)
+        self.assertTrue(buydetail.has(('001', '2025-01-01', 'B')))
+        positions = pickle.loads(pickle.dumps(PositionList([{'code': '600000'}])))
+        self.assertIsNotNone(positions.get('600000'))
+
+    def test_strategies_share_buydetail(self):
+        """测试股票明细和strategies中的明细是同一个列表"""
+        account = Account()
+        account.add_watch_stock('600000', {'buydetail': [{'sid': '001', 'date': '2025-01-01', 'type': 'B', 'count': 100}], 'buydetail_full': []})
+        account.extend_stock_buydetail('600000', [{'sid': '002', 'date': '2025-01-02', 'type': 'B', 'count': 100}])
+        stock = account.get_stock('600000')
+        self.assertIs(stock['strategies']['buydetail'], stock['buydetail'])
+        self.assertIs(stock['strategies']['buydetail_full'], stock['buydetail_full'])
+        self.assertEqual(len(stock['strategies']['buydetail']), 2)
+
+    def test_extend_stock_buydetail_indexes_stock(self):
+        """测试扩展股票明细后股票明细带索引"""
+        account = Account()
+        account.stocks = [{'code': '600000', 'buydetail': [], 'buydetail_full': []}]
+        account.extend_stock_buydetail('600000', [{'sid': '001', 'date': '2025-01-01', 'type': 'B', 'count': 100}])
+        stock = account.get_stock('600000')
+        self.assertIsInstance(stock['buydetail_full'], BuyDetailList)
+        self.assertEqual(len(stock['buydetail']), 1)
+        account.extend_stock_buydetail('600000', [{'sid': '001', 'date': '2025-01-01', 'type': 'B', 'count': 100}])
+        self.assertEqual(len(stock['buydetail_full']), 1)
+
+
 class TestAccountMethods(unittest.TestCase):
     """测试 Account 类中不涉及 HTTP 请求的方法"""
 
@@ -574,6 +664,115 @@ class TestMiscEdgeCases(unittest.TestCase):
         self.assertEqual(result, 100)
 
 
+class TestMiscBatchSnapshots(unittest.TestCase):
+    """测试批量行情快照"""
+
+    def setUp(self):
+        quote_cache.clear()
+
+    def make_snapshot(self, code, price):
+        return {
+            'code': code, 'price': price, 'top_price': price * 1.1, 'bottom_price': price * 0.9,
+            'buysells': {'buy1': price - 0.01, 'sale1': price + 0.01, 'buy5': price - 0.05, 'sale5': price + 0.05}
+        }
+
+    def test_get_stock_snapshots(self):
+        """测试批量获取快照, 重复代码只请求一次"""
+        with patch('pyphon.misc.get_stock_snapshot', side_effect=lambda c: self.make_snapshot(c, 10.0)) as mock_snap:
+            result = get_stock_snapshots(['600000', '000001', '600000'])
+
+            self.assertEqual(list(result.keys()), ['600000', '000001'])
+            self.assertEqual(mock_snap.call_count, 2)
+            self.assertEqual(result['000001']['code'], '000001')
+
+    def test_get_stock_snapshots_partial_failure(self):
+        """测试部分代码获取失败"""
+        def snap(code):
+            if code == '000001':
+                raise ValueError('network error')
+            return self.make_snapshot(code, 10.0)
+
+        with patch('pyphon.misc.get_stock_snapshot', side_effect=snap):
+            result = get_stock_snapshots(['600000', '000001'])
+
+            self.assertEqual(list(result.keys()), ['600000'])
+
+    def test_get_stock_snapshots_empty(self):
+        """测试空代码列表"""
+        self.assertEqual(get_stock_snapshots([]), {})
+
+    def test_get_rt_prices(self):
+        """测试批量获取实时价格"""
+        with patch('pyphon.misc.get_stock_snapshot', side_effect=lambda c: self.make_snapshot(c, 10.0)):
+            result = get_rt_prices(['600000'])
+
+            self.assertAlmostEqual(result['600000']['ask5'], 10.05)
+            self.assertAlmostEqual(result['600000']['bid5'], 9.95)
+            self.assertAlmostEqual(result['600000']['top_price'], 11.0)
+
+    def test_get_stock_snapshots_uses_cache(self):
+        """测试批量获取时只请求缓存中没有的代码"""
+        quote_cache.put('600000', self.make_snapshot('600000', 10.0))
+        with patch('pyphon.misc.get_stock_snapshot', side_effect=lambda c: self.make_snapshot(c, 20.0)) as mock_snap:
+            result = get_stock_snapshots(['600000', '000001'])
+
+            mock_snap.assert_called_once_with('000001')
+            self.assertEqual(result['600000']['price'], 10.0)
+            self.assertEqual(result['000001']['price'], 20.0)
+
+
+class TestQuoteCache(unittest.TestCase):
+    """测试行情快照缓存"""
+
+    def setUp(self):
+        quote_cache.clear()
+        self.snap = {
+            'code': '600000', 'price': 10.0, 'top_price': 11.0, 'bottom_price': 9.0,
+            'buysells': {'buy1': 9.99, 'sale1': 10.01, 'buy5': 9.95, 'sale5': 10.05}
+        }
+
+    def test_hit_and_miss(self):
+        """测试命中与未命中计数"""
+        self.assertIsNone(quote_cache.get('600000'))
+        quote_cache.put('600000', self.snap)
+        self.assertEqual(quote_cache.get('600000'), self.snap)
+
+        stats = quote_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_expired(self):
+        """测试超过ttl的快照视为过期"""
+        with patch('pyphon.misc.time.time', return_value=1000.0):
+            quote_cache.put('600000', self.snap)
+        with patch('pyphon.misc.time.time', return_value=1000.0 + quote_cache.ttl + 1):
+            self.assertIsNone(quote_cache.get('600000'))
+            self.assertEqual(quote_cache.get('600000', max_age=quote_cache.ttl + 2), self.snap)
+
+    def test_lru_eviction(self):
+        """测试超过容量时淘汰最久未使用的代码"""
+        with patch.object(quote_cache, 'maxsize', 2):
+            quote_cache.put('600000', self.snap)
+            quote_cache.put('000001', self.snap)
+            quote_cache.get('600000')
+            quote_cache.put('000002', self.snap)
+
+            self.assertIsNotNone(quote_cache.get('600000'))
+            self.assertIsNone(quote_cache.get('000001'))
+
+    def test_get_rt_price_cached(self):
+        """测试get_rt_price命中缓存时不发请求, max_age=0时强制刷新"""
+        quote_cache.put('600000', self.snap)
+        with patch('pyphon.misc.get_stock_snapshot', return_value=self.snap) as mock_snap:
+            result = get_rt_price('600000')
+            mock_snap.assert_not_called()
+            self.assertEqual(result['ask5'], 10.05)
+
+            get_rt_price('600000', max_age=0)
+            mock_snap.assert_called_once_with('600000')
+
+
 
 class TestAccountCheckOrders(unittest.TestCase):
     """测试 Account.check_orders 方法"""
@@ -770,6 +969,88 @@ class TestAccountCheckOrders(unittest.TestCase):
 
                 # 交易记录应该被移除
                 self.assertEqual(len(self.account.trading_records), 0)
+                self.assertIsNone(self.account.trading_records.get(('600000', 'B', 'ORDER001')))
+
+    @patch('pyphon.accounts.datetime')
+    def test_check_orders_remove_unfilled_records(self, mock_datetime):
+        """测试已撤和废单没有成交时也移除交易记录, 不再快速轮询"""
+        mock_datetime.now.return_value.strftime.return_value = '2025-01-15'
+        self.account.trading_records = [
+            {'code': '600000', 'tradeType': 'B', 'sid': 'ORDER001'},
+            {'code': '000001', 'tradeType': 'S', 'sid': 'ORDER002'},
+            {'code': '300750', 'tradeType': 'B', 'sid': 'ORDER003'}
+        ]
+        orders = [
+            {'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtzt': '已撤', 'Cjjg': '0', 'Cjsl': '0', 'Wtbh': 'ORDER001', 'Zqmc': '浦发银行'},
+            {'Zqdm': '000001', 'Mmsm': '证券卖出', 'Wtzt': '废单', 'Cjjg': '0', 'Cjsl': '0', 'Wtbh': 'ORDER002', 'Zqmc': '平安银行'},
+            {'Zqdm': '300750', 'Mmsm': '证券买入', 'Wtzt': '已报', 'Cjjg': '0', 'Cjsl': '0', 'Wtbh': 'ORDER003', 'Zqmc': '宁德时代'}
+        ]
+
+        with patch.object(self.account, 'get_orders', return_value=orders):
+            with patch.object(self.account, 'extend_stock_buydetail') as mock_extend:
+                result = self.account.check_orders()
+
+        self.assertEqual(result, {})
+        mock_extend.assert_not_called()
+        self.assertEqual([r['sid'] for r in self.account.pending_orders()], ['ORDER003'])
+
+    @patch('pyphon.accounts.datetime')
+    @patch('pyphon.accounts.delay_seconds')
+    def test_check_orders_without_sid(self, mock_delay_seconds, mock_datetime):
+        """测试没有委托编号的成交重复轮询时不会重复记录"""
+        mock_datetime.now.return_value.strftime.return_value = '2025-01-15'
+        mock_delay_seconds.return_value = 3600
+        orders = [{'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtzt': '已成', 'Cjjg': '12.50', 'Cjsl': '100', 'Wtsj': '093001', 'Zqmc': '浦发银行'}]
+
+        with patch.object(self.account, 'get_orders', side_effect=lambda: [dict(o) for o in orders]):
+            with patch.object(self.account, 'extend_stock_buydetail') as mock_extend:
+                for _ in range(3):
+                    result = self.account.check_orders()
+        self.assertEqual(mock_extend.call_count, 1)
+        self.assertEqual(len(self.account.order_deals), 1)
+        self.assertEqual(len(result['600000']), 1)
+
+
+    @patch('pyphon.accounts.datetime')
+    @patch('pyphon.accounts.delay_seconds')
+    def test_check_orders_only_changed_orders(self, mock_delay_seconds, mock_datetime):
+        """测试重复轮询只处理状态有变化的委托, 返回当日全部成交"""
+        mock_datetime.now.return_value.strftime.return_value = '2025-01-15'
+        mock_delay_seconds.return_value = 3600
+
+        order1 = {'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtzt': '已成', 'Cjjg': '12.50', 'Cjsl': '100', 'Wtbh': 'ORDER001', 'Zqmc': '浦发银行'}
+        order2 = {'Zqdm': '000001', 'Mmsm': '证券卖出', 'Wtzt': '部成', 'Cjjg': '10.80', 'Cjsl': '100', 'Wtbh': 'ORDER002', 'Zqmc': '平安银行'}
+
+        with patch.object(self.account, 'extend_stock_buydetail') as mock_extend:
+            with patch.object(self.account, 'get_orders', return_value=[order1, order2]):
+                result = self.account.check_orders()
+                self.assertEqual(list(result.keys()), ['600000'])
+                result = self.account.check_orders()
+                self.assertEqual(list(result.keys()), ['600000'])
+            self.assertEqual(mock_extend.call_count, 1)
+
+            order2 = {**order2, 'Wtzt': '已成', 'Cjsl': '200'}
+            with patch.object(self.account, 'get_orders', return_value=[order1, order2]):
+                result = self.account.check_orders()
+            self.assertEqual(mock_extend.call_count, 2)
+            mock_extend.assert_called_with('000001', unittest.mock.ANY)
+            self.assertEqual(result['000001'][0]['count'], 200)
+            self.assertEqual(len(result['600000']), 1)
+            self.assertIs(self.account.today_deals, result)
+
+    @patch('pyphon.accounts.datetime')
+    def test_check_orders_reset_on_new_day(self, mock_datetime):
+        """测试跨日后重新处理委托"""
+        mock_datetime.now.return_value.strftime.return_value = '2025-01-15'
+        orders = [{'Zqdm': '600000', 'Mmsm': '证券买入', 'Wtzt': '已成', 'Cjjg': '12.50', 'Cjsl': '100', 'Wtbh': 'ORDER001', 'Zqmc': '浦发银行'}]
+
+        with patch.object(self.account, 'get_orders', return_value=orders):
+            with patch.object(self.account, 'extend_stock_buydetail') as mock_extend:
+                self.account.check_orders()
+                mock_datetime.now.return_value.strftime.return_value = '2025-01-16'
+                result = self.account.check_orders()
+                self.assertEqual(mock_extend.call_count, 2)
+                self.assertEqual(result['600000'][0]['time'], '2025-01-16')
 
 
 class TestAccountArchiveDeals(unittest.TestCase):
@@ -916,6 +1197,35 @@ class TestAccountGetHistoryDeals(unittest.TestCase):
                 self.assertIn('qqhs', data)
                 self.assertIn('dwc', data)
 
+    @patch('pyphon.accounts.datetime')
+    def test_get_history_deals_concurrent_order(self, mock_datetime):
+        """测试并发查询各时间段时结果仍按时间段顺序返回"""
+        mock_datetime.now.return_value = datetime(2025, 1, 15)
+        mock_datetime.strptime = datetime.strptime
+
+        later_done = []
+        release = threading.Event()
+        released = []
+
+        def fetch(url, data):
+            if data['st'] == '2024-01-01':
+                # 最早的时间段等其他两个时间段返回后才返回, 顺序执行时会等待超时
+                released.append(release.wait(2))
+            else:
+                later_done.append(data['st'])
+                if len(later_done) >= 2:
+                    release.set()
+            return [{'st': data['st']}]
+
+        with patch.object(self.account, 'fetch_batches_deal_data', side_effect=fetch) as mock_fetch:
+            result = self.account.get_history_deals('http://test.com', '2024-01-01')
+
+            self.assertGreater(mock_fetch.call_count, 2)
+            self.assertEqual(released, [True])
+            starts = [r['st'] for r in result]
+            self.assertEqual(starts, sorted(starts))
+            self.assertEqual(list(self.account.get_history_deals('http://test.com', '2024-01-01', stream=True)), result)
+
     def test_get_deal_time_normal(self):
         """测试正常的时间格式转换"""
         result = self.account.get_deal_time('20250115', '143000')
@@ -1524,6 +1834,115 @@ class TestTrackingAccountMethods(unittest.TestCase):
             mock_extend.assert_called_once()
 
 
+
+class TestInitTrackAccounts(unittest.TestCase):
+    """测试并发加载跟踪账户关注股票"""
+
+    def setUp(self):
+        self.saved = (accld.fha, accld.track_accounts, accld.all_accounts)
+        accld.fha = {'server': 'http://fha.test/', 'headers': {'Authorization': 'Basic x'}}
+        accld.track_accounts = []
+        accld.all_accounts = {}
+
+    def tearDown(self):
+        accld.fha, accld.track_accounts, accld.all_accounts = self.saved
+
+    def mock_get(self, url, **kwargs):
+        rsp = MagicMock()
+        if 'userbind' in url:
+            rsp.json.return_value = [
+                {'name': 'track1', 'realcash': 0},
+                {'username': 'u.track2', 'realcash': 0},
+                {'name': 'real', 'realcash': 1}
+            ]
+            return rsp
+        # 两个跟踪账户的请求同时进行时才能通过, 顺序查询时超时失败
+        self.barrier.wait()
+        acc = url.split('acc=')[1]
+        if acc == 'track2':
+            raise ConnectionError('timeout')
+        rsp.json.return_value = {'SH600000': {'strategies': {'grptype': 'GroupStandard', 'strategies': {}}}}
+        return rsp
+
+    def test_init_track_accounts_concurrent(self):
+        """测试并发查询, 单个账户失败不影响其他账户"""
+        self.barrier = threading.Barrier(2, timeout=2)
+        with patch('pyphon.accounts.transport.get', side_effect=self.mock_get):
+            accld.init_track_accounts()
+
+        self.assertFalse(self.barrier.broken)
+        self.assertEqual([a.keyword for a in accld.track_accounts], ['track1', 'track2'])
+        self.assertIsNotNone(accld.all_accounts['track1'].get_stock('600000'))
+        self.assertEqual(len(accld.all_accounts['track2'].stocks), 0)
+
+
+class TestAccountLoader(unittest.TestCase):
+    """测试多个登录的账户相互独立"""
+
+    def setUp(self):
+        self.loader = AccountLoader.register(AccountLoader('second'))
+        self.loader.enable_credit = True
+        self.loader.jywg = MagicMock()
+        self.loader.jywg.validate_key = 'second_key'
+
+    def tearDown(self):
+        AccountLoader.unregister(self.loader)
+
+    def test_accounts_bound_to_loader(self):
+        """测试账户使用所属登录的会话, 本地存储标识带登录名"""
+        self.loader.create_accounts()
+        self.assertIs(AccountLoader.get('second'), self.loader)
+        self.assertIs(AccountLoader.get(), accld)
+        self.assertEqual(set(self.loader.all_accounts), {'normal', 'collat', 'credit'})
+        self.assertNotIn(self.loader.normal_account, accld.all_accounts.values())
+
+        credit = self.loader.credit_account
+        self.assertIs(credit.loader, self.loader)
+        self.assertEqual(credit.valkey, 'second_key')
+        self.assertEqual(credit.uid, 'second/credit')
+        self.assertEqual(NormalAccount().uid, 'normal')
+
+    def test_order_signal_per_loader(self):
+        """测试各登录的委托通知互不影响"""
+        accld.order_signal.clear()
+        self.loader.order_signal.set()
+        self.assertFalse(accld.order_signal.is_set())
+        self.loader.order_signal.clear()
+
+    def test_only_registered_loaders(self):
+        """测试只有注册的登录记录在loaders中, 同名登录被替换"""
+        other = AccountLoader('other')
+        self.assertNotIn(other, AccountLoader.loaders)
+        second = AccountLoader.register(AccountLoader('second'))
+        self.assertIs(AccountLoader.get('second'), second)
+        self.assertEqual(len([ld for ld in AccountLoader.loaders if ld.name == 'second']), 1)
+        AccountLoader.unregister(second)
+
+class TestTradeBatch(unittest.TestCase):
+    """测试批量下单一次获取行情"""
+
+    def setUp(self):
+        self.loader = AccountLoader('batch')
+        self.account = self.loader.add_account(NormalAccount())
+        self.account.trade = MagicMock()
+
+    @patch('pyphon.accounts.get_rt_price')
+    @patch('pyphon.accounts.get_rt_prices')
+    def test_market_orders_share_one_quote_request(self, mock_prices, mock_price):
+        """测试市价委托的行情批量获取并传给各委托"""
+        rps = {c: {'price': 10.0, 'ask5': 10.1, 'bid5': 9.9, 'top_price': 11.0, 'bottom_price': 9.0} for c in ('600000', '000001')}
+        mock_prices.return_value = rps
+        self.loader.trade_batch([
+            {'code': '600000', 'price': 0, 'count': 100, 'account': 'normal', 'tradeType': 'B'},
+            {'code': '000001', 'price': 0, 'count': 100, 'account': 'normal', 'tradeType': 'S'},
+            {'code': '300750', 'price': 20.0, 'count': 100, 'account': 'normal', 'tradeType': 'B'}
+        ])
+        mock_prices.assert_called_once_with(['600000', '000001'])
+        mock_price.assert_not_called()
+        self.assertEqual(self.account.trade.call_args_list[0][0], ('600000', 0, 100, 'B', rps['600000']))
+        self.assertEqual(self.account.trade.call_args_list[1][0], ('000001', 0, 100, 'S', rps['000001']))
+        self.assertEqual(self.account.trade.call_args_list[2][0], ('300750', 20.0, 100, 'B', None))
+
 if __name__ == '__main__':
     unittest.main()
     # suite = unittest.TestSuite()
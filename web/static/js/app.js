@@ -5,6 +5,9 @@ class EMTraderApp {
     this.systemStatus = "connecting";
     this.accounts = [];
     this.refreshInterval = null;
+    this.eventSource = null;
+    this.state = null;
+    this.renderTimer = null;
     this.init();
   }
 
@@ -12,7 +15,7 @@ class EMTraderApp {
   init() {
     this.bindEvents();
     this.loadSystemStatus();
-    this.startAutoRefresh();
+    this.connectEvents();
   }
 
   // 绑定事件
@@ -220,6 +223,9 @@ class EMTraderApp {
 
   // 开始自动刷新
   startAutoRefresh() {
+    if (this.refreshInterval) {
+      return;
+    }
     this.refreshInterval = setInterval(() => {
       this.loadSystemStatus();
       if (this.currentTab === "dashboard") {
@@ -228,8 +234,151 @@ class EMTraderApp {
     }, 30000); // 30秒刷新一次
   }
 
+  // 停止自动刷新
+  stopAutoRefresh() {
+    if (this.refreshInterval) {
+      clearInterval(this.refreshInterval);
+      this.refreshInterval = null;
+    }
+  }
+
+  // 订阅服务器推送, 不支持或连接断开时退回定时刷新
+  connectEvents() {
+    if (!window.EventSource) {
+      this.startAutoRefresh();
+      return;
+    }
+
+    const source = new EventSource("/events");
+    source.addEventListener("snapshot", (e) => {
+      this.applySnapshot(JSON.parse(e.data));
+    });
+    ["status", "positions", "assets", "deals", "quote"].forEach((type) => {
+      source.addEventListener(type, (e) => {
+        this.applyEvent(type, JSON.parse(e.data));
+      });
+    });
+    source.onopen = () => {
+      this.stopAutoRefresh();
+    };
+    source.onerror = () => {
+      // EventSource会自动重连, 重连后重新推送完整状态, 断开期间定时刷新
+      this.state = null;
+      this.startAutoRefresh();
+    };
+    this.eventSource = source;
+  }
+
+  // 使用推送的完整状态
+  applySnapshot(snap) {
+    this.state = {
+      stocks: snap.stocks || {},
+      assets: snap.assets || {},
+      deals: snap.deals || {},
+    };
+    if (snap.status) {
+      this.updateSystemStatus(snap.status);
+    }
+    this.stopAutoRefresh();
+    this.scheduleRender();
+  }
+
+  // 合并推送的增量事件
+  applyEvent(type, data) {
+    if (type === "status") {
+      this.updateSystemStatus(data);
+      return;
+    }
+    if (!this.state) {
+      return;
+    }
+
+    const account = data.account;
+    switch (type) {
+      case "positions": {
+        const entry = (this.state.stocks[account] ||= { account, stocks: [] });
+        const old = new Map(entry.stocks.map((s) => [s.code, s]));
+        data.stocks.forEach((s) => old.set(s.code, { ...old.get(s.code), ...s }));
+        entry.stocks = data.full
+          ? data.stocks.map((s) => old.get(s.code))
+          : Array.from(old.values());
+        break;
+      }
+      case "assets":
+        this.state.assets[account] = { account, assets: data.assets };
+        break;
+      case "deals": {
+        const entry = (this.state.deals[account] ||= { account, deals: {} });
+        entry.deals ||= {};
+        Object.entries(data.deals).forEach(([code, deals]) => {
+          const merged = (entry.deals[code] ||= []);
+          deals.forEach((deal) => {
+            if (!merged.some((d) => d.sid === deal.sid)) {
+              merged.push(deal);
+            }
+          });
+        });
+        break;
+      }
+      case "quote":
+        Object.values(this.state.stocks).forEach((entry) => {
+          (entry.stocks || []).forEach((stock) => {
+            if (stock.code === data.code) {
+              stock.latestPrice = data.price;
+            }
+          });
+        });
+        break;
+    }
+    this.scheduleRender();
+  }
+
+  // 合并短时间内的多个事件后再更新页面
+  scheduleRender() {
+    if (this.renderTimer) {
+      return;
+    }
+    this.renderTimer = setTimeout(() => {
+      this.renderTimer = null;
+      this.renderState();
+    }, 200);
+  }
+
+  // 用推送的状态更新当前页面
+  renderState() {
+    if (!this.state) {
+      return;
+    }
+    const { stocks, assets, deals } = this.state;
+    switch (this.currentTab) {
+      case "dashboard":
+        this.updateDashboard(
+          this.accounts.map((account) => [
+            stocks[account] || { account, stocks: [] },
+            assets[account] || {},
+          ])
+        );
+        this.renderRecentTrades(this.accounts.map((account) => deals[account] || {}));
+        break;
+      case "positions": {
+        const account = document.querySelector("#positionAccount").value;
+        this.updatePositionsTable((stocks[account] || {}).stocks || []);
+        break;
+      }
+      case "orders": {
+        const account = document.querySelector("#orderAccount").value;
+        this.updateOrdersTable((deals[account] || {}).deals || {});
+        break;
+      }
+    }
+  }
+
   // 加载概览数据
   async loadDashboard() {
+    if (this.state) {
+      this.renderState();
+      return;
+    }
     try {
       // 加载账户信息和资产信息
       const accountPromises = this.accounts.map((account) =>
@@ -241,6 +390,8 @@ class EMTraderApp {
       const accountsData = await Promise.all(accountPromises);
 
       this.updateDashboard(accountsData);
+      // 加载最近交易
+      this.loadRecentTrades();
     } catch (error) {
       console.error("加载概览失败:", error);
     }
@@ -293,9 +444,6 @@ class EMTraderApp {
       this.formatMoney(availableMoney);
     document.getElementById("positionValue").textContent =
       this.formatMoney(positionValue);
-
-    // 加载最近交易
-    this.loadRecentTrades();
   }
 
   // 加载最近交易
@@ -305,41 +453,45 @@ class EMTraderApp {
         this.apiRequest(`/deals?account=${account}`)
       );
       const tradesData = await Promise.all(tradesPromises);
+      this.renderRecentTrades(tradesData);
+    } catch (error) {
+      console.error("加载交易记录失败:", error);
+    }
+  }
 
-      const recentTrades = document.getElementById("recentTrades");
-      recentTrades.innerHTML = "";
-
-      tradesData.forEach((data) => {
-        if (data.deals && Object.keys(data.deals).length > 0) {
-          Object.entries(data.deals).forEach(([code, deals]) => {
-            deals.forEach((deal) => {
-              const tradeDiv = document.createElement("div");
-              tradeDiv.className = "trade-item";
-              tradeDiv.innerHTML = `
-                                <span>${deal.time}</span>
-                                <span>${code}</span>
-                                <span class="${
-                                  deal.tradeType === "B"
-                                    ? "text-success"
-                                    : "text-danger"
-                                }">
-                                    ${deal.tradeType === "B" ? "买入" : "卖出"}
-                                </span>
-                                <span>¥${deal.price}</span>
-                                <span>${deal.count}股</span>
-                            `;
-              recentTrades.appendChild(tradeDiv);
-            });
+  // 更新最近交易显示
+  renderRecentTrades(tradesData) {
+    const recentTrades = document.getElementById("recentTrades");
+    recentTrades.innerHTML = "";
+
+    tradesData.forEach((data) => {
+      if (data.deals && Object.keys(data.deals).length > 0) {
+        Object.entries(data.deals).forEach(([code, deals]) => {
+          deals.forEach((deal) => {
+            const tradeDiv = document.createElement("div");
+            tradeDiv.className = "trade-item";
+            tradeDiv.innerHTML = `
+                              <span>${deal.time}</span>
+                              <span>${code}</span>
+                              <span class="${
+                                deal.tradeType === "B"
+                                  ? "text-success"
+                                  : "text-danger"
+                              }">
+                                  ${deal.tradeType === "B" ? "买入" : "卖出"}
+                              </span>
+                              <span>¥${deal.price}</span>
+                              <span>${deal.count}股</span>
+                          `;
+            recentTrades.appendChild(tradeDiv);
           });
-        }
-      });
-
-      if (recentTrades.children.length === 0) {
-        recentTrades.innerHTML =
-          '<div class="text-muted text-center">暂无交易记录</div>';
+        });
       }
-    } catch (error) {
-      console.error("加载交易记录失败:", error);
+    });
+
+    if (recentTrades.children.length === 0) {
+      recentTrades.innerHTML =
+        '<div class="text-muted text-center">暂无交易记录</div>';
     }
   }
 
@@ -396,6 +548,10 @@ class EMTraderApp {
     if (!account) {
         account = document.querySelector('#positionAccount').value;
     }
+    if (this.state && this.state.stocks[account]) {
+      this.updatePositionsTable(this.state.stocks[account].stocks || []);
+      return;
+    }
     this.showLoading();
     try {
       const data = await this.apiRequest(`/stocks?account=${account}`);
@@ -460,6 +616,10 @@ class EMTraderApp {
     if (!account) {
         account = document.querySelector("#orderAccount").value;
     }
+    if (this.state && this.state.deals[account]) {
+      this.updateOrdersTable(this.state.deals[account].deals || {});
+      return;
+    }
     this.showLoading();
     try {
       const data = await this.apiRequest(`/deals?account=${account}`);